@@ -0,0 +1,96 @@
+"""Benchmark: contract.py decoders against the decoders generated from the ABIs
+in isaac_api.decoders
+
+For every event, times the contract.py decoder followed by the `to_json ()`
+calls the handlers made on its result, against the generated decoder (plus
+`dynamics_to_json` for forward_world) on the event's list of felts and on one
+contiguous buffer:
+
+    poetry run python benchmarks/bench_decoders.py
+    poetry run python benchmarks/bench_decoders.py --repeat 200000
+"""
+
+import timeit
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+from isaac_api import contract, decoders
+from isaac_api.felts import dynamics_to_json, extract_counter
+
+SCALE = 10**20
+GRID = [12, 34]
+PLAYERS = [0xaaa, 0xbbb, 0xccc]
+
+
+def _felt (value):
+    return (value % contract.STARK_PRIME).to_bytes (32, 'big')
+
+
+# event name => (sample payload, handler-side conversion of the contract.py result)
+EVENTS = {
+    'forward_world':                                    ([1] + [int ((i - 8) * 1.5 * SCALE) for i in range (16)] + [3 * SCALE],
+                                                         lambda r: (r[0].to_json (), r[1])),
+    'give_undeployed_fungible_device_occurred':         ([1, 0xaaa, 12, 10], None),
+    'activate_universe_occurred':                       ([1, 4], None),
+    'terminate_universe_occurred':                      ([1, 1, 2, 0, 0], None),
+    'player_deploy_device_occurred':                    ([1, 0xaaa, 100] + GRID, lambda r: (r[0], r[1], r[2].to_json ())),
+    'player_pickup_device_occurred':                    ([1, 0xaaa, 100] + GRID, lambda r: (r[0], r[1], r[2].to_json ())),
+    'player_deploy_utx_occurred':                       ([1, 0xaaa, 500, 12, 5, 5, 10, 10, 4, 6, 5, 7, 5, 8, 5, 9, 5],
+                                                         lambda r: r[:3] + (r[3].to_json (), r[4].to_json ()) + r[5:]),
+    'player_pickup_utx_occurred':                       ([1, 0xaaa] + GRID, lambda r: (r[0], r[1].to_json ())),
+    'resource_update_at_harvester_occurred':            ([1, 100, 6], None),
+    'resource_update_at_transformer_occurred':          ([1, 103, 1, 2], None),
+    'resource_update_at_upsf_occurred':                 ([1, 101, 3, 9], None),
+    'energy_update_at_device_occurred':                 ([1, 100, 7], None),
+    'impulse_applied_occurred':                         ([3 * SCALE, -4 * SCALE], lambda r: r.to_json ()),
+    'player_transfer_undeployed_fungible_device_occurred':    ([1, 0xaaa, 0xbbb, 12, 2], None),
+    'player_transfer_undeployed_nonfungible_device_occurred': ([1, 0xaaa, 0xbbb, 100], None),
+    'player_upsf_build_fungible_device_occurred':       ([1, 0xaaa] + GRID + [3, 2], lambda r: (r[0], r[1].to_json ()) + r[2:]),
+    'create_new_nonfungible_device_occurred':           ([1, 0xaaa, 14, 101], None),
+    'universe_activation_occurred':                     ([1, 777, 0x666, len (PLAYERS)] + PLAYERS, None),
+    'universe_deactivation_occurred':                   ([1, 777, 0x666, len (PLAYERS)] + PLAYERS, None),
+    'ask_to_queue_occurred':                            ([1, 0xaaa, 2], None),
+    'give_invitation_occurred':                         ([1, 0xaaa], None),
+}
+
+
+def _contract_decoder (name):
+    if name == 'forward_world':
+        return contract.decode_forward_world_event
+    return getattr (contract, f'decode_{name}_event')
+
+
+def _time (fn, repeat):
+    return min (timeit.repeat (fn, number = repeat, repeat = 3)) / repeat * 1e6
+
+
+def main ():
+    parser = ArgumentParser ()
+    parser.add_argument ('--repeat', type = int, default = 50_000)
+    args = parser.parse_args ()
+
+    print (f"{'event':<58} {'contract':>9} {'generated':>9} {'buffer':>9} {'speedup':>8}   (us/event)")
+    for name, (payload, to_json) in EVENTS.items():
+        data = [_felt (v) for v in payload]
+        buffer = b''.join (data)
+        event = SimpleNamespace (data = data)
+        decode = _contract_decoder (name)
+        generated = decoders.DECODERS [name if name != 'forward_world' else 'forward_world_macro_occurred']
+        if name == 'forward_world':
+            # the handler stores the nested dynamics dict
+            generated = lambda d, decode_flat = generated: (lambda r: (dynamics_to_json (r[0]), r[1])) (decode_flat (d))
+        convert = to_json or (lambda r: r)
+
+        t_contract = _time (lambda: convert (decode (event)), args.repeat)
+        t_generated = _time (lambda: generated (data), args.repeat)
+        t_buffer = _time (lambda: generated (buffer), args.repeat)
+        print (f'{name:<58} {t_contract:>9.2f} {t_generated:>9.2f} {t_buffer:>9.2f} {t_contract / t_generated:>7.1f}x')
+
+    data = [_felt (v) for v in EVENTS ['forward_world'][0]]
+    t_counter = _time (lambda: contract.extract_counter_from_event (SimpleNamespace (data = data)), args.repeat)
+    t_fast_counter = _time (lambda: extract_counter (data), args.repeat)
+    print (f"{'extract_counter':<58} {t_counter:>9.2f} {t_fast_counter:>9.2f} {'':>9} {t_counter / t_fast_counter:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,354 @@
+"""Synthetic isaac blocks for load testing the indexer
+
+`SyntheticChain` plays the life of one civilization per universe: players
+queue in the lobby, receive UTX devices and their own devices, the universe is
+activated and then advances one `forward_world_macro_occurred` per block while
+players deploy, pick up, tether and trade devices and the devices report
+resource and energy updates. The last block terminates and deactivates every
+universe. All 21 events the indexer subscribes to are produced, with the felt
+layouts of the contracts.
+
+Universe 0 uses the configured universe address; further universes get
+synthetic addresses, registered in `ISAAC_UNIVERSE_ADDRESSES` by `register`.
+"""
+
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+from apibara.model import BlockHeader, NewEvents, StarkNetEvent
+
+from isaac_api.contract import STARK_PRIME
+from isaac_api.indexer import (
+    ISAAC_UNIVERSE_ADDRESSES,
+    ISAAC_LOBBY_ADDRESS,
+    HARVESTER_TYPES,
+    TRANSFORMER_TYPES,
+    UPSF_TYPE,
+    UTX_TYPES,
+)
+
+SCALE_FP = 10**20
+
+# device types handed out round-robin to each player
+DEVICE_TYPES = [0, 2, 7, 14, 15, 1, 3, 8, 4, 9, 5, 10, 6, 11]
+
+# relative frequency of the events a universe emits besides forward_world_macro_occurred
+WEIGHTS = {
+    'energy_update_at_device_occurred':                        30,
+    'resource_update_at_harvester_occurred':                   15,
+    'resource_update_at_transformer_occurred':                 10,
+    'resource_update_at_upsf_occurred':                        5,
+    'player_deploy_utx_occurred':                              6,
+    'player_pickup_utx_occurred':                              4,
+    'player_deploy_device_occurred':                           3,
+    'player_pickup_device_occurred':                           3,
+    'impulse_applied_occurred':                                2,
+    'player_transfer_undeployed_fungible_device_occurred':     2,
+    'player_transfer_undeployed_nonfungible_device_occurred':  1,
+    'player_upsf_build_fungible_device_occurred':              2,
+    'create_new_nonfungible_device_occurred':                  1,
+    'give_undeployed_fungible_device_occurred':                1,
+    'give_invitation_occurred':                                1,
+    'ask_to_queue_occurred':                                   1,
+}
+
+
+@dataclass
+class LoadProfile:
+    universes: int = 1
+    players: int = 3
+    devices_per_player: int = 8
+    utx_density: int = 4          # cells per UTX set
+    events_per_block: int = 20    # per universe, besides forward_world_macro_occurred
+    blocks: int = 200
+    seed: int = 0
+
+
+def universe_address (univ: int) -> str:
+    if univ in ISAAC_UNIVERSE_ADDRESSES:
+        return ISAAC_UNIVERSE_ADDRESSES [univ]
+    return '0x' + (0x15AAC0000 + univ).to_bytes (32, 'big').hex ()
+
+
+def register (profile: LoadProfile):
+    """Make the indexer recognise the synthetic universe addresses."""
+    for univ in range (profile.universes):
+        ISAAC_UNIVERSE_ADDRESSES.setdefault (univ, universe_address (univ))
+
+
+def _felt (value: int) -> bytes:
+    return (value % STARK_PRIME).to_bytes (32, 'big')
+
+
+def _address (hex_address: str) -> bytes:
+    return int (hex_address, 16).to_bytes (32, 'big')
+
+
+@dataclass
+class _Device:
+    id: int
+    type: int
+    owner: int
+    grid: tuple
+    deployed: bool = False
+
+
+@dataclass
+class _Universe:
+    index: int
+    address: bytes
+    players: List[int]
+    counter: int = 0
+    devices: List[_Device] = field (default_factory = list)
+    utx_sets: Dict[int, tuple] = field (default_factory = dict)   # label => (owner, type, cells)
+    balances: Dict[int, Dict[int, int]] = field (default_factory = dict)
+    phi: int = 0
+
+
+class SyntheticChain:
+    def __init__ (self, profile: LoadProfile) -> None:
+        self.profile = profile
+        self._random = random.Random (profile.seed)
+        self._lobby = _address (ISAAC_LOBBY_ADDRESS)
+        self._lobby_counter = 0
+        self._next_id = 1000
+        self._next_account = 0xA000
+        self._queue_idx = 0
+        self._utx_row = 0
+        self._names = list (WEIGHTS)
+        self._weights = list (WEIGHTS.values())
+        self.universes = [
+            _Universe (
+                index   = univ,
+                address = _address (universe_address (univ)),
+                players = [self._account () for _ in range (profile.players)],
+            )
+            for univ in range (profile.universes)
+        ]
+
+    def blocks (self, start_block: int = 1) -> Iterator[NewEvents]:
+        timestamp = datetime (2022, 11, 1, tzinfo = timezone.utc)
+        for i in range (self.profile.blocks):
+            number = start_block + i
+            if i == 0:
+                events = self._setup ()
+            elif i == 1:
+                events = self._activate ()
+            elif i == self.profile.blocks - 1:
+                events = self._deactivate ()
+            else:
+                events = self._steady ()
+            yield NewEvents (
+                block = BlockHeader (
+                    hash        = _felt (number),
+                    parent_hash = _felt (number - 1),
+                    number      = number,
+                    timestamp   = timestamp + timedelta (seconds = 30 * i),
+                ),
+                events = events,
+            )
+
+    #
+    # Lifecycle
+    #
+    def _setup (self) -> List[StarkNetEvent]:
+        events = []
+        for u in self.universes:
+            for player in u.players:
+                events.append (self._lobby_event ('ask_to_queue_occurred', player, self._next_queue_idx ()))
+                for utx_type in UTX_TYPES:
+                    events.append (self._give (u, player, utx_type, 40 * self.profile.utx_density))
+                for k in range (self.profile.devices_per_player):
+                    events.append (self._create (u, player, DEVICE_TYPES [k % len (DEVICE_TYPES)]))
+        return events
+
+    def _activate (self) -> List[StarkNetEvent]:
+        events = []
+        for civ_idx, u in enumerate (self.universes):
+            events.append (self._lobby_event (
+                'universe_activation_occurred', 777 + u.index, int.from_bytes (u.address, 'big'), len (u.players), *u.players
+            ))
+            events.append (self._event (u, 'activate_universe_occurred', civ_idx))
+            # three quarters of the devices start deployed
+            for device in u.devices [:len (u.devices) * 3 // 4]:
+                events.append (self._deploy (u, device))
+            events.append (self._forward (u))
+        return events
+
+    def _steady (self) -> List[StarkNetEvent]:
+        events = []
+        for u in self.universes:
+            events.append (self._forward (u))
+            for name in self._random.choices (self._names, self._weights, k = self.profile.events_per_block):
+                event = getattr (self, '_' + name) (u) or self._energy_update_at_device_occurred (u)
+                if event is not None:
+                    events.append (event)
+        return events
+
+    def _deactivate (self) -> List[StarkNetEvent]:
+        events = []
+        for u in self.universes:
+            events.append (self._event (u, 'terminate_universe_occurred', 1, 1, 0, 0))
+            events.append (self._lobby_event (
+                'universe_deactivation_occurred', 777 + u.index, int.from_bytes (u.address, 'big'), len (u.players), *u.players
+            ))
+        return events
+
+    #
+    # Events
+    #
+    def _event (self, u: _Universe, name: str, *values: int) -> StarkNetEvent:
+        u.counter += 1
+        return StarkNetEvent (name = name, address = u.address, log_index = 0, topics = [],
+                              data = [_felt (v) for v in (u.counter,) + values])
+
+    def _lobby_event (self, name: str, *values: int) -> StarkNetEvent:
+        self._lobby_counter += 1
+        return StarkNetEvent (name = name, address = self._lobby, log_index = 0, topics = [],
+                              data = [_felt (v) for v in (self._lobby_counter,) + values])
+
+    def _forward (self, u: _Universe) -> StarkNetEvent:
+        u.phi += 1
+        r = self._random
+        dynamics = [int (r.uniform (-50, 50) * SCALE_FP) for _ in range (16)]
+        return self._event (u, 'forward_world_macro_occurred', *dynamics, u.phi)
+
+    def _give (self, u: _Universe, player: int, device_type: int, amount: int) -> StarkNetEvent:
+        balance = u.balances.setdefault (player, {})
+        balance [device_type] = balance.get (device_type, 0) + amount
+        return self._event (u, 'give_undeployed_fungible_device_occurred', player, device_type, amount)
+
+    def _create (self, u: _Universe, owner: int, device_type: int) -> StarkNetEvent:
+        device = _Device (id = self._next_device_id (), type = device_type, owner = owner, grid = self._free_grid (u))
+        u.devices.append (device)
+        return self._event (u, 'create_new_nonfungible_device_occurred', owner, device_type, device.id)
+
+    def _deploy (self, u: _Universe, device: _Device) -> StarkNetEvent:
+        device.deployed = True
+        return self._event (u, 'player_deploy_device_occurred', device.owner, device.id, *device.grid)
+
+    def _pick (self, devices: List[_Device]) -> Optional[_Device]:
+        return self._random.choice (devices) if devices else None
+
+    def _deployed (self, u: _Universe, types = None) -> List[_Device]:
+        return [d for d in u.devices if d.deployed and (types is None or d.type in types)]
+
+    def _energy_update_at_device_occurred (self, u):
+        device = self._pick (self._deployed (u))
+        return device and self._event (u, 'energy_update_at_device_occurred', device.id, self._random.randrange (1000))
+
+    def _resource_update_at_harvester_occurred (self, u):
+        device = self._pick (self._deployed (u, HARVESTER_TYPES))
+        return device and self._event (u, 'resource_update_at_harvester_occurred', device.id, self._random.randrange (1000))
+
+    def _resource_update_at_transformer_occurred (self, u):
+        device = self._pick (self._deployed (u, TRANSFORMER_TYPES))
+        r = self._random
+        return device and self._event (u, 'resource_update_at_transformer_occurred', device.id, r.randrange (1000), r.randrange (1000))
+
+    def _resource_update_at_upsf_occurred (self, u):
+        device = self._pick (self._deployed (u, [UPSF_TYPE]))
+        r = self._random
+        return device and self._event (u, 'resource_update_at_upsf_occurred', device.id, r.randrange (16), r.randrange (1000))
+
+    def _player_deploy_utx_occurred (self, u):
+        owner = self._random.choice (u.players)
+        ends = [d for d in self._deployed (u) if d.owner == owner]
+        utx_type = self._random.choice (UTX_TYPES)
+        density = self.profile.utx_density
+        if len (ends) < 2 or u.balances [owner].get (utx_type, 0) < density:
+            return None
+        src, dst = self._random.sample (ends, 2)
+        self._utx_row += 1
+        cells = [(x, 10_000 + self._utx_row) for x in range (density)]
+        label = self._next_device_id ()
+        u.utx_sets [label] = (owner, utx_type, cells)
+        u.balances [owner][utx_type] -= density
+        return self._event (u, 'player_deploy_utx_occurred', owner, label, utx_type, *src.grid, *dst.grid,
+                            density, *[v for cell in cells for v in cell])
+
+    def _player_pickup_utx_occurred (self, u):
+        if not u.utx_sets:
+            return None
+        label = self._random.choice (list (u.utx_sets))
+        owner, utx_type, cells = u.utx_sets.pop (label)
+        u.balances [owner][utx_type] += len (cells)
+        return self._event (u, 'player_pickup_utx_occurred', owner, *self._random.choice (cells))
+
+    def _player_deploy_device_occurred (self, u):
+        device = self._pick ([d for d in u.devices if not d.deployed])
+        return device and self._deploy (u, device)
+
+    def _player_pickup_device_occurred (self, u):
+        device = self._pick (self._deployed (u))
+        if device is None:
+            return None
+        device.deployed = False
+        return self._event (u, 'player_pickup_device_occurred', device.owner, device.id, *device.grid)
+
+    def _impulse_applied_occurred (self, u):
+        # the only event without an event_counter
+        r = self._random
+        return StarkNetEvent (name = 'impulse_applied_occurred', address = u.address, log_index = 0, topics = [],
+                              data = [_felt (int (r.uniform (-1, 1) * SCALE_FP)) for _ in range (2)])
+
+    def _player_transfer_undeployed_fungible_device_occurred (self, u):
+        if len (u.players) < 2:
+            return None
+        src, dst = self._random.sample (u.players, 2)
+        utx_type = self._random.choice (UTX_TYPES)
+        if u.balances [src].get (utx_type, 0) < 1:
+            return None
+        u.balances [src][utx_type] -= 1
+        u.balances [dst][utx_type] = u.balances [dst].get (utx_type, 0) + 1
+        return self._event (u, 'player_transfer_undeployed_fungible_device_occurred', src, dst, utx_type, 1)
+
+    def _player_transfer_undeployed_nonfungible_device_occurred (self, u):
+        device = self._pick ([d for d in u.devices if not d.deployed])
+        if device is None or len (u.players) < 2:
+            return None
+        src, device.owner = device.owner, self._random.choice ([p for p in u.players if p != device.owner])
+        return self._event (u, 'player_transfer_undeployed_nonfungible_device_occurred', src, device.owner, device.id)
+
+    def _player_upsf_build_fungible_device_occurred (self, u):
+        upsf = self._pick (self._deployed (u, [UPSF_TYPE]))
+        if upsf is None:
+            return None
+        utx_type = self._random.choice (UTX_TYPES)
+        u.balances [upsf.owner][utx_type] = u.balances [upsf.owner].get (utx_type, 0) + 2
+        return self._event (u, 'player_upsf_build_fungible_device_occurred', upsf.owner, *upsf.grid, utx_type, 2)
+
+    def _create_new_nonfungible_device_occurred (self, u):
+        owner = self._random.choice (u.players)
+        return self._create (u, owner, self._random.choice (DEVICE_TYPES))
+
+    def _give_undeployed_fungible_device_occurred (self, u):
+        return self._give (u, self._random.choice (u.players), self._random.choice (UTX_TYPES), 10)
+
+    def _give_invitation_occurred (self, u):
+        return self._lobby_event ('give_invitation_occurred', self._account ())
+
+    def _ask_to_queue_occurred (self, u):
+        return self._lobby_event ('ask_to_queue_occurred', self._account (), self._next_queue_idx ())
+
+    #
+    # Identifiers
+    #
+    def _next_device_id (self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _account (self) -> int:
+        self._next_account += 1
+        return self._next_account
+
+    def _next_queue_idx (self) -> int:
+        self._queue_idx += 1
+        return self._queue_idx - 1
+
+    def _free_grid (self, u: _Universe) -> tuple:
+        # devices sit on a 6-cell lattice, apart from the UTX rows
+        n = len (u.devices)
+        return (6 * (n % 100), 6 * (n // 100))
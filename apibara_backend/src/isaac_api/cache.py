@@ -0,0 +1,250 @@
+"""Write-through in-memory universe state for the isaac indexer"""
+
+import copy
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from pymongo.database import Database
+
+from isaac_api.footprint import DeployedDevices
+from isaac_api.tethers import tethers_collection
+from isaac_api.unit_of_work import apply_update
+
+Document = Dict[str, Any]
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+def grid_key (grid: Document) -> Tuple[int, int]:
+    return (grid ['x'], grid ['y'])
+
+
+class BoundedLRU:
+    """Least-recently-used map with a size bound and hit/miss counters."""
+
+    def __init__ (self, max_entries: int) -> None:
+        self._entries: OrderedDict = OrderedDict ()
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get (self, key) -> Optional[Any]:
+        value = self._entries.get (key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end (key)
+        self.hits += 1
+        return value
+
+    def peek (self, key) -> Optional[Any]:
+        return self._entries.get (key)
+
+    def put (self, key, value):
+        self._entries [key] = value
+        self._entries.move_to_end (key)
+        while len (self._entries) > self._max_entries:
+            self._entries.popitem (last=False)
+            self.evictions += 1
+
+    def pop (self, key):
+        return self._entries.pop (key, None)
+
+    def clear (self):
+        self._entries.clear ()
+
+    def values (self) -> Iterable[Any]:
+        return self._entries.values ()
+
+    def __len__ (self) -> int:
+        return len (self._entries)
+
+
+class UniverseState:
+    """Current players, devices, balances and utx sets of one universe.
+
+    A miss never means "absent": entries may have been evicted, so callers
+    fall back to storage and put the result back.
+    """
+
+    def __init__ (self, max_entries: int) -> None:
+        self.balances = BoundedLRU (max_entries)   # account => u{univ}_player_fungible_balances document
+        self.devices = BoundedLRU (max_entries)    # device id => {owner, type, is_deployed}
+        self.deployed = BoundedLRU (max_entries)   # device id or utx label => {owner, type, base_grid, cells}
+        self.grid = BoundedLRU (max_entries)       # (x, y) => deployed device id or utx label
+        self.utx_sets = BoundedLRU (max_entries)   # utx label => u{univ}_deployed_utx_sets document
+        self.tethers = BoundedLRU (max_entries)    # device id => set of utx labels tethered to it
+        self.tether_ends = BoundedLRU (max_entries)  # utx label => device ids it is tethered to
+        self.latest_macro_state: Optional[Document] = None  # most recent u{univ}_macro_states document
+
+    def maps (self) -> Dict[str, BoundedLRU]:
+        return {
+            'balances' : self.balances,
+            'devices'  : self.devices,
+            'deployed' : self.deployed,
+            'grid'     : self.grid,
+            'utx_sets' : self.utx_sets,
+            'tethers'  : self.tethers,
+        }
+
+    #
+    # Balances
+    #
+    def put_balance (self, account: str, doc: Document):
+        self.balances.put (account, _strip (doc))
+
+    def update_balance (self, account: str, update: Document):
+        doc = self.balances.peek (account)
+        if doc is not None:
+            apply_update (doc, update)
+
+    #
+    # Non-fungible devices
+    #
+    def put_device (self, device_id: str, owner: str, device_type: int, is_deployed: bool):
+        self.devices.put (device_id, {'owner': owner, 'type': device_type, 'is_deployed': is_deployed})
+
+    def update_device (self, device_id: str, **fields):
+        doc = self.devices.peek (device_id)
+        if doc is not None:
+            doc.update (fields)
+
+    #
+    # Deployed devices and utx
+    #
+    def put_deployed (self, device_id: str, owner: str, device_type: str, base_grid: Optional[Document], cells: list):
+        self.deployed.put (device_id, {
+            'owner'     : owner,
+            'type'      : device_type,
+            'base_grid' : base_grid,
+            'cells'     : [dict (cell) for cell in cells],
+        })
+        for cell in cells:
+            self.grid.put (grid_key (cell), device_id)
+
+    def remove_deployed (self, device_id: str):
+        entry = self.deployed.pop (device_id)
+        if entry is None:
+            return
+        for cell in entry ['cells']:
+            if self.grid.peek (grid_key (cell)) == device_id:
+                self.grid.pop (grid_key (cell))
+
+    def deployed_at (self, grid: Document) -> Optional[Tuple[str, Document]]:
+        device_id = self.grid.get (grid_key (grid))
+        if device_id is None:
+            return None
+        entry = self.deployed.get (device_id)
+        if entry is None:
+            return None
+        return device_id, entry
+
+    #
+    # Utx sets
+    #
+    def put_utx_set (self, label: str, doc: Document):
+        self.utx_sets.put (label, _strip (doc))
+
+    def update_utx_set (self, label: str, update: Document):
+        doc = self.utx_sets.peek (label)
+        if doc is not None:
+            apply_update (doc, update)
+
+    #
+    # Tethers; a device's label set is only cached when complete, so adding
+    # to an uncached device leaves it to be loaded from storage on next use
+    #
+    def add_tether (self, device_id: str, label: str):
+        labels = self.tethers.peek (device_id)
+        if labels is not None:
+            labels.add (label)
+        ends = self.tether_ends.peek (label)
+        if ends is None:
+            ends = []
+            self.tether_ends.put (label, ends)
+        ends.append (device_id)
+
+    def remove_tethers_of_label (self, label: str):
+        # if the ends were evicted, stale labels may remain in device sets;
+        # they no longer match a current utx set, so untethering them is a no-op
+        for device_id in self.tether_ends.pop (label) or []:
+            labels = self.tethers.peek (device_id)
+            if labels is not None:
+                labels.discard (label)
+
+    def clear (self):
+        for lru in self.maps ().values():
+            lru.clear ()
+        self.tether_ends.clear ()
+        self.latest_macro_state = None
+
+
+class UniverseStateCache:
+    """Per-universe write-through cache shared by the indexer handlers."""
+
+    def __init__ (self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self._max_entries = max_entries
+        self._universes: Dict[int, UniverseState] = {}
+
+    def universe (self, univ: int) -> UniverseState:
+        state = self._universes.get (univ)
+        if state is None:
+            state = UniverseState (self._max_entries)
+            self._universes [univ] = state
+        return state
+
+    def reset_universe (self, univ: int):
+        """Drop everything known about `univ`, e.g. when the lobby deactivates it."""
+        self.universe (univ).clear ()
+
+    def warm (self, db: Database, universes: Iterable[int], deployed: DeployedDevices):
+        """Load the current (non-clamped) state of each universe from Mongo."""
+        current = {'_chain.valid_to': None}
+        for univ in universes:
+            state = self.universe (univ)
+            state.clear ()
+
+            for doc in db [f'u{univ}_player_fungible_balances'].find (current):
+                state.put_balance (doc ['account'], doc)
+
+            for doc in db [f'u{univ}_player_nonfungible_devices'].find (current):
+                state.put_device (doc ['id'], doc ['owner'], doc ['type'], doc ['is_deployed'])
+
+            docs_by_id: Dict[str, list] = {}
+            for doc in db [deployed.collection (univ)].find (current):
+                docs_by_id.setdefault (doc ['id'], []).append (doc)
+            for device_id, docs in docs_by_id.items():
+                state.put_deployed (device_id, docs[0]['owner'], docs[0]['type'], docs[0].get ('base_grid'), DeployedDevices.cells_of (docs))
+
+            for doc in db [f'u{univ}_deployed_utx_sets'].find (current):
+                state.put_utx_set (doc ['label'], doc)
+
+            labels_by_device: Dict[str, set] = {}
+            for doc in db [tethers_collection (univ)].find (current):
+                labels_by_device.setdefault (doc ['device_id'], set ()).add (doc ['label'])
+                state.add_tether (doc ['device_id'], doc ['label'])
+            for device_id, labels in labels_by_device.items():
+                state.tethers.put (device_id, labels)
+
+            for doc in db [f'u{univ}_macro_states'].find (current, sort = [('block_number', -1)], limit = 1):
+                state.latest_macro_state = _strip (doc)
+
+    def stats (self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss/size counters summed over universes, per map."""
+        totals: Dict[str, Dict[str, int]] = {}
+        for state in self._universes.values():
+            for name, lru in state.maps ().items():
+                t = totals.setdefault (name, {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0})
+                t ['hits'] += lru.hits
+                t ['misses'] += lru.misses
+                t ['evictions'] += lru.evictions
+                t ['size'] += len (lru)
+        return totals
+
+
+def _strip (doc: Document) -> Document:
+    doc = copy.deepcopy (doc)
+    doc.pop ('_id', None)
+    doc.pop ('_chain', None)
+    return doc
@@ -0,0 +1,332 @@
+"""Event decoder generation from compiled Cairo ABIs
+
+`generate` reads the `@event`s and structs of ABI JSON files and emits a
+module with one decoder per event. Every field sits at a slot known when the
+module is generated, so a decoder converts the payload's felts once and reads
+fields by index; arrays are sliced (`v [a:a + n]`, or strided slices zipped
+per struct member), and fields after an array are offset by its length. No
+decoder walks an iterator.
+
+The ABI types addresses, signed quantities and fixed-point values all as
+`felt`, so `Conventions` says how each field is wanted:
+
+- felts are signed unless their name is in `unsigned`,
+- fields named in `fixed_point` are signed values scaled down by 10**20,
+- structs in `flat` decode to the list of their felts, other structs to dicts
+  keyed by member name,
+- the `event_counter` field is returned only by the events in `keep_counter`,
+- an array's `{name}_len` field is returned as is, before the array,
+- the events in `skip` get no decoder.
+
+A decoder returns its fields as a tuple, or the field itself when there is
+only one. The module also maps event names (`DECODERS`) and event keys, the
+selectors of the event names (`DECODERS_BY_KEY`), to decoders.
+
+The generated modules only use the standard library, so they can be dropped
+into any of the indexers:
+
+    poetry run isaac gen-decoders                    # isaac_api/decoders.py
+    poetry run isaac gen-decoders --preset s2m2      # s2m2_api/decoders.py
+
+`write_vendored` copies the modules shared by the indexers (`VENDORED`) into
+the packages built on their own, with a header pointing at the original.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from apibara.starknet import get_selector_from_name
+
+COUNTER_FIELD = 'event_counter'
+
+
+@dataclass (frozen = True)
+class Conventions:
+    unsigned: FrozenSet[str] = frozenset ()
+    fixed_point: FrozenSet[str] = frozenset ()
+    flat: FrozenSet[str] = frozenset ()
+    keep_counter: FrozenSet[str] = frozenset ()
+    skip: FrozenSet[str] = frozenset ()
+
+
+@dataclass (frozen = True)
+class Preset:
+    abis: Tuple[str, ...]   # relative to the root of the repository
+    out: str
+    conventions: Conventions = field (default_factory = Conventions)
+
+
+PRESETS = {
+    'isaac': Preset (
+        abis = ('isaac/deploy/artifacts/isaac/universe_abi.json', 'isaac/deploy/artifacts/isaac/lobby_abi.json'),
+        out = 'apibara_backend/src/isaac_api/decoders.py',
+        conventions = Conventions (
+            unsigned = frozenset ([
+                'owner', 'to', 'src', 'dst', 'account', 'device_id', 'id', 'utx_label',
+                'universe_address', 'arr_player_adr',
+            ]),
+            fixed_point = frozenset (['macro_state', 'impulse', 'vec']),
+            flat = frozenset (['Dynamics']),
+            keep_counter = frozenset ([
+                'give_undeployed_fungible_device_occurred', 'activate_universe_occurred',
+                'universe_activation_occurred', 'universe_deactivation_occurred',
+            ]),
+            skip = frozenset (['debug_emit_vec2', 'debug_emit_felt']),
+        ),
+    ),
+    's2m2': Preset (
+        abis = ('s2m2/artifacts/s2m2_abi.json',),
+        out = 's2m2_apibara_backend/src/s2m2_api/decoders.py',
+        conventions = Conventions (unsigned = frozenset (['solver'])),
+    ),
+}
+
+
+def load_abis (paths: Iterable[str]) -> Tuple[List[dict], Dict[str, dict]]:
+    """Events, in ABI order, and structs by name of the ABI files at `paths`."""
+    events, structs = [], {}
+    for path in paths:
+        with open (path) as f:
+            for entry in json.load (f):
+                if entry ['type'] == 'event':
+                    events.append (entry)
+                elif entry ['type'] == 'struct':
+                    structs [entry ['name']] = entry
+    return events, structs
+
+
+class _Slot:
+    """Offset of the next felt: a constant plus the felts of the arrays before it."""
+
+    def __init__ (self) -> None:
+        self.const = 0
+        self.terms: List[str] = []
+
+    def expr (self, plus: int = 0) -> str:
+        parts = ([str (self.const + plus)] if self.const + plus or not self.terms else []) + self.terms
+        return ' + '.join (parts)
+
+
+class _EventWriter:
+    def __init__ (self, event: dict, structs: Dict[str, dict], conventions: Conventions) -> None:
+        self.event = event
+        self.structs = structs
+        self.conventions = conventions
+        self.lines: List[str] = []
+        self.lengths: Dict[str, str] = {}   # array name => variable holding its length
+
+    def write (self) -> List[str]:
+        name = self.event ['name']
+        slot = _Slot ()
+        returned = []
+        for member in self.event.get ('data') or []:
+            expr = self._field (member, slot)
+            if member ['name'] == COUNTER_FIELD and name not in self.conventions.keep_counter:
+                continue
+            returned.append (expr)
+
+        head = [f'def decode_{name} (data: Data):']
+        body = ['    v = _felts (data)'] if self.event.get ('data') else []
+        body += self.lines
+        if not returned:
+            body.append ('    return None')
+        elif len (returned) == 1:
+            body.append (f'    return {returned [0]}')
+        else:
+            body.append ('    return ' + ', '.join (returned))
+        return head + body
+
+    def _convert (self, name: str) -> str:
+        if name in self.conventions.fixed_point:
+            return '_fp'
+        if name in self.conventions.unsigned:
+            return ''
+        return '_s'
+
+    def _felt (self, convert: str, index: str) -> str:
+        return f'{convert} (v [{index}])' if convert else f'v [{index}]'
+
+    def _size (self, type: str) -> int:
+        if type == 'felt':
+            return 1
+        return self.structs [type]['size']
+
+    def _leaves (self, type: str, base: int = 0) -> List[Tuple[Tuple[str, ...], int]]:
+        """(member path, offset) of every felt of a struct."""
+        if type == 'felt':
+            return [((), base)]
+        leaves = []
+        for member in self.structs [type]['members']:
+            for path, offset in self._leaves (member ['type'], base + member ['offset']):
+                leaves.append (((member ['name'],) + path, offset))
+        return leaves
+
+    def _struct (self, type: str, convert: str, at) -> str:
+        """Dict, or list for `flat` structs, of the struct whose felt `i` is `at (i)`."""
+        if type == 'felt':
+            return at (0)
+        if type in self.conventions.flat:
+            return '[' + ', '.join (at (offset) for _, offset in self._leaves (type)) + ']'
+        items = []
+        for member in self.structs [type]['members']:
+            offset = member ['offset']
+            value = self._struct (member ['type'], convert, lambda i, offset = offset: at (offset + i))
+            items.append (f"'{member ['name']}': {value}")
+        return '{' + ', '.join (items) + '}'
+
+    def _field (self, member: dict, slot: _Slot) -> str:
+        name, type = member ['name'], member ['type']
+        convert = self._convert (name)
+
+        if type.endswith ('*'):
+            item = type [:-1]
+            length = self.lengths.get (name)
+            if length is None:
+                raise ValueError (f"{self.event ['name']}.{name}: no {name}_len field before the array")
+            start, size = slot.expr (), self._size (item)
+            if item == 'felt':
+                sliced = f'v [{start}:{start} + {length}]'
+                expr = sliced if not convert else f'[{convert} (x) for x in {sliced}]'
+            else:
+                # one strided slice per felt of the struct, zipped
+                leaves = self._leaves (item)
+                names = [f'f{i}' for i in range (len (leaves))]
+                slices = [
+                    f'v [{slot.expr (offset)}:{slot.expr (offset)} + {size}*{length}:{size}]'
+                    for _, offset in leaves
+                ]
+                value = self._struct (item, convert, lambda i: f'{convert} ({names [i]})' if convert else names [i])
+                if len (leaves) == 1:
+                    expr = f'[{value} for {names [0]} in {slices [0]}]'
+                else:
+                    expr = f"[{value} for {', '.join (names)} in zip ({', '.join (slices)})]"
+            slot.terms.append (length if size == 1 else f'{size}*{length}')
+            return expr
+
+        if type == 'felt':
+            expr = self._felt (convert, slot.expr ())
+            if name.endswith ('_len'):
+                # array lengths are read into a variable, for the slots after the array
+                variable = f'n_{name [:-4]}'
+                self.lines.append (f'    {variable} = {expr}')
+                self.lengths [name [:-4]] = variable
+                expr = variable
+            slot.const += 1
+            return expr
+
+        base = slot.expr ()
+        if type in self.conventions.flat and convert:
+            size = self._size (type)
+            expr = f'[{convert} (x) for x in v [{base}:{slot.expr (size)}]]'
+        else:
+            expr = self._struct (type, convert, lambda i: self._felt (convert, slot.expr (i)))
+        slot.const += self._size (type)
+        return expr
+
+
+_HEADER = '''\
+"""Event decoders generated from {sources} by `isaac_api.codegen`; do not edit
+
+Regenerate with `poetry run isaac gen-decoders{preset}` after changing the contracts.
+"""
+
+from itertools import repeat
+from typing import Callable, Dict, List, Sequence, Union
+
+STARK_PRIME = 3618502788666131213697322783095070105623107215331596699973092056135872020481
+STARK_PRIME_HALF = 1809251394333065606848661391547535052811553607665798349986546028067936010240
+FELT_SIZE = 32
+SCALE_FP = 10**20
+
+Data = Union[Sequence[bytes], bytes, bytearray, memoryview]
+
+
+def _felts (data: Data) -> List[int]:
+    if isinstance (data, (bytes, bytearray, memoryview)):
+        view = memoryview (data)
+        return [int.from_bytes (view [i:i + FELT_SIZE], 'big') for i in range (0, len (view), FELT_SIZE)]
+    return list (map (int.from_bytes, data, repeat ('big')))
+
+
+def _s (v: int) -> int:
+    return v - STARK_PRIME if v > STARK_PRIME_HALF else v
+
+
+def _fp (v: int) -> float:
+    return (v - STARK_PRIME if v > STARK_PRIME_HALF else v) / SCALE_FP
+'''
+
+
+def generate (paths: Iterable[str], conventions: Conventions, preset: Optional[str] = None, root: Optional[str] = None) -> str:
+    """Source of the decoder module for the events of the ABI files at `paths`."""
+    paths = list (paths)
+    events, structs = load_abis (os.path.join (root, p) if root else p for p in paths)
+    sources = ', '.join (f'`{os.path.basename (p)}`' for p in paths)
+    out = [_HEADER.format (sources = sources, preset = f' --preset {preset}' if preset and preset != 'isaac' else '')]
+
+    names = []
+    for event in events:
+        # the same event may be declared by several ABIs
+        if event ['name'] in names or event ['name'] in conventions.skip:
+            continue
+        names.append (event ['name'])
+        out.append ('')
+        out.append ('\n'.join (_EventWriter (event, structs, conventions).write ()))
+        out.append ('')
+
+    out.append ('')
+    out.append ('DECODERS: Dict[str, Callable] = {')
+    out += [f"    '{name}': decode_{name}," for name in names]
+    out.append ('}')
+    out.append ('')
+    out.append ('# event keys: the selector of the event name, as found in the first key of an event')
+    out.append ('DECODERS_BY_KEY: Dict[int, Callable] = {')
+    out += [f'    {hex (get_selector_from_name (name))}: decode_{name},' for name in names]
+    out.append ('}')
+    out.append ('')
+    return '\n'.join (out)
+
+
+def write_preset (name: str, root: str) -> str:
+    """Regenerate the decoder module of a preset; returns its path."""
+    preset = PRESETS [name]
+    path = os.path.join (root, preset.out)
+    source = generate (preset.abis, preset.conventions, preset = name, root = root)
+    with open (path, 'w') as f:
+        f.write (source)
+    return path
+
+
+#
+# Vendored modules
+#
+# module => its copies in the indexers packaged on their own, relative to the root of the repository
+VENDORED = {
+    'apibara_backend/src/isaac_api/instrumentation.py': (
+        's2m2_apibara_backend/src/s2m2_api/instrumentation.py',
+        'stardisc_backend/src/indexer/instrumentation.py',
+    ),
+}
+
+_VENDORED_HEADER = '# Copied from `{source}` by `poetry run isaac vendor`; do not edit\n\n'
+
+
+def vendored_source (source: str, root: str) -> str:
+    """Content of the copies of the module at `source`."""
+    with open (os.path.join (root, source)) as f:
+        return _VENDORED_HEADER.format (source = source) + f.read ()
+
+
+def write_vendored (root: str) -> List[str]:
+    """Rewrite the copies of the vendored modules; returns their paths."""
+    paths = []
+    for source, copies in VENDORED.items():
+        content = vendored_source (source, root)
+        for copy in copies:
+            path = os.path.join (root, copy)
+            with open (path, 'w') as f:
+                f.write (content)
+            paths.append (path)
+    return paths
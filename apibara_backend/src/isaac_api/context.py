@@ -0,0 +1,35 @@
+"""Shared state handed to the isaac indexer handlers through `info.context`"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from pymongo.database import Database
+
+from isaac_api.cache import UniverseStateCache
+from isaac_api.dispatch import Dispatch
+from isaac_api.epochs import UniverseEpochs
+from isaac_api.footprint import DeployedDevices
+from isaac_api.group_commit import GroupCommit
+from isaac_api.inventory import PlayerInventories
+from isaac_api.mongo import AsyncMongo
+from isaac_api.recording import RecordingWriter
+from isaac_api.shards import ShardState
+from isaac_api.trajectory import MacroTrajectory
+from isaac_api.views import MaterializedViews
+
+
+@dataclass
+class IndexerContext:
+    cache: UniverseStateCache = field (default_factory = UniverseStateCache)
+    deployed: DeployedDevices = field (default_factory = DeployedDevices)
+    trajectory: MacroTrajectory = field (default_factory = MacroTrajectory)
+    inventories: PlayerInventories = field (default_factory = PlayerInventories)
+    epochs: UniverseEpochs = field (default_factory = UniverseEpochs)
+    recorder: Optional[RecordingWriter] = None
+    views: Optional[MaterializedViews] = None
+    shard: ShardState = field (default_factory = ShardState)
+    db: Optional[Database] = None   # database written, instead of the one apibara's storage is bound to
+    mongo: Optional[AsyncMongo] = None   # pool the blocks are read and written through, when set
+    write_mode: Optional[str] = None     # `isaac_api.mongo` write mode of the last block
+    dispatch: Optional[Dispatch] = None  # routes of the indexed events, built by `prepare_context`
+    group: GroupCommit = field (default_factory = GroupCommit)   # blocks committed together while catching up; disabled by default
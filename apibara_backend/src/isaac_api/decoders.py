@@ -0,0 +1,187 @@
+"""Event decoders generated from `universe_abi.json`, `lobby_abi.json` by `isaac_api.codegen`; do not edit
+
+Regenerate with `poetry run isaac gen-decoders` after changing the contracts.
+"""
+
+from itertools import repeat
+from typing import Callable, Dict, List, Sequence, Union
+
+STARK_PRIME = 3618502788666131213697322783095070105623107215331596699973092056135872020481
+STARK_PRIME_HALF = 1809251394333065606848661391547535052811553607665798349986546028067936010240
+FELT_SIZE = 32
+SCALE_FP = 10**20
+
+Data = Union[Sequence[bytes], bytes, bytearray, memoryview]
+
+
+def _felts (data: Data) -> List[int]:
+    if isinstance (data, (bytes, bytearray, memoryview)):
+        view = memoryview (data)
+        return [int.from_bytes (view [i:i + FELT_SIZE], 'big') for i in range (0, len (view), FELT_SIZE)]
+    return list (map (int.from_bytes, data, repeat ('big')))
+
+
+def _s (v: int) -> int:
+    return v - STARK_PRIME if v > STARK_PRIME_HALF else v
+
+
+def _fp (v: int) -> float:
+    return (v - STARK_PRIME if v > STARK_PRIME_HALF else v) / SCALE_FP
+
+
+def decode_forward_world_macro_occurred (data: Data):
+    v = _felts (data)
+    return [_fp (x) for x in v [1:17]], _s (v [17])
+
+
+def decode_impulse_applied_occurred (data: Data):
+    v = _felts (data)
+    return {'x': _fp (v [0]), 'y': _fp (v [1])}
+
+
+def decode_create_new_nonfungible_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2]), v [3]
+
+
+def decode_resource_update_at_harvester_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2])
+
+
+def decode_resource_update_at_transformer_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2]), _s (v [3])
+
+
+def decode_resource_update_at_upsf_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2]), _s (v [3])
+
+
+def decode_energy_update_at_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2])
+
+
+def decode_activate_universe_occurred (data: Data):
+    v = _felts (data)
+    return _s (v [0]), _s (v [1])
+
+
+def decode_give_undeployed_fungible_device_occurred (data: Data):
+    v = _felts (data)
+    return _s (v [0]), v [1], _s (v [2]), _s (v [3])
+
+
+def decode_player_deploy_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], v [2], {'x': _s (v [3]), 'y': _s (v [4])}
+
+
+def decode_player_pickup_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], v [2], {'x': _s (v [3]), 'y': _s (v [4])}
+
+
+def decode_player_deploy_utx_occurred (data: Data):
+    v = _felts (data)
+    n_locs = _s (v [8])
+    return v [1], v [2], _s (v [3]), {'x': _s (v [4]), 'y': _s (v [5])}, {'x': _s (v [6]), 'y': _s (v [7])}, n_locs, [{'x': _s (f0), 'y': _s (f1)} for f0, f1 in zip (v [9:9 + 2*n_locs:2], v [10:10 + 2*n_locs:2])]
+
+
+def decode_player_pickup_utx_occurred (data: Data):
+    v = _felts (data)
+    return v [1], {'x': _s (v [2]), 'y': _s (v [3])}
+
+
+def decode_player_upsf_build_fungible_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], {'x': _s (v [2]), 'y': _s (v [3])}, _s (v [4]), _s (v [5])
+
+
+def decode_player_transfer_undeployed_fungible_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], v [2], _s (v [3]), _s (v [4])
+
+
+def decode_player_transfer_undeployed_nonfungible_device_occurred (data: Data):
+    v = _felts (data)
+    return v [1], v [2], v [3]
+
+
+def decode_terminate_universe_occurred (data: Data):
+    v = _felts (data)
+    return _s (v [1]), _s (v [2]), _s (v [3]), _s (v [4])
+
+
+def decode_universe_activation_occurred (data: Data):
+    v = _felts (data)
+    n_arr_player_adr = _s (v [3])
+    return _s (v [0]), _s (v [1]), v [2], n_arr_player_adr, v [4:4 + n_arr_player_adr]
+
+
+def decode_universe_deactivation_occurred (data: Data):
+    v = _felts (data)
+    n_arr_player_adr = _s (v [3])
+    return _s (v [0]), _s (v [1]), v [2], n_arr_player_adr, v [4:4 + n_arr_player_adr]
+
+
+def decode_ask_to_queue_occurred (data: Data):
+    v = _felts (data)
+    return v [1], _s (v [2])
+
+
+def decode_give_invitation_occurred (data: Data):
+    v = _felts (data)
+    return v [1]
+
+
+DECODERS: Dict[str, Callable] = {
+    'forward_world_macro_occurred': decode_forward_world_macro_occurred,
+    'impulse_applied_occurred': decode_impulse_applied_occurred,
+    'create_new_nonfungible_device_occurred': decode_create_new_nonfungible_device_occurred,
+    'resource_update_at_harvester_occurred': decode_resource_update_at_harvester_occurred,
+    'resource_update_at_transformer_occurred': decode_resource_update_at_transformer_occurred,
+    'resource_update_at_upsf_occurred': decode_resource_update_at_upsf_occurred,
+    'energy_update_at_device_occurred': decode_energy_update_at_device_occurred,
+    'activate_universe_occurred': decode_activate_universe_occurred,
+    'give_undeployed_fungible_device_occurred': decode_give_undeployed_fungible_device_occurred,
+    'player_deploy_device_occurred': decode_player_deploy_device_occurred,
+    'player_pickup_device_occurred': decode_player_pickup_device_occurred,
+    'player_deploy_utx_occurred': decode_player_deploy_utx_occurred,
+    'player_pickup_utx_occurred': decode_player_pickup_utx_occurred,
+    'player_upsf_build_fungible_device_occurred': decode_player_upsf_build_fungible_device_occurred,
+    'player_transfer_undeployed_fungible_device_occurred': decode_player_transfer_undeployed_fungible_device_occurred,
+    'player_transfer_undeployed_nonfungible_device_occurred': decode_player_transfer_undeployed_nonfungible_device_occurred,
+    'terminate_universe_occurred': decode_terminate_universe_occurred,
+    'universe_activation_occurred': decode_universe_activation_occurred,
+    'universe_deactivation_occurred': decode_universe_deactivation_occurred,
+    'ask_to_queue_occurred': decode_ask_to_queue_occurred,
+    'give_invitation_occurred': decode_give_invitation_occurred,
+}
+
+# event keys: the selector of the event name, as found in the first key of an event
+DECODERS_BY_KEY: Dict[int, Callable] = {
+    0x28ecc732e12d910338c3c78b1960bb6e6a8f6746b914696d6ebe15ed46aa241: decode_forward_world_macro_occurred,
+    0x1ccd902fac523b3077e68b3433b50d85ec659d829a6ba67f66609b6d6d8a00b: decode_impulse_applied_occurred,
+    0x2bdd8d79cd8b35954a1a3078ca2e1da291c5947af91748e1a9d6947360c5fbb: decode_create_new_nonfungible_device_occurred,
+    0x35855f1ad29837c0ca9d4d53f8df0be1f4e2685fb53ce4c35f4fc19cafaaa04: decode_resource_update_at_harvester_occurred,
+    0x1448dafd94d00fa418985683b405a3685c332e541993814e85009d95e9b2ca1: decode_resource_update_at_transformer_occurred,
+    0x24437da518f66bf165945ccc4276e65c7c2e44fc2c150ce90f82dab55bd7bc9: decode_resource_update_at_upsf_occurred,
+    0x29e37ec73e4da91c369d3f288a95891636122efe9af3bb2b40260fcb56ce980: decode_energy_update_at_device_occurred,
+    0x16d54d4233f11b2e8e899373d8deae8a6df9061a5469e173fb60fbbf3687c9b: decode_activate_universe_occurred,
+    0x19385e9e847994cad00925280ca087aab59448311814d50e297bb6f914cfe5b: decode_give_undeployed_fungible_device_occurred,
+    0xb61cc14c6eea61df81cfd3f4a4892d47ab95826f37276012529bd6f241aaf5: decode_player_deploy_device_occurred,
+    0x7b7231304d6f656ce55ab3d52a9d328e12581b39ce3ef210e30f2139ac5371: decode_player_pickup_device_occurred,
+    0x92effb8096652636b9282c66b2c6c3ac183267996438f465b6929aa3d0d310: decode_player_deploy_utx_occurred,
+    0x3cba1bd52812997aafd4aa91ee2816b6c2a08be9deb33b5563560c2ef2de618: decode_player_pickup_utx_occurred,
+    0x218a24d998d23abd42692b7c80b4e2ef6e5e66cdf0d7750cc84233d254e1446: decode_player_upsf_build_fungible_device_occurred,
+    0xbb53c7e2d972ec578cada6374933a50b01074e535a31840ef4ce2d139b3b42: decode_player_transfer_undeployed_fungible_device_occurred,
+    0x34e984275915101e937adc5f743570a95dc9363162923fedc8ea716c888ee06: decode_player_transfer_undeployed_nonfungible_device_occurred,
+    0x55da6c1fcf13fa9f469264783ca8c1f31d1eefbe55a0ce60056c1b81d79dde: decode_terminate_universe_occurred,
+    0x234b385701346a3a01d58deaa9582e156551636ef58309019a6dd552185a3e6: decode_universe_activation_occurred,
+    0x6abcdba2e63056c5e6ada18fa05b9c04b10e263b471853e8b23848791c112e: decode_universe_deactivation_occurred,
+    0x3f0e24657aea94b5423bd476254ee102bedb700d9428ebf60ec2cf7ee0bfbe: decode_ask_to_queue_occurred,
+    0x29e815b11e360ed189cc59e7155d4f6e85b21565ddf51d7b52f0b16e2273318: decode_give_invitation_occurred,
+}
@@ -0,0 +1,121 @@
+"""Event dispatch of the isaac indexer
+
+Handlers register themselves on an `EventRegistry` by event name, as universe
+or lobby handlers:
+
+    EVENTS = EventRegistry ()
+
+    @EVENTS.universe ('give_undeployed_fungible_device_occurred')
+    async def handle_give_undeployed_fungible_device_occurred (info, event, univ, block_number): ...
+
+    @EVENTS.lobby ('ask_to_queue_occurred')
+    async def handle_ask_to_queue_occurred (info, event, block_number): ...
+
+Once the contract addresses are known, `EventRegistry.build` binds every
+handler to every address that emits its event. The resulting `Dispatch` maps
+the raw address bytes of an event to the routes of that contract, keyed by
+event name: dispatching an event is two dict lookups, with no address parsing.
+Apibara names each event after the selector of the filter it matched, so the
+name stands for the selector.
+
+Universe events are handled before lobby events (`priority`), which act across
+universes once every universe of the block is done.
+"""
+
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional
+
+from isaac_api.decoders import DECODERS
+
+UNIVERSE_PRIORITY = 1
+LOBBY_PRIORITY = 0
+
+Handler = Callable[..., Awaitable[None]]
+
+
+@dataclass (frozen = True)
+class Route:
+    name: str
+    univ: Optional[int]   # universe of the emitting contract; None for the lobby
+    decoder: Callable     # `isaac_api.decoders` decoder of the event
+    handler: Handler
+    priority: int
+
+    async def handle (self, info, event, block_number: int):
+        if self.univ is None:
+            await self.handler (info, event, block_number)
+        else:
+            await self.handler (info, event, self.univ, block_number)
+
+
+def address_bytes (address: str) -> bytes:
+    """The 32 bytes of a hex contract address, as found in `event.address`."""
+    return int (address, 16).to_bytes (32, 'big')
+
+
+class Dispatch:
+    """Routes of the events of each contract address."""
+
+    def __init__ (self, routes: Dict[bytes, Dict[str, Route]]) -> None:
+        self._routes = routes
+
+    def route (self, event) -> Optional[Route]:
+        """Route of an event, or None when its contract or name is not indexed."""
+        routes = self._routes.get (event.address)
+        if routes is None:
+            # an address not padded to 32 bytes; remembered under its raw bytes
+            routes = self._routes.get (int.from_bytes (event.address, 'big').to_bytes (32, 'big'))
+            if routes is None:
+                return None
+            self._routes [bytes (event.address)] = routes
+        return routes.get (event.name)
+
+    def routes (self) -> List[Route]:
+        seen, routes = set (), []
+        for contract in self._routes.values ():
+            for route in contract.values ():
+                if id (route) not in seen:
+                    seen.add (id (route))
+                    routes.append (route)
+        return routes
+
+
+class EventRegistry:
+    """Universe and lobby handlers by event name, registered with the decorators."""
+
+    def __init__ (self) -> None:
+        self.universe_handlers: Dict[str, Handler] = {}
+        self.lobby_handlers: Dict[str, Handler] = {}
+
+    def universe (self, name: str) -> Callable[[Handler], Handler]:
+        """Register a `(info, event, univ, block_number)` handler of the universe event `name`."""
+        return self._register (self.universe_handlers, name)
+
+    def lobby (self, name: str) -> Callable[[Handler], Handler]:
+        """Register an `(info, event, block_number)` handler of the lobby event `name`."""
+        return self._register (self.lobby_handlers, name)
+
+    def _register (self, handlers: Dict[str, Handler], name: str) -> Callable[[Handler], Handler]:
+        if name not in DECODERS:
+            raise ValueError (f'no decoder for event {name}')
+
+        def register (handler: Handler) -> Handler:
+            if name in handlers:
+                raise ValueError (f'{name} already has a handler: {handlers [name].__name__}')
+            handlers [name] = handler
+            return handler
+        return register
+
+    def build (self, universe_addresses: Mapping[int, str], lobby_address: str) -> Dispatch:
+        """Bind the handlers to the contracts at these addresses."""
+        routes = {}
+        for univ, address in universe_addresses.items ():
+            routes [address_bytes (address)] = {
+                name: Route (name, univ, DECODERS [name], handler, UNIVERSE_PRIORITY)
+                for name, handler in self.universe_handlers.items ()
+            }
+        routes [address_bytes (lobby_address)] = {
+            name: Route (name, None, DECODERS [name], handler, LOBBY_PRIORITY)
+            for name, handler in self.lobby_handlers.items ()
+        }
+        return Dispatch (routes)
@@ -0,0 +1,177 @@
+"""Per-universe collection epochs
+
+`delete` reset mode (the original behaviour) clears a deactivated universe
+with one `delete_many` per collection.
+
+`epoch` reset mode stores the collections a deactivation clears as
+`u{univ}_e{epoch}_{name}`. `universe_epochs` records the current epoch of each
+universe, and the block that advanced it:
+
+    {univ, epoch, block_number}
+
+and `u{univ}_{name}` is a read-only view on the current epoch's collection, so
+readers keep using the original names. Deactivation only advances the epoch:
+the writes that follow land in fresh collections, the new collections are
+indexed and the views switched off the event loop once the block is committed,
+before it is acknowledged, and the previous epoch's collections are dropped in
+the background.
+"""
+
+import asyncio
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+from isaac_api.footprint import DeployedDevices, _collection_type
+from isaac_api.indexes import ensure_indexes
+
+DELETE_MODE = 'delete'
+EPOCH_MODE = 'epoch'
+MODES = [DELETE_MODE, EPOCH_MODE]
+
+EPOCHS_COLLECTION = 'universe_epochs'
+
+# collections cleared on deactivation, besides the deployed devices collection of the storage mode;
+# u{univ}_civ_state keeps the history of civilizations and is not part of an epoch
+EPOCH_NAMES = [
+    'player_fungible_balances',
+    'player_nonfungible_devices',
+    'player_inventories',
+    'deployed_utx_sets',
+    'utx_tethers',
+    'macro_states',
+    'macro_trajectory',
+    'impulses',
+    'pgs',
+    'harvesters',
+    'transformers',
+    'upsfs',
+    'ndpes',
+]
+
+_UNIVERSE_COLLECTION = re.compile (r'^u(\d+)_(.+)$')
+
+
+def epoch_collection (univ: int, name: str, epoch: int) -> str:
+    return f'u{univ}_e{epoch}_{name}'
+
+
+class UniverseEpochs:
+    """Maps the per-universe collection names used by the handlers to the current epoch's collections."""
+
+    def __init__ (self, mode: str = DELETE_MODE, deployed: Optional[DeployedDevices] = None) -> None:
+        if mode not in MODES:
+            raise ValueError (f'Invalid universe reset mode {mode}; expected one of {MODES}')
+        self.mode = mode
+        self._deployed = deployed or DeployedDevices ()
+        self._names: Set[str] = set (EPOCH_NAMES)
+        self._names.add (_UNIVERSE_COLLECTION.match (self._deployed.collection (0)).group (2))
+        self._epochs: Dict[int, int] = {}
+        self._background: Set[asyncio.Future] = set ()
+
+    @property
+    def enabled (self) -> bool:
+        return self.mode == EPOCH_MODE
+
+    def epoch (self, univ: int) -> int:
+        return self._epochs.get (univ, 0)
+
+    def current (self) -> Dict[int, int]:
+        return dict (self._epochs)
+
+    def names (self) -> List[str]:
+        return sorted (self._names)
+
+    def collection (self, name: str) -> str:
+        """Physical collection behind `name`; names outside an epoch are returned unchanged."""
+        if not self.enabled:
+            return name
+        match = _UNIVERSE_COLLECTION.match (name)
+        if match is None or match.group (2) not in self._names:
+            return name
+        univ = int (match.group (1))
+        return epoch_collection (univ, match.group (2), self.epoch (univ))
+
+    #
+    # Startup
+    #
+    def load (self, db: Database, universes: Iterable[int]):
+        for univ in universes:
+            doc = db [EPOCHS_COLLECTION].find_one ({'univ': univ})
+            self._epochs [univ] = doc ['epoch'] if doc else 0
+
+    def ensure (self, db: Database, universes: Iterable[int]):
+        """Point the views at the current epochs and drop the collections of earlier epochs."""
+        if not self.enabled:
+            return
+        for univ in universes:
+            for name in self._names:
+                view = f'u{univ}_{name}'
+                if _collection_type (db, view) not in (None, 'view'):
+                    raise RuntimeError (
+                        f'{view} holds documents outside an epoch; '
+                        f'run `isaac migrate-epochs` before starting in epoch reset mode'
+                    )
+            self._switch_views (db, univ)
+            for epoch in range (self.epoch (univ)):
+                self.drop_epoch (db, univ, epoch)
+
+    #
+    # Deactivation
+    #
+    def advance (self, storage, univ: int):
+        """Start a new epoch for `univ`; the writes queued from now on go to its collections."""
+        previous = self.epoch (univ)
+        self._epochs [univ] = previous + 1
+        storage.queue_write (EPOCHS_COLLECTION, UpdateOne (
+            {'univ': univ},
+            {'$set': {'epoch': previous + 1, 'block_number': storage.block_number}},
+            upsert = True
+        ))
+        storage.on_commit (lambda: self._after_advance (storage.db, univ), blocking = True)
+        storage.on_commit (lambda: self._in_background (self.drop_epoch, storage.db, univ, previous))
+
+    def _after_advance (self, db: Database, univ: int):
+        ensure_indexes (db, [univ], self._deployed, resolve = self.collection, lobby = False)
+        self._switch_views (db, univ)
+
+    def _switch_views (self, db: Database, univ: int):
+        for name in self._names:
+            view = f'u{univ}_{name}'
+            target = epoch_collection (univ, name, self.epoch (univ))
+            command = 'create' if _collection_type (db, view) is None else 'collMod'
+            db.command (command, view, viewOn = target, pipeline = [])
+
+    def drop_epoch (self, db: Database, univ: int, epoch: int):
+        for name in self._names:
+            db.drop_collection (epoch_collection (univ, name, epoch))
+
+    def _in_background (self, fn: Callable, *args):
+        try:
+            loop = asyncio.get_running_loop ()
+        except RuntimeError:
+            fn (*args)
+            return
+        future = loop.run_in_executor (None, fn, *args)
+        self._background.add (future)
+        future.add_done_callback (self._background.discard)
+
+
+def migrate_to_epochs (db: Database, univ: int, deployed: DeployedDevices) -> List[str]:
+    """Move the collections of `univ` into epoch 0 and create the views.
+
+    Returns the names of the collections moved.
+    """
+    epochs = UniverseEpochs (EPOCH_MODE, deployed)
+    moved = []
+    for name in epochs.names ():
+        source = f'u{univ}_{name}'
+        if _collection_type (db, source) == 'collection':
+            db [source].rename (epoch_collection (univ, name, 0))
+            moved.append (source)
+    db [EPOCHS_COLLECTION].update_one ({'univ': univ}, {'$setOnInsert': {'epoch': 0}}, upsert = True)
+    epochs.load (db, [univ])
+    epochs.ensure (db, [univ])
+    return moved
@@ -0,0 +1,36 @@
+"""Felt helpers the generated decoders leave to the handlers
+
+`isaac_api.decoders` returns macro dynamics as 16 floats in `DYNAMICS_FIELDS`
+order; `dynamics_to_json` nests them the way `Dynamics.to_json ()` does.
+`extract_counter` reads the event counter, the first felt of most events,
+without decoding the rest of the payload.
+"""
+
+from typing import Any, Dict, Sequence, Union
+
+from isaac_api.contract import STARK_PRIME, STARK_PRIME_HALF
+
+FELT_SIZE = 32
+
+BODIES = ['sun0', 'sun1', 'sun2', 'planet']
+DYNAMICS_FIELDS = [
+    (body, vec, axis) for body in BODIES for vec in ['q', 'qd'] for axis in ['x', 'y']
+]
+
+Data = Union[Sequence[bytes], bytes, bytearray, memoryview]
+
+
+def dynamics_to_json (v: Sequence[float]) -> Dict[str, Any]:
+    """The `Dynamics.to_json ()` shape of 16 values in `DYNAMICS_FIELDS` order."""
+    return {
+        'sun0'   : {'q': {'x': v[0],  'y': v[1]},  'qd': {'x': v[2],  'y': v[3]}},
+        'sun1'   : {'q': {'x': v[4],  'y': v[5]},  'qd': {'x': v[6],  'y': v[7]}},
+        'sun2'   : {'q': {'x': v[8],  'y': v[9]},  'qd': {'x': v[10], 'y': v[11]}},
+        'planet' : {'q': {'x': v[12], 'y': v[13]}, 'qd': {'x': v[14], 'y': v[15]}},
+    }
+
+
+def extract_counter (data: Data) -> int:
+    first = memoryview (data) [:FELT_SIZE] if isinstance (data, (bytes, bytearray, memoryview)) else data [0]
+    v = int.from_bytes (first, 'big')
+    return v - STARK_PRIME if v > STARK_PRIME_HALF else v
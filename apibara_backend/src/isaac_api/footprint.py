@@ -0,0 +1,177 @@
+"""Storage layouts for deployed devices and utx cells
+
+`cells` mode (the original layout) stores one document per occupied grid cell
+in `u{univ}_deployed_devices`:
+
+    {owner, id, type, grid, base_grid}
+
+`footprint` mode stores one document per device or utx set in
+`u{univ}_deployed_device_footprints`, with the occupied cells as an array and a
+multikey index on their keys:
+
+    {owner, id, type, base_grid, grids: [{x, y}, ...], cells: ['x:y', ...]}
+
+In footprint mode `u{univ}_deployed_devices` becomes a read-only view that
+unwinds `grids`, so existing readers keep seeing one document per cell. Its
+`_id` is the footprint's `_id` and the position of the cell in `grids`,
+`'{_id}:{n}'`, the same on every read.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo.database import Database
+
+Document = Dict[str, Any]
+
+CELLS_MODE = 'cells'
+FOOTPRINT_MODE = 'footprint'
+MODES = [CELLS_MODE, FOOTPRINT_MODE]
+
+
+def cell_key (grid: Document) -> str:
+    return f"{grid['x']}:{grid['y']}"
+
+
+def cells_collection (univ: int) -> str:
+    return f'u{univ}_deployed_devices'
+
+
+def footprints_collection (univ: int) -> str:
+    return f'u{univ}_deployed_device_footprints'
+
+
+#
+# Compatibility view: one document per cell, shaped like the cells-mode documents
+#
+def _cells_view_pipeline () -> List[Document]:
+    return [
+        {'$unwind': {'path': '$grids', 'includeArrayIndex': 'cell_index'}},
+        {'$project': {
+            '_id'       : {'$concat': [{'$toString': '$_id'}, ':', {'$toString': '$cell_index'}]},
+            'owner'     : 1,
+            'id'        : 1,
+            'type'      : 1,
+            'grid'      : '$grids',
+            'base_grid' : 1,
+            '_chain'    : 1,
+        }},
+    ]
+
+
+def _collection_type (db: Database, name: str) -> Optional[str]:
+    for info in db.list_collections (filter = {'name': name}):
+        return info.get ('type', 'collection')
+    return None
+
+
+class DeployedDevices:
+    """Reads and writes of deployed devices / utx cells for the configured storage mode."""
+
+    def __init__ (self, mode: str = CELLS_MODE) -> None:
+        if mode not in MODES:
+            raise ValueError (f'Invalid deployed devices storage mode {mode}; expected one of {MODES}')
+        self.mode = mode
+
+    @property
+    def footprint (self) -> bool:
+        return self.mode == FOOTPRINT_MODE
+
+    def collection (self, univ: int) -> str:
+        return footprints_collection (univ) if self.footprint else cells_collection (univ)
+
+    def grid_filter (self, grid: Document) -> Document:
+        if self.footprint:
+            return {'cells' : cell_key (grid)}
+        return {'grid' : grid}
+
+    async def insert (self, storage, univ: int, owner: str, device_id: str, device_type: str, cells: List[Document], base_grid: Optional[Document] = None):
+        if self.footprint:
+            doc = {
+                'owner' : owner,
+                'id'    : device_id,
+                'type'  : device_type,
+                'grids' : [dict (cell) for cell in cells],
+                'cells' : [cell_key (cell) for cell in cells],
+            }
+            if base_grid is not None:
+                doc ['base_grid'] = base_grid
+            await storage.insert_one (self.collection (univ), doc)
+            return
+
+        docs = []
+        for cell in cells:
+            doc = {
+                'owner' : owner,
+                'id'    : device_id,
+                'type'  : device_type,
+                'grid'  : dict (cell),
+            }
+            if base_grid is not None:
+                doc ['base_grid'] = base_grid
+            docs.append (doc)
+        if docs:
+            await storage.insert_many (self.collection (univ), docs)
+
+    @staticmethod
+    def cells_of (docs: Iterable[Document]) -> List[Document]:
+        """Occupied cells of the documents of one device, in either layout."""
+        cells = []
+        for doc in docs:
+            if 'grids' in doc:
+                cells += doc ['grids']
+            else:
+                cells.append (doc ['grid'])
+        return cells
+
+    def ensure (self, db: Database, univ: int):
+        """Create the compatibility view for footprint mode, or update its pipeline; its indexes are declared in `isaac_api.indexes`."""
+        if not self.footprint:
+            return
+
+        view_type = _collection_type (db, cells_collection (univ))
+        if view_type in (None, 'view'):
+            command = 'create' if view_type is None else 'collMod'
+            db.command (command, cells_collection (univ), viewOn = footprints_collection (univ), pipeline = _cells_view_pipeline ())
+        else:
+            raise RuntimeError (
+                f'{cells_collection (univ)} holds cells-mode documents; '
+                f'run `isaac migrate-footprints` before starting in footprint mode'
+            )
+
+
+def migrate_to_footprints (db: Database, univ: int) -> int:
+    """Fold the current cells-mode documents of `univ` into footprint documents.
+
+    The original collection is kept as `u{univ}_deployed_devices_cells` and
+    replaced by the compatibility view. Returns the number of footprints written.
+    """
+    source = cells_collection (univ)
+    if _collection_type (db, source) == 'view':
+        return 0
+
+    by_id: Dict[str, Document] = {}
+    if _collection_type (db, source) is not None:
+        for doc in db [source].find ({'_chain.valid_to': None}):
+            footprint = by_id.get (doc ['id'])
+            if footprint is None:
+                footprint = {
+                    'owner'  : doc ['owner'],
+                    'id'     : doc ['id'],
+                    'type'   : doc ['type'],
+                    'grids'  : [],
+                    'cells'  : [],
+                    '_chain' : {'valid_from': doc ['_chain']['valid_from'], 'valid_to': None},
+                }
+                if 'base_grid' in doc:
+                    footprint ['base_grid'] = doc ['base_grid']
+                by_id [doc ['id']] = footprint
+            footprint ['grids'].append (doc ['grid'])
+            footprint ['cells'].append (cell_key (doc ['grid']))
+            footprint ['_chain']['valid_from'] = max (footprint ['_chain']['valid_from'], doc ['_chain']['valid_from'])
+
+        if by_id:
+            db [footprints_collection (univ)].insert_many (list (by_id.values ()))
+        db [source].rename (f'{source}_cells')
+
+    DeployedDevices (FOOTPRINT_MODE).ensure (db, univ)
+    return len (by_id)
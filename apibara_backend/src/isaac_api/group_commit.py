@@ -0,0 +1,76 @@
+"""Group commits of the isaac indexer while it catches up with the chain head
+
+Far behind the head, after downtime or during the initial sync, committing
+block by block spends most of the time on round-trips. Once the lag exceeds
+`enter_lag` blocks, `GroupCommit` keeps the unit of work of a block open for the
+next ones (`BlockUnitOfWork.advance`) and commits up to `max_blocks` blocks, or
+`max_requests` queued requests, at once. The documents end up as if each block
+had been committed on its own. Within `exit_lag` blocks of the head, it goes
+back to committing every block, starting with the open group.
+
+Apibara acknowledges a block as soon as its handler returns, so the blocks of
+an open group are acknowledged before they are written. A process stopped
+with an open group loses them from the stream: `isaac start` rewinds the
+Apibara indexer to the last committed block on startup when group commits are
+enabled.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from isaac_api.unit_of_work import BlockUnitOfWork
+
+BLOCK_MODE = 'block'
+GROUP_MODE = 'group'
+
+DEFAULT_MAX_BLOCKS = 100
+DEFAULT_MAX_REQUESTS = 50000
+DEFAULT_ENTER_LAG = 200
+
+
+@dataclass
+class GroupCommit:
+    max_blocks: int = 1        # 1 disables group commits
+    max_requests: int = DEFAULT_MAX_REQUESTS
+    enter_lag: int = DEFAULT_ENTER_LAG
+    exit_lag: int = 10
+
+    mode: str = BLOCK_MODE
+    uow: Optional[BlockUnitOfWork] = None   # unit of work of the open group
+    first_block: Optional[int] = None
+    blocks: int = 0
+    events: int = 0
+
+    @property
+    def enabled (self) -> bool:
+        return self.max_blocks > 1
+
+    def update_mode (self, lag: Optional[int]) -> bool:
+        """Switch modes at the lag of the current block, None when the head is unknown; True on a switch."""
+        if not self.enabled or lag is None:
+            return False
+        if self.mode == BLOCK_MODE and lag > self.enter_lag:
+            self.mode = GROUP_MODE
+            return True
+        if self.mode == GROUP_MODE and lag <= self.exit_lag:
+            self.mode = BLOCK_MODE
+            return True
+        return False
+
+    def add (self, uow: BlockUnitOfWork, block_number: int, events: int):
+        """Count a block handled into `uow`, the unit of work of the open group."""
+        if self.uow is None:
+            self.uow, self.first_block = uow, block_number
+        self.blocks += 1
+        self.events += events
+
+    def due (self) -> bool:
+        """Whether the open group is to be committed with its last block."""
+        return (
+            self.mode == BLOCK_MODE
+            or self.blocks >= self.max_blocks
+            or self.uow.pending_request_count () >= self.max_requests
+        )
+
+    def close (self):
+        self.uow, self.first_block, self.blocks, self.events = None, None, 0, 0
@@ -0,0 +1,225 @@
+"""Several indexers on one Apibara stream
+
+An `IndexerHost` runs indexers as plugins of a single `IndexerRunner`: one
+Apibara indexer with the union of the plugins' event filters, one stream, one
+block download. Each event goes to the plugin whose filters name the emitting
+contract, in a `NewEvents` of that plugin's events only. The plugins of a
+block are handled concurrently, each with its own context and a `PooledStorage`
+bound to its own database: apibara's chain-aware `Storage`, with its driver
+calls run on the host's `AsyncMongo` pool rather than on the event loop, so a
+plugin waiting on Mongo leaves the loop to the other plugins, the read API and
+the push hub. Their metrics are served together on one port.
+
+`host_progress` records the last block handled by each plugin, written on the
+`AsyncMongo` pool once the plugins of a block are done:
+
+    {_id: plugin name, block_number}
+
+Apibara acknowledges a block once every plugin of the block is done. A block
+delivered again, after a crash or to a plugin added to a running host, is
+skipped by the plugins that already handled it. The host indexer starts from
+the earliest block any plugin still needs.
+
+The isaac and s2m2 indexers are available as plugins (`plugins`); s2m2 when
+`s2m2_api` is installed in the same environment:
+
+    poetry run isaac start-host --plugins isaac,s2m2
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from apibara import Info, NewBlock, NewEvents
+from apibara.indexer.storage import Storage
+from apibara.model import EventFilter
+from pymongo import UpdateOne
+
+from isaac_api.instrumentation import REGISTRY, Registry
+from isaac_api.mongo import AsyncDatabase, AsyncMongo
+
+log = logging.getLogger ('isaac_api.host')
+
+HOST_PROGRESS_COLLECTION = 'host_progress'
+
+PLUGIN_SECONDS = REGISTRY.histogram ('isaac_host_plugin_seconds', 'Time spent by one plugin on one block.', ['plugin'])
+PLUGIN_EVENTS = REGISTRY.counter ('isaac_host_plugin_events_total', 'Events routed to each plugin.', ['plugin'])
+PLUGIN_BLOCK = REGISTRY.gauge ('isaac_host_plugin_block', 'Last block handled by each plugin.', ['plugin'])
+
+
+def _address_key (address: bytes) -> bytes:
+    """32-byte form of a contract address, however many leading zero bytes it came with."""
+    return int.from_bytes (address, 'big').to_bytes (32, 'big')
+
+
+class PooledStorage (Storage):
+    """apibara's `Storage`, with each driver call run on the `AsyncMongo` pool"""
+
+    def __init__ (self, db: AsyncDatabase, block_number: int) -> None:
+        super ().__init__ (db.db, block_number)
+        self._mongo: AsyncMongo = db.mongo
+
+    async def insert_one (self, collection: str, doc):
+        self._add_chain_information (doc)
+        await self._mongo.run (self._db [collection].insert_one, doc)
+
+    async def insert_many (self, collection: str, docs):
+        docs = list (docs)
+        for doc in docs:
+            self._add_chain_information (doc)
+        await self._mongo.run (self._db [collection].insert_many, docs)
+
+    async def delete_one (self, collection: str, filter):
+        await self._mongo.run (self._db [collection].update_one, filter, {'$set': {'_chain.valid_to': self._block_number}})
+
+    async def delete_many (self, collection: str, filter):
+        await self._mongo.run (self._db [collection].update_many, filter, {'$set': {'_chain.valid_to': self._block_number}})
+
+    async def find_one (self, collection: str, filter):
+        self._add_current_block_to_filter (filter)
+        return await self._mongo.run (self._db [collection].find_one, filter)
+
+    async def find (self, collection: str, filter, projection = None, skip = None, limit = None) -> Iterator[dict]:
+        self._add_current_block_to_filter (filter)
+        cursor = self._db [collection].find (filter, projection, skip or 0, limit or 0)
+        return iter (await self._mongo.run (list, cursor))
+
+    async def _clamp (self, collection: str, filter):
+        """End the validity of the current document matching `filter`; the document before"""
+        self._add_current_block_to_filter (filter)
+        return await self._mongo.run (
+            self._db [collection].find_one_and_update, filter, {'$set': {'_chain.valid_to': self._block_number}}
+        )
+
+    async def find_one_and_replace (self, collection: str, filter, replacement, upsert: bool = False):
+        existing = await self._clamp (collection, filter)
+        if existing is not None or upsert:
+            await self.insert_one (collection, replacement)
+        return existing
+
+    async def find_one_and_update (self, collection: str, filter, update):
+        existing = await self._clamp (collection, filter)
+        if existing is not None:
+            del existing ['_id']
+            del existing ['_chain']
+            await self.insert_one (collection, existing)
+            await self._mongo.run (self._db [collection].update_one, filter, update)
+        return existing
+
+
+@dataclass
+class Plugin:
+    name: str                 # progress key, metrics label
+    db_name: str              # database its `info.storage` is bound to
+    filters: List[EventFilter]
+    index_from_block: int
+    handle_events: Callable[[Info, NewEvents], Awaitable[None]]
+    handle_block: Optional[Callable[[Info, NewBlock], Awaitable[None]]] = None
+    context: Any = None
+    registry: Optional[Registry] = None   # metrics served by the host
+    progress: int = field (default = -1, init = False)
+
+
+class IndexerHost:
+    def __init__ (self, plugins: List[Plugin], db: AsyncDatabase) -> None:
+        names = [plugin.name for plugin in plugins]
+        if len (names) != len (set (names)):
+            raise ValueError (f'Duplicate plugins in {names}')
+        self.plugins = plugins
+        self._db = db
+        self._routes: Dict[bytes, Plugin] = {}
+        for plugin in plugins:
+            for f in plugin.filters:
+                if f.address is None:
+                    raise ValueError (f'{plugin.name}: filter {f} has no contract address to route its events by')
+                other = self._routes.setdefault (_address_key (f.address), plugin)
+                if other is not plugin:
+                    raise ValueError (f'{plugin.name} and {other.name} both index the contract at 0x{f.address.hex ()}')
+
+    def filters (self) -> List[EventFilter]:
+        return [f for plugin in self.plugins for f in plugin.filters]
+
+    def registry (self) -> Registry:
+        """The metrics of the host and of every plugin."""
+        merged, registries = Registry (), [REGISTRY]
+        for plugin in self.plugins:
+            if plugin.registry is not None and all (plugin.registry is not r for r in registries):
+                registries.append (plugin.registry)
+        for registry in registries:
+            for metric in registry.metrics ():
+                merged.register (metric)
+        return merged
+
+    async def load (self):
+        progress = {doc ['_id']: doc ['block_number'] for doc in await self._db [HOST_PROGRESS_COLLECTION].find ()}
+        for plugin in self.plugins:
+            plugin.progress = progress.get (plugin.name, -1)
+
+    async def forget (self):
+        await self._db [HOST_PROGRESS_COLLECTION].delete_many ({})
+        for plugin in self.plugins:
+            plugin.progress = -1
+
+    def index_from_block (self) -> int:
+        """First block to stream: the earliest one a plugin has not handled yet."""
+        return min (max (plugin.index_from_block, plugin.progress) for plugin in self.plugins)
+
+    def _info (self, info: Info, plugin: Plugin, block_number: int) -> Info:
+        return Info (
+            context = plugin.context,
+            rpc_client = info.rpc_client,
+            storage = PooledStorage (self._db.mongo.database (plugin.db_name), block_number)
+        )
+
+    async def handle_events (self, info: Info, block_events: NewEvents):
+        block_number = block_events.block.number
+        events: Dict[str, list] = {}
+        for event in block_events.events:
+            plugin = self._routes.get (_address_key (event.address))
+            if plugin is None:
+                log.warning ('block %s: no plugin indexes %s at 0x%s', block_number, event.name, event.address.hex ())
+            elif block_number > plugin.progress:
+                events.setdefault (plugin.name, []).append (event)
+
+        plugins = [plugin for plugin in self.plugins if plugin.name in events]
+        await asyncio.gather (*[
+            self._handle_plugin (info, plugin, NewEvents (block = block_events.block, events = events [plugin.name]))
+            for plugin in plugins
+        ])
+        if plugins:
+            await self._db [HOST_PROGRESS_COLLECTION].bulk_write ([
+                UpdateOne ({'_id': plugin.name}, {'$set': {'block_number': block_number}}, upsert = True)
+                for plugin in plugins
+            ])
+        for plugin in plugins:
+            plugin.progress = block_number
+            PLUGIN_BLOCK.set (block_number, plugin = plugin.name)
+
+    async def _handle_plugin (self, info: Info, plugin: Plugin, block_events: NewEvents):
+        started = time.perf_counter ()
+        await plugin.handle_events (self._info (info, plugin, block_events.block.number), block_events)
+        PLUGIN_SECONDS.observe (time.perf_counter () - started, plugin = plugin.name)
+        PLUGIN_EVENTS.inc (len (block_events.events), plugin = plugin.name)
+
+    async def handle_block (self, info: Info, block: NewBlock):
+        await asyncio.gather (*[
+            plugin.handle_block (self._info (info, plugin, block.new_head.number), block)
+            for plugin in self.plugins if plugin.handle_block is not None
+        ])
+
+
+def s2m2_plugin () -> Plugin:
+    """The s2m2 indexer, writing to its own database; needs `s2m2_api`."""
+    from s2m2_api import indexer as s2m2
+
+    return Plugin (
+        name = s2m2.INDEXER_ID,
+        db_name = s2m2.INDEXER_ID,
+        filters = s2m2.event_filters (),
+        index_from_block = s2m2.ORIGIN_BLOCK_TO_INDEX,
+        handle_events = s2m2.handle_events,
+        handle_block = s2m2.handle_block,
+        registry = s2m2.REGISTRY,
+    )
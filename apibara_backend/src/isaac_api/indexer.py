@@ -3,47 +3,72 @@
 import os
 import sys
 import asyncio
+import logging
+import time
 import math
+import dataclasses
 from argparse import ArgumentParser
 from datetime import datetime
 
-from pymongo import MongoClient
 # from dotenv import load_dotenv
 
 from apibara import NewEvents, IndexerRunner, NewBlock, Info, Client
 from apibara.indexer.runner import IndexerRunnerConfiguration
+from apibara.indexer.storage import IndexerStorage
 from apibara.model import EventFilter
 
-from isaac_api.contract import (
-    extract_counter_from_event,
-
+from isaac_api.felts import extract_counter, dynamics_to_json
+from isaac_api.decoders import (
     ## universe
-    decode_forward_world_event,
-    decode_give_undeployed_fungible_device_occurred_event,
-    decode_activate_universe_occurred_event,
-    decode_terminate_universe_occurred_event,
-    decode_player_deploy_device_occurred_event,
-    decode_player_pickup_device_occurred_event,
-    decode_player_deploy_utx_occurred_event,
-    decode_player_pickup_utx_occurred_event,
-
-    decode_resource_update_at_harvester_occurred_event,
-    decode_resource_update_at_transformer_occurred_event,
-    decode_resource_update_at_upsf_occurred_event,
-    decode_energy_update_at_device_occurred_event,
-
-    decode_impulse_applied_occurred_event,
-    decode_player_transfer_undeployed_fungible_device_occurred_event,
-    decode_player_transfer_undeployed_nonfungible_device_occurred_event,
-
-    decode_player_upsf_build_fungible_device_occurred_event,
-    decode_create_new_nonfungible_device_occurred_event,
+    decode_forward_world_macro_occurred,
+    decode_give_undeployed_fungible_device_occurred,
+    decode_activate_universe_occurred,
+    decode_terminate_universe_occurred,
+    decode_player_deploy_device_occurred,
+    decode_player_pickup_device_occurred,
+    decode_player_deploy_utx_occurred,
+    decode_player_pickup_utx_occurred,
+
+    decode_resource_update_at_harvester_occurred,
+    decode_resource_update_at_transformer_occurred,
+    decode_resource_update_at_upsf_occurred,
+    decode_energy_update_at_device_occurred,
+
+    decode_impulse_applied_occurred,
+    decode_player_transfer_undeployed_fungible_device_occurred,
+    decode_player_transfer_undeployed_nonfungible_device_occurred,
+
+    decode_player_upsf_build_fungible_device_occurred,
+    decode_create_new_nonfungible_device_occurred,
 
     ## lobby
-    decode_universe_activation_occurred_event,
-    decode_universe_deactivation_occurred_event,
-    decode_ask_to_queue_occurred_event,
-    decode_give_invitation_occurred_event
+    decode_universe_activation_occurred,
+    decode_universe_deactivation_occurred,
+    decode_ask_to_queue_occurred,
+    decode_give_invitation_occurred
+)
+from isaac_api.unit_of_work import BlockUnitOfWork
+from isaac_api.cache import UniverseStateCache, DEFAULT_MAX_ENTRIES
+from isaac_api.context import IndexerContext
+from isaac_api.dispatch import EventRegistry
+from isaac_api.host import IndexerHost, Plugin, s2m2_plugin
+from isaac_api.group_commit import GroupCommit, GROUP_MODE, DEFAULT_MAX_BLOCKS, DEFAULT_MAX_REQUESTS, DEFAULT_ENTER_LAG
+from isaac_api.footprint import DeployedDevices, CELLS_MODE
+from isaac_api.tethers import tethers_collection, backfill_tethers, SRC_END, DST_END
+from isaac_api.inventory import PlayerInventories, inventories_collection, device_state, backfill_inventories
+from isaac_api.trajectory import MacroTrajectory, row_from_dynamics, DEFAULT_BUCKET_BLOCKS
+from isaac_api.indexes import ensure_indexes, check_query_plans
+from isaac_api.epochs import UniverseEpochs, DELETE_MODE
+from isaac_api.recording import RecordingWriter
+from isaac_api.instrumentation import REGISTRY, COUNT_BUCKETS, EventLog, serve
+from isaac_api.views import MaterializedViews, DEFAULT_RETENTION_BLOCKS
+from isaac_api.push import PushHub, DEFAULT_MAX_PENDING, DEFAULT_MAX_CHANGES
+from isaac_api import read_api
+from isaac_api.shards import ShardRole, ShardState
+from isaac_api.recovery import recover
+from isaac_api.mongo import (
+    AsyncMongo, CATCH_UP, LIVE,
+    DEFAULT_MAX_POOL_SIZE, DEFAULT_MIN_POOL_SIZE, DEFAULT_CATCH_UP_WRITE_CONCERN, DEFAULT_LIVE_WRITE_CONCERN
 )
 
 # load_dotenv ()
@@ -54,6 +79,52 @@ DEVICE_TYPE_COUNT = 16
 
 BIRTH_BLOCK = 318228
 INDEXER_ID = os.getenv('ISAAC_INDEXER_ID', 'isaac')
+HOST_ID = os.getenv ('ISAAC_HOST_ID', f'{INDEXER_ID}-host') # Apibara indexer of `isaac start-host`
+CACHE_MAX_ENTRIES = int (os.getenv ('ISAAC_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+DEPLOYED_DEVICES_MODE = os.getenv ('ISAAC_DEPLOYED_DEVICES_MODE', CELLS_MODE) # 'cells' or 'footprint'
+UNIVERSE_RESET_MODE = os.getenv ('ISAAC_UNIVERSE_RESET_MODE', DELETE_MODE) # 'delete' or 'epoch'
+TRAJECTORY_BUCKET_BLOCKS = int (os.getenv ('ISAAC_TRAJECTORY_BUCKET_BLOCKS', DEFAULT_BUCKET_BLOCKS))
+RECORD_PATH = os.getenv ('ISAAC_RECORD_PATH') # recording directory of the handled blocks, for `isaac replay`
+LOG_LEVEL = os.getenv ('ISAAC_LOG_LEVEL', 'INFO') # DEBUG adds one line per event
+EVENT_LOG_SAMPLE = float (os.getenv ('ISAAC_EVENT_LOG_SAMPLE', 1.0)) # fraction of the events logged at DEBUG
+METRICS_PORT = int (os.getenv ('ISAAC_METRICS_PORT', 0)) # serve /metrics on this port; 0 disables it
+READ_API_PORT = int (os.getenv ('ISAAC_READ_API_PORT', 0)) # serve the materialized views on this port; 0 disables them
+READ_API_HOST = os.getenv ('ISAAC_READ_API_HOST', '127.0.0.1')
+READ_API_RETENTION_BLOCKS = int (os.getenv ('ISAAC_READ_API_RETENTION_BLOCKS', DEFAULT_RETENTION_BLOCKS)) # blocks of changes kept for the delta endpoint
+PUSH_MAX_PENDING = int (os.getenv ('ISAAC_PUSH_MAX_PENDING', DEFAULT_MAX_PENDING)) # messages queued for a WebSocket client before coalescing
+PUSH_MAX_CHANGES = int (os.getenv ('ISAAC_PUSH_MAX_CHANGES', DEFAULT_MAX_CHANGES)) # changes of a coalesced message before a resync instead
+SHARDS = os.getenv ('ISAAC_SHARDS', '') # universes of each shard worker, e.g. "0,1;2,3"; empty runs a single process
+MONGO_MAX_POOL_SIZE = int (os.getenv ('ISAAC_MONGO_MAX_POOL_SIZE', DEFAULT_MAX_POOL_SIZE)) # connections, and driver calls in flight
+MONGO_MIN_POOL_SIZE = int (os.getenv ('ISAAC_MONGO_MIN_POOL_SIZE', DEFAULT_MIN_POOL_SIZE))
+CATCH_UP_WRITE_CONCERN = os.getenv ('ISAAC_CATCH_UP_WRITE_CONCERN', DEFAULT_CATCH_UP_WRITE_CONCERN) # `w` of the blocks written while catching up, unjournaled
+LIVE_WRITE_CONCERN = os.getenv ('ISAAC_LIVE_WRITE_CONCERN', DEFAULT_LIVE_WRITE_CONCERN) # `w` of the blocks written live, journaled
+LIVE_LAG_BLOCKS = int (os.getenv ('ISAAC_LIVE_LAG_BLOCKS', 10)) # blocks behind the head below which the indexer is live
+GROUP_COMMIT_BLOCKS = int (os.getenv ('ISAAC_GROUP_COMMIT_BLOCKS', DEFAULT_MAX_BLOCKS)) # blocks committed together while catching up; 1 disables group commits
+GROUP_COMMIT_MAX_REQUESTS = int (os.getenv ('ISAAC_GROUP_COMMIT_MAX_REQUESTS', DEFAULT_MAX_REQUESTS)) # queued requests that commit a group early
+GROUP_COMMIT_LAG_BLOCKS = int (os.getenv ('ISAAC_GROUP_COMMIT_LAG_BLOCKS', DEFAULT_ENTER_LAG)) # blocks behind the head above which blocks are committed in groups
+
+log = logging.getLogger ('isaac_api.indexer')
+trace = EventLog (log, EVENT_LOG_SAMPLE)
+
+#
+# Metrics
+#
+HANDLER_SECONDS = REGISTRY.histogram ('isaac_handler_seconds', 'Wall time handling one event, including the handlers of the other universe partitions interleaved with it.', ['event'])
+PARTITION_SECONDS = REGISTRY.histogram ('isaac_partition_seconds', 'Wall time handling one partition of a block; the universe partitions run concurrently.', ['partition'])
+BLOCK_SECONDS = REGISTRY.histogram ('isaac_block_seconds', 'Time spent handling and committing one block.')
+BLOCK_MONGO_READS = REGISTRY.histogram ('isaac_block_mongo_reads', 'Server reads issued while handling one block.', buckets = COUNT_BUCKETS)
+BLOCK_MONGO_BULK_WRITES = REGISTRY.histogram ('isaac_block_mongo_bulk_writes', 'bulk_write calls of one block commit.', buckets = COUNT_BUCKETS)
+BLOCK_MONGO_REQUESTS = REGISTRY.histogram ('isaac_block_mongo_requests', 'Write requests flushed by one block commit.', buckets = COUNT_BUCKETS)
+INDEXED_BLOCK = REGISTRY.gauge ('isaac_indexed_block', 'Last block handled.')
+HEAD_BLOCK = REGISTRY.gauge ('isaac_head_block', 'Latest block announced by the Apibara server.')
+BLOCK_LAG = REGISTRY.gauge ('isaac_block_lag', 'Blocks between the head and the last block handled.')
+CACHE_HIT_RATIO = REGISTRY.gauge ('isaac_cache_hit_ratio', 'Hits over lookups of each universe state cache map.', ['map'])
+CACHE_ENTRIES = REGISTRY.gauge ('isaac_cache_entries', 'Entries of each universe state cache map.', ['map'])
+COMMIT_BLOCKS = REGISTRY.histogram ('isaac_commit_blocks', 'Blocks written by one commit.', buckets = COUNT_BUCKETS)
+GROUP_COMMIT = REGISTRY.gauge ('isaac_group_commit', '1 while blocks are committed in groups, 0 while committed one by one.')
+MODE_SWITCHES = REGISTRY.counter ('isaac_commit_mode_switches_total', 'Switches between commit modes, by mode switched to.', ['mode'])
+MODE_BLOCKS = REGISTRY.counter ('isaac_blocks_total', 'Blocks handled, by commit mode.', ['mode'])
+MODE_EVENTS = REGISTRY.counter ('isaac_events_total', 'Events handled, by commit mode.', ['mode'])
 
 ISAAC_UNIVERSE_ADDRESSES = {
     0 : '0x0666e03798f67a4579e6a211a9eb1b11d58e159fd11adbe275d600a08506c1b8'
@@ -67,6 +138,32 @@ UTX_TYPES = [12,13]
 UPSF_TYPE = 14
 NDPE_TYPE = 15
 
+UNIVERSE_EVENT_LIST = [
+    'forward_world_macro_occurred',
+    'give_undeployed_fungible_device_occurred',
+    'activate_universe_occurred',
+    'player_deploy_device_occurred',
+    'player_pickup_device_occurred',
+    'player_deploy_utx_occurred',
+    'player_pickup_utx_occurred',
+    'resource_update_at_harvester_occurred',
+    'resource_update_at_transformer_occurred',
+    'resource_update_at_upsf_occurred',
+    'energy_update_at_device_occurred',
+    'impulse_applied_occurred',
+    'player_transfer_undeployed_fungible_device_occurred',
+    'player_transfer_undeployed_nonfungible_device_occurred',
+    'player_upsf_build_fungible_device_occurred',
+    'create_new_nonfungible_device_occurred',
+    'terminate_universe_occurred',
+]
+
+# lobby events that also touch the collections of the universe they name
+UNIVERSE_LOBBY_EVENT_LIST = [
+    'universe_activation_occurred',
+    'universe_deactivation_occurred',
+]
+
 LOBBY_EVENT_LIST = [
     'universe_activation_occurred',
     'universe_deactivation_occurred',
@@ -74,6 +171,9 @@ LOBBY_EVENT_LIST = [
     'give_invitation_occurred'
 ]
 
+# handlers of the events above, registered by their decorators below
+EVENTS = EventRegistry ()
+
 DEVICE_DIMENSION_MAP = {
     0 : 1,
     1 : 3,
@@ -93,155 +193,319 @@ DEVICE_DIMENSION_MAP = {
     15 : 5
 }
 
-def _create_mongo_client_and_db():
-    mongo_connection_url = os.getenv ("ISAAC_MONGO_URL")
-    mongo_db_name = os.getenv ("ISAAC_MONGO_DB_NAME")
+def _connect (mongo_url):
+    return AsyncMongo.connect (
+        mongo_url,
+        max_pool_size = MONGO_MAX_POOL_SIZE,
+        min_pool_size = MONGO_MIN_POOL_SIZE,
+        catch_up_w = CATCH_UP_WRITE_CONCERN,
+        live_w = LIVE_WRITE_CONCERN
+    )
 
-    mongo = MongoClient (mongo_connection_url)
-    isaac_db = mongo [mongo_db_name]
+def _indexer_db_name ():
+    # apibara stores the indexer's documents in a database named after the indexer id
+    return INDEXER_ID.replace ('-', '_')
 
-    #
-    # Check database status before processing events
-    #
-    db_status = isaac_db.command ("serverStatus")
-    print (f'> MongoDB connected: {db_status["host"]}')
+def _indexer_mongo (mongo_url):
+    """Pooled non-blocking client, and the indexer's database through it"""
+    mongo = _connect (mongo_url)
+    return mongo, mongo.database (_indexer_db_name ())
 
-    MONGO = mongo
+class PooledIndexerStorage (IndexerStorage):
+    """apibara's `IndexerStorage` on the pooled client, instead of a client of its own"""
 
-    return mongo, isaac_db
+    def __init__ (self, client, indexer_id):
+        self.db_name = indexer_id.replace ('-', '_')
+        self._mongo = client
+        self._db = client [self.db_name]
 
-def find_if_from_univ (adr):
-    for (k,v) in ISAAC_UNIVERSE_ADDRESSES.items():
-        if int(adr[2:], 16) == int(v, 16):
-            return k
-    return None
+def _use_pool (runner, mongo, indexer_id):
+    # IndexerRunner connects its storage from `storage_url`; keep one connection pool per process
+    runner._indexer_storage = PooledIndexerStorage (mongo.client, indexer_id)
 
 #
 # Handle events
 #
 
-def extract_priority_from_event (event):
-    # priority: universe > lobby
-
-    if event.name in LOBBY_EVENT_LIST:
-        return 0
-    else:
-        return 1
-
-
 async def handle_events(info: Info, block_events: NewEvents):
+    started = time.perf_counter ()
     block_number = block_events.block.number
 
+    if info.context.recorder is not None:
+        info.context.recorder.append (block_events)
+
     #
-    # sort events based on event_counter value in ascending order
+    # route each event by its contract and name, then sort by priority (universe > lobby)
+    # and event_counter value in ascending order
     #
-    event_priority_counter_tuples = []
+    dispatch = info.context.dispatch
+    if dispatch is None:
+        dispatch = info.context.dispatch = EVENTS.build (ISAAC_UNIVERSE_ADDRESSES, ISAAC_LOBBY_ADDRESS)
+    event_route_counter_tuples = []
     for event in block_events.events:
-        counter = extract_counter_from_event (event)
-        priority = extract_priority_from_event (event)
-        event_priority_counter_tuples.append ( (event, priority, counter) )
-    event_priority_counter_tuples.sort (key = lambda e: e[2], reverse=False)
-    event_priority_counter_tuples.sort (key = lambda e: e[1], reverse=True)
-
-    # debug = "\n".join ([ f"{t[0].name}_p{t[1]}_c{t[2]}" for t in event_priority_counter_tuples ])
-    # print (f'\n*** Block {block_number}: handling events:\n{debug}\n')
-    print (f'\n*** Block {block_number}\n')
-
-    for (event, _, counter) in event_priority_counter_tuples:
-        from_adr = hex ( int.from_bytes(event.address, "big") )
-        from_univ = find_if_from_univ (from_adr)
-        print (f'  - got event (counter={counter}): name={event.name}, address={from_adr}, block_number={block_number}, from_univ={from_univ}')
-
-        #
-        # universe
-        #
-        if event.name == 'forward_world_macro_occurred':
-            await handle_forward_world_macro_occurred (info, event, from_univ, block_number)
-
-        elif event.name == 'give_undeployed_fungible_device_occurred':
-            await handle_give_undeployed_fungible_device_occurred (info, event, from_univ, block_number)
-
-        elif event.name == 'activate_universe_occurred':
-            await handle_activate_universe_occurred (info, event, from_univ, block_number)
-
-        elif event.name == 'terminate_universe_occurred':
-            await handle_terminate_universe_occurred (info, event, from_univ)
-
-        elif event.name == 'player_deploy_device_occurred':
-            await handle_player_deploy_device_occurred (info, event, from_univ)
-
-        elif event.name == 'player_pickup_device_occurred':
-            await handle_player_pickup_device_occurred (info, event, from_univ)
-
-        elif event.name == 'player_deploy_utx_occurred':
-            await handle_player_deploy_utx_occurred (info, event, from_univ)
-
-        elif event.name == 'player_pickup_utx_occurred':
-            await handle_player_pickup_utx_occurred (info, event, from_univ)
-
-        elif event.name == 'resource_update_at_harvester_occurred':
-            await handle_resource_update_at_harvester_occurred (info, event, from_univ)
-
-        elif event.name == 'resource_update_at_transformer_occurred':
-            await handle_resource_update_at_transformer_occurred (info, event, from_univ)
-
-        elif event.name == 'resource_update_at_upsf_occurred':
-            await handle_resource_update_at_upsf_occurred (info, event, from_univ)
-
-        elif event.name == 'energy_update_at_device_occurred':
-            await handle_energy_update_at_device_occurred (info, event, from_univ)
-
-        elif event.name == 'impulse_applied_occurred':
-            await handle_impulse_applied_occurred (info, event, from_univ, block_number)
+        route = dispatch.route (event)
+        if route is None:
+            log.debug ('block %s: no handler of %s at %s', block_number, event.name, event.address.hex ())
+            continue
+        event_route_counter_tuples.append ( (event, route, extract_counter (event.data)) )
+    event_route_counter_tuples.sort (key = lambda e: (-e[1].priority, e[2]))
+    log.log (logging.DEBUG if info.context.group.mode == GROUP_MODE else logging.INFO, 'block %s: %s events', block_number, len (block_events.events))
+
+    #
+    # Universe events touch only their own u{univ}_* collections: partition them by universe
+    # and handle the partitions concurrently, each in counter order. Lobby events act across
+    # universes and have the lowest priority, so they run after every partition, in order.
+    #
+    # With shards, the events of universes this process does not own, or has already
+    # committed this block for, are skipped.
+    #
+    shard = info.context.shard
+    partitions = {}
+    lobby_events = []
+    for (event, route, counter) in event_route_counter_tuples:
+        if route.univ is None:
+            lobby_events.append ( (event, counter, route) )
+        elif shard.owns (route.univ, block_number):
+            partitions.setdefault (route.univ, []).append ( (event, counter, route) )
+
+    #
+    # queue all writes of this block into one unit of work, flushed once the block is handled,
+    # or into the unit of work of the open group while catching up with group commits;
+    # apibara's Storage does not expose its database handle, hence the private attribute
+    #
+    group = info.context.group
+    mongo = info.context.mongo
+    uow = group.uow
+    if uow is not None:
+        await uow.advance (block_number)
+    else:
+        uow = BlockUnitOfWork (
+            info.context.db if info.context.db is not None else info.storage._db,
+            block_number,
+            resolve = info.context.epochs.collection,
+            concurrent_reads = len (partitions) > 1,
+            mongo = mongo,
+            write_concern = mongo.write_concern (write_mode (info.context, block_number)) if mongo is not None else None
+        )
+    info = dataclasses.replace (info, storage = uow)
+
+    await asyncio.gather (*[
+        handle_partition (info, partition, block_number, f'u{univ}') for univ, partition in partitions.items()
+    ])
+    await handle_partition (info, lobby_events, block_number, 'lobby')
+    shard.record (uow, block_number, int (HEAD_BLOCK.value ()))
+
+    mode = commit_mode (info.context, block_number)
+    MODE_BLOCKS.inc (mode = mode)
+    MODE_EVENTS.inc (len (block_events.events), mode = mode)
+    group.add (uow, block_number, len (block_events.events))
+    if not group.due ():
+        _observe_progress (block_number)
+        return
+    await commit_group (info.context, started)
 
-        elif event.name == 'player_transfer_undeployed_fungible_device_occurred':
-            await handle_player_transfer_undeployed_fungible_device_occurred (info, event, from_univ, block_number)
 
-        elif event.name == 'player_transfer_undeployed_nonfungible_device_occurred':
-            await handle_player_transfer_undeployed_nonfungible_device_occurred (info, event, from_univ, block_number)
+async def commit_group (context, started = None):
+    """Commit the blocks handled since the last commit: the current block, or the open group"""
+    group = context.group
+    uow = group.uow
+    if uow is None:
+        return
+    started = time.perf_counter () if started is None else started
+
+    # the views follow the committed documents
+    await uow.flush ()
+    changes = uow.changes () if context.views is not None else None
+    requests = await uow.commit ()
+    if changes is not None:
+        context.views.apply (uow.block_number, changes, context.epochs)
+    if group.blocks > 1:
+        log.info ('blocks %s-%s: committed %s events, %s requests', group.first_block, uow.block_number, group.events, requests)
+    COMMIT_BLOCKS.observe (group.blocks)
+    group.close ()
+    _observe_block (context, uow, uow.block_number, requests, time.perf_counter () - started)
+
+
+def commit_mode (context, block_number):
+    """GROUP_MODE while catching up with group commits, BLOCK_MODE otherwise; see `isaac_api.group_commit`"""
+    group = context.group
+    head_block = HEAD_BLOCK.value ()
+    if group.update_mode (head_block - block_number if head_block else None):
+        log.info ('block %s: %s commits, %s blocks behind the head', block_number, group.mode, head_block - block_number)
+        MODE_SWITCHES.inc (mode = group.mode)
+    GROUP_COMMIT.set (1 if group.mode == GROUP_MODE else 0)
+    return group.mode
+
+
+def write_mode (context, block_number):
+    """CATCH_UP while more than LIVE_LAG_BLOCKS behind the head, or while the head is unknown; LIVE otherwise"""
+    head_block = HEAD_BLOCK.value ()
+    mode = LIVE if head_block and head_block - block_number <= LIVE_LAG_BLOCKS else CATCH_UP
+    if mode != context.write_mode:
+        log.info ('block %s: %s writes', block_number, mode)
+        context.write_mode = mode
+    return mode
+
+
+def _observe_progress (block_number):
+    INDEXED_BLOCK.set (block_number)
+    if HEAD_BLOCK.value ():
+        BLOCK_LAG.set (max (0, HEAD_BLOCK.value () - block_number))
+
+
+def _observe_block (context, uow, block_number, requests, seconds):
+    BLOCK_SECONDS.observe (seconds)
+    BLOCK_MONGO_READS.observe (uow.reads)
+    BLOCK_MONGO_BULK_WRITES.observe (uow.writes)
+    BLOCK_MONGO_REQUESTS.observe (requests)
+    _observe_progress (block_number)
+    for name, stats in context.cache.stats ().items():
+        lookups = stats ['hits'] + stats ['misses']
+        CACHE_HIT_RATIO.set (stats ['hits'] / lookups if lookups else 0.0, map = name)
+        CACHE_ENTRIES.set (stats ['size'], map = name)
+
+
+async def handle_partition (info, events, block_number, name):
+    # the partitions of a block interleave on the loop: both times are wall times
+    if not events:
+        return
+    started = time.perf_counter ()
+    for (event, counter, route) in events:
+        event_started = time.perf_counter ()
+        await handle_event (info, event, counter, route, block_number)
+        HANDLER_SECONDS.observe (time.perf_counter () - event_started, event = route.name)
+    PARTITION_SECONDS.observe (time.perf_counter () - started, partition = name)
 
-        elif event.name == 'player_upsf_build_fungible_device_occurred':
-            await handle_player_upsf_build_fungible_device_occurred (info, event, from_univ, block_number)
 
-        elif event.name == 'create_new_nonfungible_device_occurred':
-            await handle_create_new_nonfungible_device_occurred (info, event, from_univ, block_number)
+async def handle_event (info, event, counter, route, block_number):
+    if trace.begin ():
+        from_adr = hex ( int.from_bytes(event.address, "big") )
+        trace ('got event (counter=%s): name=%s, address=%s, block_number=%s, from_univ=%s, fields=%s', counter, event.name, from_adr, block_number, route.univ, route.decoder (event.data))
 
-        #
-        # lobby
-        #
-        elif event.name == 'universe_activation_occurred':
-            await handle_universe_activation_occurred (info, event)
+    await route.handle (info, event, block_number)
 
-        elif event.name == 'universe_deactivation_occurred':
-            await handle_universe_deactivation_occurred (info, event)
 
-        elif event.name == 'ask_to_queue_occurred':
-            await handle_ask_to_queue_occurred (info, event)
+#
+# Cached reads; on a miss fall back to storage (which sees this block's own writes) and fill the cache
+#
+async def _get_balance (info, univ, account):
+    state = info.context.cache.universe (univ)
+    balance = state.balances.get (account)
+    if balance is None:
+        balance = await info.storage.find_one (
+            f'u{univ}_player_fungible_balances',
+            {'account' : account}
+        )
+        if balance is not None:
+            state.put_balance (account, balance)
+    return balance
+
+async def _get_device (info, univ, device_id):
+    state = info.context.cache.universe (univ)
+    device = state.devices.get (device_id)
+    if device is None:
+        record = await info.storage.find_one (
+            f'u{univ}_player_nonfungible_devices',
+            {'id' : device_id}
+        )
+        if record is None:
+            return None
+        state.put_device (device_id, record ['owner'], record ['type'], record ['is_deployed'])
+        device = state.devices.peek (device_id)
+    return device
+
+async def _get_deployed_by_id (info, univ, device_id):
+    state = info.context.cache.universe (univ)
+    entry = state.deployed.get (device_id)
+    if entry is None:
+        docs = await info.storage.find (
+            collection = info.context.deployed.collection (univ),
+            filter = {'id' : device_id},
+            skip = 0,
+            limit = 0
+        )
+        docs = list (docs)
+        if not docs:
+            return None
+        state.put_deployed (device_id, docs[0]['owner'], docs[0]['type'], docs[0].get ('base_grid'), DeployedDevices.cells_of (docs))
+        entry = state.deployed.peek (device_id)
+    return entry
+
+async def _get_latest_macro_state (info, univ):
+    state = info.context.cache.universe (univ)
+    if state.latest_macro_state is None:
+        # fallback: the descending block_number index makes this a single-document read
+        macro_states = await info.storage.find (
+            collection = f'u{univ}_macro_states',
+            filter = {},
+            skip = 0,
+            limit = 1,
+            sort = [('block_number', -1)]
+        )
+        if not macro_states:
+            return None
+        state.latest_macro_state = macro_states[0]
+    return state.latest_macro_state
+
+async def _get_tethered_labels (info, univ, device_id):
+    state = info.context.cache.universe (univ)
+    labels = state.tethers.get (device_id)
+    if labels is None:
+        docs = await info.storage.find (
+            collection = tethers_collection (univ),
+            filter = {'device_id' : device_id},
+            skip = 0,
+            limit = 0
+        )
+        labels = set (doc ['label'] for doc in docs)
+        state.tethers.put (device_id, labels)
+    return labels
+
+async def _get_deployed_at (info, univ, grid_json):
+    state = info.context.cache.universe (univ)
+    hit = state.deployed_at (grid_json)
+    if hit is not None:
+        return hit
+    result = await info.storage.find_one (
+        info.context.deployed.collection (univ),
+        info.context.deployed.grid_filter (grid_json)
+    )
+    if result is None:
+        return None
+    entry = await _get_deployed_by_id (info, univ, result ['id'])
+    return result ['id'], entry
 
-        elif event.name == 'give_invitation_occurred':
-            await handle_give_invitation_occurred (info, event)
+async def _update_inventory_device (info, univ, device_id, fields):
+    # resource updates name the device only; its inventory is its owner's
+    device = await _get_device (info, univ, device_id)
+    if device is not None:
+        await info.context.inventories.update_device_state (info.storage, univ, device ['owner'], device_id, fields)
 
 
+@EVENTS.universe ('forward_world_macro_occurred')
 async def handle_forward_world_macro_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    dynamics, phi = decode_forward_world_event (event)
-    print(f'> dynamics={dynamics}, phi={phi}\n')
+    dynamics, phi = decode_forward_world_macro_occurred (event.data)
+    trace ('dynamics=%s, phi=%s', dynamics, phi)
 
     #
     # Update database
     #
 
-    dynamics_json = dynamics.to_json()
+    dynamics_json = dynamics_to_json (dynamics)
+    macro_state = {
+        "phi" : phi.to_bytes(32, "big"),
+        "dynamics" : dynamics_json,
+        "block_number" : block_number
+    }
     await info.storage.insert_one (
         f'u{univ}_macro_states',
-        {
-            "phi" : phi.to_bytes(32, "big"),
-            "dynamics" : dynamics_json,
-            "block_number" : block_number
-        }
+        macro_state
     )
+    info.context.cache.universe (univ).latest_macro_state = macro_state
+    await info.context.trajectory.append (info.storage, univ, block_number, row_from_dynamics (dynamics, phi))
 
     def distance (qa, qb):
         return math.sqrt ( (qa['x']-qb['x'])**2 + (qa['y']-qb['y'])**2 )
@@ -258,20 +522,19 @@ async def handle_forward_world_macro_occurred (info, event, univ, block_number):
     # print (f'    - distances to sun0 ({distance_0}), sun1 ({distance_1}), sun2 ({distance_2})')
 
 
+@EVENTS.universe ('give_undeployed_fungible_device_occurred')
 async def handle_give_undeployed_fungible_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    event_counter, to_account, device_type, device_amount = decode_give_undeployed_fungible_device_occurred_event (event)
-    print(f'> event_counter={event_counter}, to_account={to_account}, device_type={device_type}, device_amount={device_amount}\n')
+    event_counter, to_account, device_type, device_amount = decode_give_undeployed_fungible_device_occurred (event.data)
+    trace ('event_counter=%s, to_account=%s, device_type=%s, device_amount=%s', event_counter, to_account, device_type, device_amount)
 
     #
     # Update db
     #
-    result = await info.storage.find_one (
-        f'u{univ}_player_fungible_balances',
-        {'account' : str(to_account)}
-    )
+    state = info.context.cache.universe (univ)
+    result = await _get_balance (info, univ, str(to_account))
     if result is None:
         # print (f'handle_give_undeployed_device_occurred NONE; performing insert_one')
         document = {
@@ -287,24 +550,30 @@ async def handle_give_undeployed_fungible_device_occurred (info, event, univ, bl
             f'u{univ}_player_fungible_balances',
             document
         )
+        state.put_balance (str(to_account), document)
+        await info.context.inventories.add_balance (info.storage, univ, str(to_account), device_type, device_amount)
     else:
         # print (f'handle_give_undeployed_device_occurred not NONE; performing find_one_and_update')
+        update = {
+            '$inc' : {str(device_type) : device_amount},
+            '$set' : {'block_number' : block_number}
+        }
         await info.storage.find_one_and_update (
             collection = f'u{univ}_player_fungible_balances',
             filter = {'account' : str(to_account)},
-            update = {
-                '$inc' : {str(device_type) : device_amount},
-                '$set' : {'block_number' : block_number}
-            }
+            update = update
         )
+        state.update_balance (str(to_account), update)
+        await info.context.inventories.add_balance (info.storage, univ, str(to_account), device_type, device_amount)
 
 
+@EVENTS.universe ('activate_universe_occurred')
 async def handle_activate_universe_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    event_counter, civ_idx = decode_activate_universe_occurred_event (event)
-    print(f'> event_counter={event_counter}, civ_idx={civ_idx}\n')
+    event_counter, civ_idx = decode_activate_universe_occurred (event.data)
+    trace ('event_counter=%s, civ_idx=%s', event_counter, civ_idx)
     # print (f"    -- event_counter={event_counter}, civ_idx={civ_idx}")
 
     #
@@ -329,12 +598,13 @@ async def handle_activate_universe_occurred (info, event, univ, block_number):
     )
 
 
-async def handle_terminate_universe_occurred (info, event, univ):
+@EVENTS.universe ('terminate_universe_occurred')
+async def handle_terminate_universe_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    bool_universe_terminable, destruction_by_which_sun, bool_universe_max_age_reached, bool_universe_escape_condition_met = decode_terminate_universe_occurred_event (event)
-    print(f'> bool_universe_terminable={bool_universe_terminable}, destruction_by_which_sun={destruction_by_which_sun}, bool_universe_max_age_reached={bool_universe_max_age_reached}, bool_universe_escape_condition_met={bool_universe_escape_condition_met}\n')
+    bool_universe_terminable, destruction_by_which_sun, bool_universe_max_age_reached, bool_universe_escape_condition_met = decode_terminate_universe_occurred (event.data)
+    trace ('bool_universe_terminable=%s, destruction_by_which_sun=%s, bool_universe_max_age_reached=%s, bool_universe_escape_condition_met=%s', bool_universe_terminable, destruction_by_which_sun, bool_universe_max_age_reached, bool_universe_escape_condition_met)
     # print (f'    terminable={bool_universe_terminable}, destruction_by_which_sun={destruction_by_which_sun}, max_age_reached={bool_universe_max_age_reached}, escaped={bool_universe_escape_condition_met}')
 
     #
@@ -358,20 +628,19 @@ async def handle_terminate_universe_occurred (info, event, univ):
     )
 
 
-async def handle_player_deploy_device_occurred (info, event, univ):
+@EVENTS.universe ('player_deploy_device_occurred')
+async def handle_player_deploy_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, device_id, grid = decode_player_deploy_device_occurred_event (event)
-    print(f'> owner={owner}, device_id={device_id}, grid={grid}\n')
+    owner, device_id, grid = decode_player_deploy_device_occurred (event.data)
+    trace ('owner=%s, device_id=%s, grid=%s', owner, device_id, grid)
 
     #
-    # Get device type and footprint from db
+    # Get device type and footprint from cache / db
     #
-    record = await info.storage.find_one (
-        f'u{univ}_player_nonfungible_devices',
-        {'id' : str(device_id)}
-    )
+    state = info.context.cache.universe (univ)
+    record = await _get_device (info, univ, str(device_id))
     device_type = record ['type']
     dim = DEVICE_DIMENSION_MAP [device_type]
 
@@ -385,35 +654,44 @@ async def handle_player_deploy_device_occurred (info, event, univ):
             '$set' : {'is_deployed' : True}
         }
     )
+    state.update_device (str(device_id), is_deployed = True)
 
     #
-    # Update db 'u{}_deployed_devices'
+    # Update db 'u{}_deployed_devices' (one document per cell, or one footprint document)
     # -- document structure: {device_id, owner, type, grid}
     #
-    base_grid_json = grid.to_json ()
+    base_grid_json = grid
+    cells = []
     for x in range(dim):
         for y in range(dim):
-            await info.storage.insert_one (
-                f'u{univ}_deployed_devices',
-                {
-                    'owner' : str(owner),
-                    'id'    : str(device_id),
-                    'type'  : str(device_type),
-                    'grid'  : {
-                        'x' : base_grid_json['x'] + x,
-                        'y' : base_grid_json['y'] + y,
-                    },
-                    'base_grid' : base_grid_json
-                }
-            )
+            cells.append ({
+                'x' : base_grid_json['x'] + x,
+                'y' : base_grid_json['y'] + y,
+            })
+    await info.context.deployed.insert (info.storage, univ, str(owner), str(device_id), str(device_type), cells, base_grid_json)
+    state.put_deployed (str(device_id), str(owner), str(device_type), base_grid_json, cells)
+
+    #
+    # Update db 'u{}_player_inventories'
+    #
+    await info.context.inventories.deploy_device (info.storage, univ, record ['owner'], str(device_id), base_grid_json)
 
 
-async def handle_player_pickup_device_occurred (info, event, univ):
+@EVENTS.universe ('player_pickup_device_occurred')
+async def handle_player_pickup_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, device_id, grid = decode_player_pickup_device_occurred_event (event)
-    print(f'> owner={owner}, device_id={device_id}, grid={grid}\n')
+    owner, device_id, grid = decode_player_pickup_device_occurred (event.data)
+    trace ('owner=%s, device_id=%s, grid=%s', owner, device_id, grid)
+
+    ## find the device deployed at the given grid
+    ## SAFEGUARD: like a utx pickup, don't continue if the owner has nothing deployed there
+    hit = await _get_deployed_at (info, univ, grid)
+    if hit is None or hit[1]['owner'] != str(owner):
+        log.warning ('erroneous %s event encountered; no device of owner %s at grid %s', event.name, owner, grid)
+        return
+    device_id_str = hit[0]
 
     #
     # Update db 'u{}_player_nonfungible_devices' - mark not deployed
@@ -425,175 +703,149 @@ async def handle_player_pickup_device_occurred (info, event, univ):
             '$set' : {'is_deployed' : False}
         }
     )
+    state = info.context.cache.universe (univ)
+    state.update_device (str(device_id), is_deployed = False)
 
     #
     # Update db 'u{}_deployed_devices'
     # -- document structure: {device_id, owner, type, grid}
     #
-    selected_grid = grid.to_json ()
-    result = await info.storage.find_one (
-        f'u{univ}_deployed_devices',
-        {
-            'owner' : str(owner),
-            'grid' : selected_grid
-        }
-    )
-    device_base_grid = result['base_grid']
-    device_type_str = result ['type']
-    device_id_str = result ['id']
-    device_type = int (device_type_str)
-    dim = DEVICE_DIMENSION_MAP [device_type]
-
     # print (f'  -- attempted to delete device at grid {grid.to_json ()}, type {device_type}, id {device_id_str}')
     result = await info.storage.delete_many ( # apibara's delete_many is pymongo's update_many
-        f'u{univ}_deployed_devices',
+        info.context.deployed.collection (univ),
         {
             'owner' : str(owner),
             'id' : device_id_str
         }
     )
-    # print (f"  -- deleted device type {device_type_str}, base grid (x,y)=({device_base_grid['x']},{device_base_grid['y']})")
+    state.remove_deployed (device_id_str)
+    await info.context.inventories.deploy_device (info.storage, univ, str(owner), device_id_str, None)
 
     #
-    # Update collection for utx if device pick-up resulting in untethering
+    # Update collection for utx if device pick-up resulting in untethering;
+    # the tether index gives the utx sets tethered at this device's source or destination
     #
-    results_tethered_as_src = []
-    results_tethered_as_dst = []
-    for x in range (dim):
-        for y in range (dim):
-            search_x = device_base_grid['x'] + x
-            search_y = device_base_grid['y'] + y
-            search_grid = {
-                'x' : search_x,
-                'y' : search_y
-            }
-            # print (f'  -- searching grid (x,y)=({search_x},{search_y}) to check utx untethering')
-
-            result_tethered_as_src = await info.storage.find ( # should return list; empty if none found
-                collection = f'u{univ}_deployed_utx_sets',
-                filter = {'src_grid' : search_grid},
-                skip = 0,
-                limit = 0
-            )
-            result_tethered_as_dst = await info.storage.find ( # should return list; empty if none found
-                collection = f'u{univ}_deployed_utx_sets',
-                filter = {'dst_grid' : search_grid},
-                skip = 0,
-                limit = 0
-            )
-            results_tethered_as_src += result_tethered_as_src
-            results_tethered_as_dst += result_tethered_as_dst
-
-    for utx_doc in results_tethered_as_src:
-        result = await info.storage.find_one_and_update (
-            collection = f'u{univ}_deployed_utx_sets',
-            filter = {'label' : utx_doc['label']},
-            update = {'$set' : {'tethered' : 0}}
+    labels = sorted (await _get_tethered_labels (info, univ, device_id_str))
+    if labels:
+        await info.storage.update_many (
+            f'u{univ}_deployed_utx_sets',
+            {'label' : {'$in' : labels}},
+            {'$set' : {'tethered' : 0}}
         )
-        # print (f'  -- device pickup results in utx untethered at source: {result}')
-
-    for utx_doc in results_tethered_as_dst:
-        result = await info.storage.find_one_and_update (
-            collection = f'u{univ}_deployed_utx_sets',
-            filter = {'label' : utx_doc['label']},
-            update = {'$set' : {'tethered' : 0}}
+        for label in labels:
+            state.update_utx_set (label, {'$set' : {'tethered' : 0}})
+            state.remove_tethers_of_label (label)
+        await info.storage.delete_many (
+            tethers_collection (univ),
+            {'label' : {'$in' : labels}}
         )
-        # print (f'  -- device pickup results in utx untethered at destination: {result}')
+        # print (f'  -- device pickup results in utx untethered: {labels}')
+    state.tethers.pop (device_id_str)
 
 
-async def handle_player_deploy_utx_occurred (info, event, univ):
+@EVENTS.universe ('player_deploy_utx_occurred')
+async def handle_player_deploy_utx_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, utx_label, utx_device_type, src_device_grid, dst_device_grid, locs_len, locs = decode_player_deploy_utx_occurred_event (event)
-    print(f'> owner={owner}, utx_label={utx_label}, utx_device_type={utx_device_type}, src_device_grid={src_device_grid}, dst_device_grid={dst_device_grid}, locs_len={locs_len}, locs={locs}\n')
+    owner, utx_label, utx_device_type, src_device_grid, dst_device_grid, locs_len, locs = decode_player_deploy_utx_occurred (event.data)
+    trace ('owner=%s, utx_label=%s, utx_device_type=%s, src_device_grid=%s, dst_device_grid=%s, locs_len=%s, locs=%s', owner, utx_label, utx_device_type, src_device_grid, dst_device_grid, locs_len, locs)
     # print (f'    owner={owner}, utx_label={utx_label}, utx_device_type={utx_device_type}, src_device_grid={src_device_grid}, dst_device_grid={dst_device_grid}, locs_len={locs_len}, locs={locs}')
 
     #
     # Update collection 'u{}_player_fungible_balances'
     #
+    state = info.context.cache.universe (univ)
     await info.storage.find_one_and_update (
         f'u{univ}_player_fungible_balances',
         {'account' : str(owner)},
         {'$inc' : {str(utx_device_type) : -1*locs_len}}
     )
+    state.update_balance (str(owner), {'$inc' : {str(utx_device_type) : -1*locs_len}})
 
     #
-    # Update collection 'u{}_deployed_devices'
+    # Update collection 'u{}_deployed_devices' (one document per cell, or one footprint document)
     # -- document structure: {device_id, owner, type, grid}
     #
-    for i in range (locs_len):
-        await info.storage.insert_one (
-            f'u{univ}_deployed_devices',
-            {
-                'owner' : str(owner),
-                'id'    : str(utx_label),
-                'type'  : str(utx_device_type),
-                'grid'  : locs[i]
-            }
-        )
+    await info.context.deployed.insert (info.storage, univ, str(owner), str(utx_label), str(utx_device_type), locs)
+    state.put_deployed (str(utx_label), str(owner), str(utx_device_type), None, locs)
 
     #
     # Update collection 'u{}_deployed_utx_sets'
     # -- document structure: {label, type, grids, src_grid, dst_grid, tethered}
     #
+    utx_set = {
+        'label' : str(utx_label),
+        'type'  : str(utx_device_type),
+        'grids' : locs,
+        'src_grid' : src_device_grid,
+        'dst_grid' : dst_device_grid,
+        'tethered' : 1
+    }
     await info.storage.insert_one (
         f'u{univ}_deployed_utx_sets',
-        {
-            'label' : str(utx_label),
-            'type'  : str(utx_device_type),
-            'grids' : locs,
-            'src_grid' : src_device_grid.to_json (),
-            'dst_grid' : dst_device_grid.to_json (),
-            'tethered' : 1
-        }
+        utx_set
     )
+    state.put_utx_set (str(utx_label), utx_set)
+
+    #
+    # Update collection 'u{}_player_inventories'
+    #
+    await info.context.inventories.add_utx_set (info.storage, univ, str(owner), str(utx_label), str(utx_device_type), locs)
 
+    #
+    # Update collection 'u{}_utx_tethers' with the devices at both ends
+    # -- document structure: {device_id, label, end}
+    #
+    for end, end_grid in ((SRC_END, utx_set ['src_grid']), (DST_END, utx_set ['dst_grid'])):
+        hit = await _get_deployed_at (info, univ, end_grid)
+        if hit is None:
+            continue
+        await info.storage.insert_one (
+            tethers_collection (univ),
+            {
+                'device_id' : hit[0],
+                'label'     : str(utx_label),
+                'end'       : end
+            }
+        )
+        state.add_tether (hit[0], str(utx_label))
 
-async def handle_player_pickup_utx_occurred (info, event, univ):
+
+@EVENTS.universe ('player_pickup_utx_occurred')
+async def handle_player_pickup_utx_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, grid = decode_player_pickup_utx_occurred_event (event)
-    print(f'> owner={owner}, grid={grid}\n')
+    owner, grid = decode_player_pickup_utx_occurred (event.data)
+    trace ('owner=%s, grid=%s', owner, grid)
 
     #
     # Update collection 'u{}_deployed_devices'
     #
-    ## first find one based on given grid; use result to learn id & type
-    result = await info.storage.find_one (
-        f'u{univ}_deployed_devices',
-        {
-            'grid'  : grid.to_json ()
-        }
-    )
+    ## first find the utx at the given grid; use result to learn id, type and how many cells will be picked up
+    state = info.context.cache.universe (univ)
+    result = await _get_deployed_at (info, univ, grid)
     ## SAFEGUARD: if for some reason the result is None, don't continue
     ## (experienced once with Open Alpha Civ#1 with a tx attempted to pickup something that was already picked up,
     ##  yet the tx didn't revert and event was still emitted)
     if not result:
-        print(f'>>> Exception: errorneous event encountered; this result should not have been None')
+        log.warning ('erroneous %s event encountered; this result should not have been None', event.name)
         return
 
-    utx_label_str = result ['id']
-    utx_device_type = result ['type']
-
-    ## then find all document matching the id to learn how many will be picked up
-    result_iter = await info.storage.find (
-        collection = f'u{univ}_deployed_devices',
-        filter = {'id' : utx_label_str},
-        skip = 0,
-        limit = 0
-    )
-    pickedup_count = sum(1 for _ in result_iter) # ref: https://stackoverflow.com/questions/3345785/getting-number-of-elements-in-an-iterator-in-python
+    utx_label_str, entry = result
+    utx_device_type = entry ['type']
+    pickedup_count = len (entry ['cells'])
     # print (f'  -- picking up {pickedup_count} utx of type {utx_device_type}')
 
     ## delete all documents matching the id; under the hood delete_many uses pymongo's update_many
     result = await info.storage.delete_many (
-        f'u{univ}_deployed_devices',
+        info.context.deployed.collection (univ),
         {
             'id'    : utx_label_str
         }
     )
+    state.remove_deployed (utx_label_str)
 
     # result = await info.storage.find_one_and_delete ( # delete one
     #     f'u{univ}_deployed_devices',
@@ -622,6 +874,12 @@ async def handle_player_pickup_utx_occurred (info, event, univ):
         {'account' : str(owner)},
         {'$inc' : {str(utx_device_type) : pickedup_count}}
     )
+    state.update_balance (str(owner), {'$inc' : {str(utx_device_type) : pickedup_count}})
+
+    #
+    # Update collection 'u{}_player_inventories'
+    #
+    await info.context.inventories.remove_utx_set (info.storage, univ, str(owner), utx_label_str, utx_device_type, pickedup_count)
 
     #
     # Update collection 'u{}_deployed_utx_sets'
@@ -633,133 +891,150 @@ async def handle_player_pickup_utx_occurred (info, event, univ):
             'label' : utx_label_str
         }
     )
+    state.utx_sets.pop (utx_label_str)
     # assert result.modified_count == 1
 
+    #
+    # Update collection 'u{}_utx_tethers'
+    #
+    await info.storage.delete_many (
+        tethers_collection (univ),
+        {'label' : utx_label_str}
+    )
+    state.remove_tethers_of_label (utx_label_str)
+
 
-async def handle_resource_update_at_harvester_occurred (info, event, univ):
+@EVENTS.universe ('resource_update_at_harvester_occurred')
+async def handle_resource_update_at_harvester_occurred (info, event, univ, block_number):
 
     #
     # Decode event
     #
-    device_id, new_quantity = decode_resource_update_at_harvester_occurred_event (event)
-    print(f'> device_id={device_id}, new_quantity={new_quantity}\n')
+    device_id, new_quantity = decode_resource_update_at_harvester_occurred (event.data)
+    trace ('device_id=%s, new_quantity=%s', device_id, new_quantity)
     # print (f'    -- resource update at harvester: device_id={device_id}, new_quantity={new_quantity}')
 
     #
     # Update collection 'u{i}_deployed_harvesters'
     # -- document structure: {id, device_type, resource, energy}
+    # -- written once per block with the device's other resource / energy updates
     #
-    await info.storage.find_one_and_update (
+    await info.storage.coalesce_update (
         collection = f'u{univ}_harvesters',
         filter = {'id' : str(device_id)},
         update = {
             '$set' : {'resource' : new_quantity}
         }
     )
+    await _update_inventory_device (info, univ, str(device_id), {'resource' : new_quantity})
 
 
-async def handle_resource_update_at_transformer_occurred (info, event, univ):
+@EVENTS.universe ('resource_update_at_transformer_occurred')
+async def handle_resource_update_at_transformer_occurred (info, event, univ, block_number):
 
     #
     # Decode event
     #
-    device_id, new_quantity_pre, new_quantity_post = decode_resource_update_at_transformer_occurred_event (event)
-    print(f'> device_id={device_id}, new_quantity_pre={new_quantity_pre}, new_quantity_post={new_quantity_post}\n')
+    device_id, new_quantity_pre, new_quantity_post = decode_resource_update_at_transformer_occurred (event.data)
+    trace ('device_id=%s, new_quantity_pre=%s, new_quantity_post=%s', device_id, new_quantity_pre, new_quantity_post)
     # print (f'    -- resource update at transformer: device_id={device_id}, new_quantity_pre={new_quantity_pre}, new_quantity_post={new_quantity_post}')
 
     #
     # Update collection 'u{i}_deployed_transformers'
     # -- document structure: {id, device_type, resource_pre, resource_post, energy}
     #
-    await info.storage.find_one_and_update (
+    await info.storage.coalesce_update (
         collection = f'u{univ}_transformers',
         filter = {'id' : str(device_id)},
         update = {
-            '$set' : {'resource_pre'  : new_quantity_pre},
-            '$set' : {'resource_post' : new_quantity_post}
+            '$set' : {
+                'resource_pre'  : new_quantity_pre,
+                'resource_post' : new_quantity_post
+            }
         }
     )
+    await _update_inventory_device (info, univ, str(device_id), {'resource_pre' : new_quantity_pre, 'resource_post' : new_quantity_post})
 
 
-async def handle_resource_update_at_upsf_occurred (info, event, univ):
+@EVENTS.universe ('resource_update_at_upsf_occurred')
+async def handle_resource_update_at_upsf_occurred (info, event, univ, block_number):
 
     #
     # Decode event
     #
-    device_id, element_type, new_quantity = decode_resource_update_at_upsf_occurred_event (event)
-    print(f'> device_id={device_id}, element_type={element_type}, new_quantity={new_quantity}\n')
+    device_id, element_type, new_quantity = decode_resource_update_at_upsf_occurred (event.data)
+    trace ('device_id=%s, element_type=%s, new_quantity=%s', device_id, element_type, new_quantity)
     # print (f'    -- resource update at upsf: device_id={device_id}, element_type={element_type}, new_quantity={new_quantity}')
 
     #
     # Update collection 'u{i}_deployed_upsfs'
     # -- document structure: {id, resource_0, resource_1, ..., resource_9}
     #
-    await info.storage.find_one_and_update (
+    await info.storage.coalesce_update (
         collection = f'u{univ}_upsfs',
         filter = {'id' : str(device_id)},
         update = {
             '$set' : {f'resource_{element_type}' : new_quantity}
         }
     )
+    await _update_inventory_device (info, univ, str(device_id), {f'resource_{element_type}' : new_quantity})
 
 
-async def handle_energy_update_at_device_occurred (info, event, univ):
+@EVENTS.universe ('energy_update_at_device_occurred')
+async def handle_energy_update_at_device_occurred (info, event, univ, block_number):
 
     #
     # Decode event
     #
-    device_id, new_quantity = decode_energy_update_at_device_occurred_event (event)
-    print(f'> device_id={device_id}, new_quantity={new_quantity}\n')
+    device_id, new_quantity = decode_energy_update_at_device_occurred (event.data)
+    trace ('device_id=%s, new_quantity=%s', device_id, new_quantity)
 
     #
     # Find device type and determine if harvester / transformer / upsf / ndpe
     #
-    result = await info.storage.find_one (
-        f'u{univ}_deployed_devices',
-        {'id' : str(device_id)}
-    )
+    result = await _get_deployed_by_id (info, univ, str(device_id))
     ## SAFEGUARD: if for some reason the result is None, don't continue
     ## (experienced once with Open Alpha Civ#2 with a tx attempted to update energy on a device id that was already picked up,
     ##  yet the tx didn't revert and event was still emitted)
     if not result:
-        print(f'>>> Exception: errorneous event encountered; this result should not have been None')
+        log.warning ('erroneous %s event encountered; this result should not have been None', event.name)
         return
     device_type = int (result ['type'])
     # print (f'    -- energy update at device: device_type={device_type}, device_id={device_id}, new_quantity={new_quantity}')
 
     #
-    # Update collection according to device_type
+    # Update collection according to device_type, once per block with the device's other updates
     #
     if (device_type in PG_TYPES):
-        await info.storage.find_one_and_update (
+        await info.storage.coalesce_update (
             f'u{univ}_pgs',
             {'id' : str(device_id)},
             {'$set' : {'energy' : new_quantity}}
         )
 
     elif (device_type in HARVESTER_TYPES):
-        await info.storage.find_one_and_update (
+        await info.storage.coalesce_update (
             f'u{univ}_harvesters',
             {'id' : str(device_id)},
             {'$set' : {'energy' : new_quantity}}
         )
 
     elif (device_type in TRANSFORMER_TYPES):
-        await info.storage.find_one_and_update (
+        await info.storage.coalesce_update (
             f'u{univ}_transformers',
             {'id' : str(device_id)},
             {'$set' : {'energy' : new_quantity}}
         )
 
     elif (device_type == UPSF_TYPE):
-        await info.storage.find_one_and_update (
+        await info.storage.coalesce_update (
             f'u{univ}_upsfs',
             {'id' : str(device_id)},
             {'$set' : {'energy' : new_quantity}}
         )
 
     elif (device_type == NDPE_TYPE):
-        await info.storage.find_one_and_update (
+        await info.storage.coalesce_update (
             f'u{univ}_ndpes',
             {'id' : str(device_id)},
             {'$set' : {'energy' : new_quantity}}
@@ -768,30 +1043,24 @@ async def handle_energy_update_at_device_occurred (info, event, univ):
     else:
         raise Exception ('Invalid device type')
 
+    await info.context.inventories.update_device_state (info.storage, univ, result ['owner'], str(device_id), {'energy' : new_quantity})
+
 
+@EVENTS.universe ('impulse_applied_occurred')
 async def handle_impulse_applied_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    # impulse, plnt_q_before_impulse = decode_impulse_applied_occurred_event (event)
-    impulse = decode_impulse_applied_occurred_event (event)
-    impulse_json = impulse.to_json ()
-    print(f'> impulse_json={impulse_json}\n')
+    # impulse, plnt_q_before_impulse = decode_impulse_applied_occurred (event.data)
+    impulse_json = decode_impulse_applied_occurred (event.data)
+    trace ('impulse_json=%s', impulse_json)
     # plnt_q_before_impulse_json = plnt_q_before_impulse.to_json ()
 
     #
     # Update collection 'impulses'
     #
 
-    macro_states = await info.storage.find (
-        collection = f'u{univ}_macro_states',
-        filter = {},
-        skip = 0,
-        limit = 0
-    )
-    macro_states = list (macro_states)
-    macro_states.sort (key = lambda doc : doc ['block_number'], reverse = True)
-    most_recent_macro_state = macro_states[0]
+    most_recent_macro_state = await _get_latest_macro_state (info, univ)
 
     await info.storage.insert_one (
         f'u{univ}_impulses',
@@ -802,40 +1071,43 @@ async def handle_impulse_applied_occurred (info, event, univ, block_number):
         }
     )
 
-    print (f"  -- impulse applied: Vec2({impulse_json['x']},{impulse_json['y']}), block_number={block_number}")
-    print (f"  -- most recent macro state: {most_recent_macro_state}")
+    trace ('impulse applied: Vec2(%s,%s), block_number=%s', impulse_json['x'], impulse_json['y'], block_number)
+    trace ('most recent macro state: %s', most_recent_macro_state)
 
 
+@EVENTS.universe ('player_transfer_undeployed_fungible_device_occurred')
 async def handle_player_transfer_undeployed_fungible_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    src_account, dst_account, device_type, device_amount = decode_player_transfer_undeployed_fungible_device_occurred_event (event)
-    print (f'> src_account={src_account}, dst_account={dst_account}, device_type={device_type}, device_amount={device_amount}\n')
+    src_account, dst_account, device_type, device_amount = decode_player_transfer_undeployed_fungible_device_occurred (event.data)
+    trace ('src_account=%s, dst_account=%s, device_type=%s, device_amount=%s', src_account, dst_account, device_type, device_amount)
 
     #
-    # Update collection 'u{}_player_fungible_balances'
+    # Update collections 'u{}_player_fungible_balances' and 'u{}_player_inventories';
+    # an inventory follows its account's balance, if there is one
     #
-    await info.storage.find_one_and_update (
-        f'u{univ}_player_fungible_balances',
-        {'account' : str(src_account)},
-        {'$inc' : {str(device_type) : -1*device_amount}}
-    )
-    await info.storage.find_one_and_update (
-        f'u{univ}_player_fungible_balances',
-        {'account' : str(dst_account)},
-        {'$inc' : {str(device_type) : +1*device_amount}}
-    )
+    state = info.context.cache.universe (univ)
+    for account, amount in ((src_account, -1*device_amount), (dst_account, +1*device_amount)):
+        result = await info.storage.find_one_and_update (
+            f'u{univ}_player_fungible_balances',
+            {'account' : str(account)},
+            {'$inc' : {str(device_type) : amount}}
+        )
+        state.update_balance (str(account), {'$inc' : {str(device_type) : amount}})
+        if result is not None:
+            await info.context.inventories.add_balance (info.storage, univ, str(account), device_type, amount)
 
 
+@EVENTS.universe ('player_transfer_undeployed_nonfungible_device_occurred')
 async def handle_player_transfer_undeployed_nonfungible_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    src_account, dst_account, device_id = decode_player_transfer_undeployed_nonfungible_device_occurred_event (event)
-    print (f'> src_account={src_account}, dst_account={dst_account}, device_id={device_id}\n')
+    src_account, dst_account, device_id = decode_player_transfer_undeployed_nonfungible_device_occurred (event.data)
+    trace ('src_account=%s, dst_account=%s, device_id=%s', src_account, dst_account, device_id)
 
-    await info.storage.find_one_and_update (
+    result = await info.storage.find_one_and_update (
         collection = f'u{univ}_player_nonfungible_devices',
         filter = {
             'id' : str(device_id),
@@ -843,18 +1115,28 @@ async def handle_player_transfer_undeployed_nonfungible_device_occurred (info, e
         },
         update = {'$set' : {'owner' : str(dst_account)}}
     )
+    device = info.context.cache.universe (univ).devices.peek (str(device_id))
+    if device is not None and device ['owner'] == str(src_account):
+        device ['owner'] = str(dst_account)
 
+    #
+    # Move the device between the 'u{}_player_inventories' documents
+    #
+    if result is not None:
+        await info.context.inventories.move_device (info.storage, univ, str(src_account), str(dst_account), str(device_id))
 
+
+@EVENTS.universe ('player_upsf_build_fungible_device_occurred')
 async def handle_player_upsf_build_fungible_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, grid, device_type, device_count = decode_player_transfer_undeployed_nonfungible_device_occurred_event (event)
+    owner, grid, device_type, device_count = decode_player_upsf_build_fungible_device_occurred (event.data)
 
     #
     # Update db
     #
-    await info.storage.find_one_and_update (
+    result = await info.storage.find_one_and_update (
         collection = f'u{univ}_player_fungible_balances',
         filter = {'account' : str(owner)},
         update = {
@@ -862,13 +1144,20 @@ async def handle_player_upsf_build_fungible_device_occurred (info, event, univ,
             '$set' : {'block_number' : block_number}
         }
     )
+    info.context.cache.universe (univ).update_balance (str(owner), {
+        '$inc' : {str(device_type) : device_count},
+        '$set' : {'block_number' : block_number}
+    })
+    if result is not None:
+        await info.context.inventories.add_balance (info.storage, univ, str(owner), device_type, device_count)
 
 
+@EVENTS.universe ('create_new_nonfungible_device_occurred')
 async def handle_create_new_nonfungible_device_occurred (info, event, univ, block_number):
     #
     # Decode event
     #
-    owner, device_type, device_id = decode_player_transfer_undeployed_nonfungible_device_occurred_event (event)
+    owner, device_type, device_id = decode_create_new_nonfungible_device_occurred (event.data)
 
     #
     # Update db 'u{univ}_player_nonfungible_devices'
@@ -882,101 +1171,111 @@ async def handle_create_new_nonfungible_device_occurred (info, event, univ, bloc
             'is_deployed' : False
         }
     )
+    info.context.cache.universe (univ).put_device (str(device_id), str(owner), device_type, False)
 
     #
     # Update db for resource & energy balances
     #
+    collection, document = None, None
     if (device_type in PG_TYPES):
-        await info.storage.insert_one (
-            f'u{univ}_pgs',
-            {
-                'id' : str(device_id),
-                'type'  : str(device_type),
-                'energy' : 0
-            }
-        )
+        collection = f'u{univ}_pgs'
+        document = {
+            'id' : str(device_id),
+            'type'  : str(device_type),
+            'energy' : 0
+        }
 
     elif (device_type in HARVESTER_TYPES):
-        await info.storage.insert_one (
-            f'u{univ}_harvesters',
-            {
-                'id' : str(device_id),
-                'type'  : str(device_type),
-                'resource' : 0,
-                'energy' : 0
-            }
-        )
+        collection = f'u{univ}_harvesters'
+        document = {
+            'id' : str(device_id),
+            'type'  : str(device_type),
+            'resource' : 0,
+            'energy' : 0
+        }
 
     elif (device_type in TRANSFORMER_TYPES):
-        await info.storage.insert_one (
-            f'u{univ}_transformers',
-            {
-                'id' : str(device_id),
-                'type'  : str(device_type),
-                'resource_pre' : 0,
-                'resource_post' : 0,
-                'energy' : 0
-            }
-        )
+        collection = f'u{univ}_transformers'
+        document = {
+            'id' : str(device_id),
+            'type'  : str(device_type),
+            'resource_pre' : 0,
+            'resource_post' : 0,
+            'energy' : 0
+        }
 
     elif (device_type == UPSF_TYPE):
-        await info.storage.insert_one (
-            f'u{univ}_upsfs',
-            {
-                'id' : str(device_id),
-                'resource_0' : 0,
-                'resource_1' : 0,
-                'resource_2' : 0,
-                'resource_3' : 0,
-                'resource_4' : 0,
-                'resource_5' : 0,
-                'resource_6' : 0,
-                'resource_7' : 0,
-                'resource_8' : 0,
-                'resource_9' : 0,
-                'energy' : 0
-            }
-        )
+        collection = f'u{univ}_upsfs'
+        document = {
+            'id' : str(device_id),
+            'resource_0' : 0,
+            'resource_1' : 0,
+            'resource_2' : 0,
+            'resource_3' : 0,
+            'resource_4' : 0,
+            'resource_5' : 0,
+            'resource_6' : 0,
+            'resource_7' : 0,
+            'resource_8' : 0,
+            'resource_9' : 0,
+            'energy' : 0
+        }
 
     elif (device_type == NDPE_TYPE):
-        await info.storage.insert_one (
-            f'u{univ}_ndpes',
-            {
-                'id' : str(device_id),
-                'energy' : 0
-            }
-        )
+        collection = f'u{univ}_ndpes'
+        document = {
+            'id' : str(device_id),
+            'energy' : 0
+        }
+
+    state = {}
+    if document is not None:
+        state = device_state (document)
+        await info.storage.insert_one (collection, document)
+
+    #
+    # Update db 'u{univ}_player_inventories' with the device and its resource & energy balances
+    #
+    await info.context.inventories.add_device (info.storage, univ, str(owner), str(device_id), device_type, state)
 
 #
 # Lobby
 #
-async def handle_universe_activation_occurred (info, event):
+@EVENTS.lobby ('universe_activation_occurred')
+async def handle_universe_activation_occurred (info, event, block_number):
 
     #
     # Decode event
     #
-    event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr = decode_universe_activation_occurred_event (event)
-    print(f'> event_counter={event_counter}, universe_idx={universe_idx}, universe_adr={universe_adr}, arr_player_adr_len={arr_player_adr_len}, arr_player_adr={arr_player_adr}\n')
+    event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr = decode_universe_activation_occurred (event.data)
+    trace ('event_counter=%s, universe_idx=%s, universe_adr=%s, arr_player_adr_len=%s, arr_player_adr=%s', event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr)
     # print (f"    -- event_counter={event_counter}, universe_idx={universe_idx}, universe_adr={universe_adr}, arr_player_adr_len={arr_player_adr_len}, arr_player_adr={arr_player_adr}")
     univ = universe_idx-777
 
     #
     # Update collection `u{}_player_fungible_balances`
     # Record in player_balances ~ {account, 0, 1, 2, ..., 15}, where 0-15 is the enumeration of device types
+    # -- only by the shard of the universe; the lobby coordinator handles `lobby_queue` below
     #
     # assert arr_player_adr_len == CIV_SIZE
-    for player_index, account in enumerate (arr_player_adr):
+    if info.context.shard.owns (univ, block_number):
+        for player_index, account in enumerate (arr_player_adr):
 
-        await info.storage.find_one_and_update (
-            f'u{univ}_player_fungible_balances',
-            {'account' : str(account)},
-            {'$set': {'player_index' : player_index}}
-        )
+            result = await info.storage.find_one_and_update (
+                f'u{univ}_player_fungible_balances',
+                {'account' : str(account)},
+                {'$set': {'player_index' : player_index}}
+            )
+            info.context.cache.universe (univ).update_balance (str(account), {'$set': {'player_index' : player_index}})
+            if result is not None:
+                await info.context.inventories.set_player_index (info.storage, univ, str(account), player_index)
 
     #
     # Update collection `lobby_queue`
     # -- document structure: {queue_idx, account, expired}
     #
+    if not info.context.shard.owns_lobby (block_number):
+        return
     for account in arr_player_adr:
         result = await info.storage.find_one_and_update (
             collection = 'lobby_queue',
@@ -988,14 +1287,42 @@ async def handle_universe_activation_occurred (info, event):
         )
 
 
-async def handle_universe_deactivation_occurred (info, event):
+@EVENTS.lobby ('universe_deactivation_occurred')
+async def handle_universe_deactivation_occurred (info, event, block_number):
     #
     # Decode event
     #
-    event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr = decode_universe_deactivation_occurred_event (event)
-    print (f"> event_counter={event_counter}, universe_idx={universe_idx}, universe_adr={universe_adr}, arr_player_adr_len={arr_player_adr_len}, arr_player_adr={arr_player_adr}\n")
+    event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr = decode_universe_deactivation_occurred (event.data)
+    trace ('event_counter=%s, universe_idx=%s, universe_adr=%s, arr_player_adr_len=%s, arr_player_adr=%s', event_counter, universe_idx, universe_adr, arr_player_adr_len, arr_player_adr)
     univ = universe_idx-777
 
+    # only the shard of the universe clears it
+    if not info.context.shard.owns (univ, block_number):
+        return
+
+    #
+    # Forget the cached state of this universe
+    #
+    info.context.cache.reset_universe (univ)
+
+    #
+    # Update collection 'u{}_civ_state'
+    #
+    await info.storage.find_one_and_update (
+        f'u{univ}_civ_state',
+        {"active" : 1},
+        {"$set" : {"active" : 0}},
+    )
+
+    #
+    # In epoch reset mode, move the universe to fresh collections;
+    # the previous epoch is dropped in the background once the block is committed
+    #
+    if info.context.epochs.enabled:
+        info.context.epochs.advance (info.storage, univ)
+        info.context.trajectory.forget (univ)
+        return
+
     #
     # Clear collection 'u{}_player_fungible_balances'
     #
@@ -1011,30 +1338,28 @@ async def handle_universe_deactivation_occurred (info, event):
     #
     await info.storage.delete_many (f'u{univ}_player_nonfungible_devices', {})
 
-
     #
-    # Clear collection 'u{}_deployed_devices'
+    # Clear collection 'u{}_player_inventories'
     #
-    await info.storage.delete_many (f'u{univ}_deployed_devices', {})
+    await info.storage.delete_many (inventories_collection (univ), {})
+
 
     #
-    # Update collection 'u{}_civ_state'
+    # Clear collection 'u{}_deployed_devices'
     #
-    await info.storage.find_one_and_update (
-        f'u{univ}_civ_state',
-        {"active" : 1},
-        {"$set" : {"active" : 0}},
-    )
+    await info.storage.delete_many (info.context.deployed.collection (univ), {})
 
     #
     # Clear collection 'u{}_macro_states'
     #
     await info.storage.delete_many (f'u{univ}_macro_states', {})
+    info.context.trajectory.reset (info.storage, univ)
 
     #
     # Clear collections for all device types
     #
     await info.storage.delete_many (f'u{univ}_deployed_utx_sets', {})
+    await info.storage.delete_many (tethers_collection (univ), {})
     await info.storage.delete_many (f'u{univ}_pgs', {})
     await info.storage.delete_many (f'u{univ}_harvesters', {})
     await info.storage.delete_many (f'u{univ}_transformers', {})
@@ -1047,12 +1372,16 @@ async def handle_universe_deactivation_occurred (info, event):
     await info.storage.delete_many (f'u{univ}_impulses', {})
 
 
-async def handle_ask_to_queue_occurred (info, event):
+@EVENTS.lobby ('ask_to_queue_occurred')
+async def handle_ask_to_queue_occurred (info, event, block_number):
     #
     # Decode event
     #
-    account, queue_idx = decode_ask_to_queue_occurred_event (event)
-    print(f'account={account}, queue_idx={queue_idx}\n')
+    account, queue_idx = decode_ask_to_queue_occurred (event.data)
+    trace ('account=%s, queue_idx=%s', account, queue_idx)
+
+    if not info.context.shard.owns_lobby (block_number):
+        return
 
     #
     # Update collection `lobby_queue`
@@ -1068,12 +1397,13 @@ async def handle_ask_to_queue_occurred (info, event):
     )
 
 
-async def handle_give_invitation_occurred (info, event):
+@EVENTS.lobby ('give_invitation_occurred')
+async def handle_give_invitation_occurred (info, event, block_number):
     #
     # Decode event
     #
-    account = decode_give_invitation_occurred_event (event)
-    print(f'> account={account}\n')
+    account = decode_give_invitation_occurred (event.data)
+    trace ('account=%s', account)
 
     return
 
@@ -1087,19 +1417,141 @@ async def handle_block (info: Info, block: NewBlock):
     # Use the provided RPC client to fetch the current block data.
     # The client is already initialized with the correct network based
     # on the indexer's settings.
-    print(f'> new live block at {block.new_head}')
+    HEAD_BLOCK.set (block.new_head.number)
+    BLOCK_LAG.set (max (0, block.new_head.number - INDEXED_BLOCK.value ()))
+    log.debug ('new live block at %s', block.new_head)
 
 
 #
 # Main
 #
-async def run_indexer (server_url=None, mongo_url=None, restart=None):
+def prepare_context (db, recorder = None, check_plans = True, views = None, shard = None):
+    """Set up the collections and warm the in-memory universe state from the documents indexed so far"""
+    deployed = DeployedDevices (DEPLOYED_DEVICES_MODE)
+    context = IndexerContext (
+        cache = UniverseStateCache (max_entries = CACHE_MAX_ENTRIES),
+        deployed = deployed,
+        trajectory = MacroTrajectory (bucket_blocks = TRAJECTORY_BUCKET_BLOCKS),
+        inventories = PlayerInventories (DEVICE_TYPE_COUNT),
+        epochs = UniverseEpochs (UNIVERSE_RESET_MODE, deployed),
+        recorder = recorder,
+        shard = shard or ShardState (universes = list (ISAAC_UNIVERSE_ADDRESSES.keys())),
+        dispatch = EVENTS.build (ISAAC_UNIVERSE_ADDRESSES, ISAAC_LOBBY_ADDRESS)
+    )
+    # a shard worker sets up its own universes only; the lobby coordinator none of them
+    universes = context.shard.owned ()
+    # undo the writes of a block that was not committed, before anything is read
+    context.shard.load (db)
+    recover (db, context.shard, context.epochs, context.trajectory)
+    context.epochs.load (db, universes)
+    context.epochs.ensure (db, universes)
+    for univ in universes:
+        context.deployed.ensure (db, univ)
+    for index in ensure_indexes (db, universes, context.deployed, resolve = context.epochs.collection, lobby = context.shard.role.lobby):
+        log.info ('created index %s', index)
+    for query in check_query_plans (db, universes, context.deployed, resolve = context.epochs.collection) if check_plans else []:
+        log.warning ('%s scans %s for %s', query.handler, query.collection, query.filter)
+    for univ in universes:
+        backfill_tethers (db, univ, context.deployed, resolve = context.epochs.collection)
+        backfill_inventories (db, univ, context.deployed, DEVICE_TYPE_COUNT, resolve = context.epochs.collection)
+    context.cache.warm (db, universes, context.deployed)
+    context.trajectory.warm (db, universes, resolve = context.epochs.collection)
+    if views is not None:
+        views.load (db, universes, context.epochs, context.deployed)
+        context.views = views
+    return context
+
+
+def event_filters (role = None):
+    """Events indexed by a process: all of them, or those of a shard worker or of the lobby coordinator"""
+    role = role or ShardRole ()
+    universes = [univ for univ in ISAAC_UNIVERSE_ADDRESSES.keys() if role.universes is None or univ in role.universes]
+    # shard workers still need the lobby events that touch their universes
+    lobby_events = LOBBY_EVENT_LIST if role.lobby else UNIVERSE_LOBBY_EVENT_LIST
+    return [
+        #
+        # from universe.cairo
+        #
+        EventFilter.from_event_name (
+            name    = name,
+            address = ISAAC_UNIVERSE_ADDRESSES [univ].replace ('0x', '')
+        )
+        for univ in universes for name in UNIVERSE_EVENT_LIST
+    ] + [
+        #
+        # from lobby.cairo
+        #
+        EventFilter.from_event_name (
+            name    = name,
+            address = ISAAC_LOBBY_ADDRESS.replace ('0x', '')
+        )
+        for name in lobby_events
+    ]
+
+
+async def indexer_plugin (mongo, role, read_api_port = 0):
+    """The isaac indexer of `role` on the pooled client `mongo`, to run alone or in an `IndexerHost`"""
+    db = mongo.database (_indexer_db_name ()).db
+    # recovery, indexes and warming the caches read the database at length: keep them off the event loop
+    context = await mongo.run (
+        prepare_context,
+        db,
+        recorder = RecordingWriter (RECORD_PATH) if RECORD_PATH else None,
+        views = MaterializedViews (retention_blocks = READ_API_RETENTION_BLOCKS) if read_api_port else None,
+        shard = ShardState (role, list (ISAAC_UNIVERSE_ADDRESSES.keys()))
+    )
+    # shard workers have their own indexer ids, but all write to the database of INDEXER_ID
+    context.db = db
+    context.mongo = mongo
+    if read_api_port:
+        hub = PushHub (max_pending = PUSH_MAX_PENDING, max_changes = PUSH_MAX_CHANGES)
+        await read_api.start (context.views, read_api_port, READ_API_HOST, hub)
+        log.info ('read API on http://%s:%s/universes/', READ_API_HOST, read_api_port)
+
+    return Plugin (
+        name = role.indexer_id,
+        db_name = _indexer_db_name (),
+        filters = event_filters (role),
+        index_from_block = context.shard.start_block (BIRTH_BLOCK - 1),
+        handle_events = handle_events,
+        handle_block = handle_block,
+        context = context,
+        registry = REGISTRY
+    )
+
+
+async def _delete_apibara_indexer (server_url, indexer_id):
+    async with Client.connect(server_url) as client:
+        existing = await client.indexer_client().get_indexer(indexer_id)
+        if existing:
+            await client.indexer_client().delete_indexer(indexer_id)
+
+
+async def _rewind_apibara_indexer (server_url, indexer_id, block_number):
+    """Recreate the Apibara indexer from `block_number` if it streamed past it"""
+    async with Client.connect(server_url) as client:
+        existing = await client.indexer_client().get_indexer(indexer_id)
+        if existing and existing.indexed_to_block > block_number:
+            log.warning ('%s was streamed up to block %s, committed up to block %s: rewinding', indexer_id, existing.indexed_to_block, block_number)
+            await client.indexer_client().delete_indexer(indexer_id)
+
+
+async def run_indexer (server_url=None, mongo_url=None, restart=None, role=None, port_offset=0):
+    logging.basicConfig (level = LOG_LEVEL, format = '%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # processes started together serve on consecutive ports
+    metrics_port = METRICS_PORT + port_offset if METRICS_PORT else 0
+    read_api_port = READ_API_PORT + port_offset if READ_API_PORT else 0
+    if metrics_port:
+        serve (metrics_port)
+        log.info ('metrics on http://127.0.0.1:%s/metrics', metrics_port)
+
+    # without ISAAC_SHARDS, one process indexes everything under INDEXER_ID
+    role = role or ShardRole (INDEXER_ID)
+    mongo, indexer_db = _indexer_mongo (mongo_url)
 
     if restart:
-        async with Client.connect(server_url) as client:
-            existing = await client.indexer_client().get_indexer(INDEXER_ID)
-            if existing:
-                await client.indexer_client().delete_indexer(INDEXER_ID)
+        await _delete_apibara_indexer (server_url, role.indexer_id)
+        await mongo.run (ShardState (role, list (ISAAC_UNIVERSE_ADDRESSES.keys())).forget, indexer_db.db)
 
     runner = IndexerRunner(
         config=IndexerRunnerConfiguration(
@@ -1107,111 +1559,76 @@ async def run_indexer (server_url=None, mongo_url=None, restart=None):
             storage_url=mongo_url,
         ),
         network_name="starknet-goerli",
-        indexer_id=INDEXER_ID,
+        indexer_id=role.indexer_id,
         new_events_handler=handle_events,
     )
+    _use_pool (runner, mongo, role.indexer_id)
     runner.add_block_handler(handle_block)
 
+    plugin = await indexer_plugin (mongo, role, read_api_port)
+    plugin.context.group = GroupCommit (
+        max_blocks = GROUP_COMMIT_BLOCKS,
+        max_requests = GROUP_COMMIT_MAX_REQUESTS,
+        enter_lag = GROUP_COMMIT_LAG_BLOCKS,
+        exit_lag = LIVE_LAG_BLOCKS
+    )
+    if plugin.context.group.enabled and not restart:
+        # the blocks of a group open when the process stopped were acknowledged, not written
+        await _rewind_apibara_indexer (server_url, role.indexer_id, plugin.index_from_block)
+    runner.set_context (plugin.context)
+
     # Create the indexer if it doesn't exist on the server,
     # otherwise it will resume indexing from where it left off.
     #
     # For now, this also helps the SDK map between human-readable
     # event names and StarkNet events.
     runner.create_if_not_exists(
-        filters=[
-            #
-            # from universe.cairo
-            #
-            EventFilter.from_event_name (
-                name    = 'forward_world_macro_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'give_undeployed_fungible_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'activate_universe_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_deploy_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_pickup_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_deploy_utx_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_pickup_utx_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'resource_update_at_harvester_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'resource_update_at_transformer_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'resource_update_at_upsf_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'energy_update_at_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'impulse_applied_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_transfer_undeployed_fungible_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_transfer_undeployed_nonfungible_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'player_upsf_build_fungible_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'create_new_nonfungible_device_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'terminate_universe_occurred',
-                address = ISAAC_UNIVERSE_ADDRESSES [0].replace ('0x', '')
-            ),
-
-            #
-            # from lobby.cairo
-            #
-            EventFilter.from_event_name (
-                name    = 'universe_activation_occurred',
-                address = ISAAC_LOBBY_ADDRESS.replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'universe_deactivation_occurred',
-                address = ISAAC_LOBBY_ADDRESS.replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'ask_to_queue_occurred',
-                address = ISAAC_LOBBY_ADDRESS.replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'give_invitation_occurred',
-                address = ISAAC_LOBBY_ADDRESS.replace ('0x', '')
-            )
-        ],
-        index_from_block = BIRTH_BLOCK - 1
+        filters = plugin.filters,
+        index_from_block = plugin.index_from_block
+    )
+
+    await runner.run()
+
+
+async def run_host (server_url=None, mongo_url=None, restart=None, plugins=('isaac',)):
+    """Run the isaac indexer and the other `plugins` on one Apibara stream, as HOST_ID"""
+    logging.basicConfig (level = LOG_LEVEL, format = '%(asctime)s %(levelname)s %(name)s: %(message)s')
+    mongo, indexer_db = _indexer_mongo (mongo_url)
+    role = ShardRole (INDEXER_ID)
+    if restart:
+        await _delete_apibara_indexer (server_url, HOST_ID)
+        await mongo.run (ShardState (role, list (ISAAC_UNIVERSE_ADDRESSES.keys())).forget, indexer_db.db)
+
+    loaded = []
+    for name in plugins:
+        if name == 'isaac':
+            loaded.append (await indexer_plugin (mongo, role, READ_API_PORT))
+        elif name == 's2m2':
+            loaded.append (s2m2_plugin ())
+        else:
+            raise ValueError (f'Unknown plugin {name}')
+    host = IndexerHost (loaded, indexer_db)
+    if restart:
+        await host.forget ()
+    await host.load ()
+    if METRICS_PORT:
+        serve (METRICS_PORT, registry = host.registry ())
+        log.info ('metrics of %s on http://127.0.0.1:%s/metrics', ', '.join (plugins), METRICS_PORT)
+
+    runner = IndexerRunner(
+        config=IndexerRunnerConfiguration(
+            apibara_url=server_url,
+            storage_url=mongo_url,
+        ),
+        network_name="starknet-goerli",
+        indexer_id=HOST_ID,
+        new_events_handler=host.handle_events,
+    )
+    _use_pool (runner, mongo, HOST_ID)
+    runner.add_block_handler(host.handle_block)
+    runner.create_if_not_exists(
+        filters = host.filters (),
+        index_from_block = host.index_from_block ()
     )
 
     await runner.run()
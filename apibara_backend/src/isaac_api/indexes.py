@@ -0,0 +1,162 @@
+"""Expected indexes of the isaac indexer collections, and query plan checks
+
+Every handler read goes through apibara's chain-aware storage, which adds
+`_chain.valid_to: None` to the filter, so each index leads with the handler's
+equality fields followed by `_chain.valid_to`.
+
+`canonical_queries` lists the lookups the handlers issue; `check_query_plans`
+explains them and reports the ones whose winning plan is a COLLSCAN. Deactivation
+clears whole collections and is deliberately left out.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.database import Database
+
+from isaac_api.footprint import DeployedDevices
+from isaac_api.inventory import inventories_collection
+from isaac_api.tethers import tethers_collection
+from isaac_api.trajectory import trajectory_collection
+
+Document = Dict[str, Any]
+Keys = List[Tuple[str, int]]
+
+CURRENT = ('_chain.valid_to', ASCENDING)
+
+
+def _current (*fields: str) -> Keys:
+    return [(f, ASCENDING) for f in fields] + [CURRENT]
+
+
+def universe_indexes (univ: int, deployed: DeployedDevices) -> Dict[str, List[IndexModel]]:
+    """collection => expected indexes, for universe `univ`"""
+    return {
+        f'u{univ}_player_fungible_balances'   : [IndexModel (_current ('account'))],
+        f'u{univ}_player_nonfungible_devices' : [IndexModel (_current ('id')), IndexModel (_current ('owner'))],
+        inventories_collection (univ)         : [IndexModel (_current ('account'))],
+        deployed.collection (univ)            : [
+            IndexModel (_current ('id')),
+            IndexModel (_current ('cells' if deployed.footprint else 'grid')),
+        ],
+        f'u{univ}_deployed_utx_sets'          : [IndexModel (_current ('label'))],
+        tethers_collection (univ)             : [IndexModel (_current ('device_id')), IndexModel (_current ('label'))],
+        f'u{univ}_macro_states'               : [IndexModel ([CURRENT, ('block_number', DESCENDING)])],
+        f'u{univ}_civ_state'                  : [IndexModel (_current ('most_recent'))],
+        f'u{univ}_harvesters'                 : [IndexModel (_current ('id'))],
+        f'u{univ}_transformers'               : [IndexModel (_current ('id'))],
+        f'u{univ}_upsfs'                      : [IndexModel (_current ('id'))],
+        f'u{univ}_pgs'                        : [IndexModel (_current ('id'))],
+        f'u{univ}_ndpes'                      : [IndexModel (_current ('id'))],
+        trajectory_collection (univ)          : [
+            IndexModel ([('bucket', ASCENDING)], unique = True),
+            IndexModel ([('start_block', ASCENDING), ('end_block', ASCENDING)]),
+        ],
+    }
+
+
+LOBBY_INDEXES: Dict[str, List[IndexModel]] = {
+    'lobby_queue' : [IndexModel (_current ('account', 'expired'))],
+}
+
+
+def ensure_indexes (
+    db: Database,
+    universes: Iterable[int],
+    deployed: DeployedDevices,
+    resolve: Optional[Callable[[str], str]] = None,
+    lobby: bool = True,
+) -> List[str]:
+    """Create the expected indexes that are missing; returns `collection.index_name` of those created.
+
+    `resolve` maps a collection name to the collection actually written, e.g. the current epoch's.
+    """
+    expected = dict (LOBBY_INDEXES) if lobby else {}
+    for univ in universes:
+        expected.update (universe_indexes (univ, deployed))
+
+    created = []
+    for collection, models in expected.items():
+        if resolve is not None:
+            collection = resolve (collection)
+        existing = set (db [collection].index_information ())
+        missing = [m for m in models if m.document ['name'] not in existing]
+        if missing:
+            created += [f'{collection}.{name}' for name in db [collection].create_indexes (missing)]
+    return created
+
+
+#
+# Query plan checks
+#
+@dataclass
+class CanonicalQuery:
+    handler: str
+    collection: str
+    filter: Document
+    sort: Optional[Keys] = None
+    limit: int = 0
+    chain_aware: bool = True
+
+
+def canonical_queries (univ: int, deployed: DeployedDevices) -> List[CanonicalQuery]:
+    grid = {'x': 0, 'y': 0}
+    return [
+        CanonicalQuery ('forward_world_macro_occurred', trajectory_collection (univ), {'bucket': 0}, chain_aware = False),
+        CanonicalQuery ('give_undeployed_fungible_device_occurred', f'u{univ}_player_fungible_balances', {'account': '0'}),
+        CanonicalQuery ('give_undeployed_fungible_device_occurred', inventories_collection (univ), {'account': '0'}),
+        CanonicalQuery ('activate_universe_occurred', f'u{univ}_civ_state', {'most_recent': 1}),
+        CanonicalQuery ('player_deploy_device_occurred', f'u{univ}_player_nonfungible_devices', {'id': '0'}),
+        CanonicalQuery ('player_deploy_device_occurred', deployed.collection (univ), deployed.grid_filter (grid)),
+        CanonicalQuery ('player_pickup_device_occurred', deployed.collection (univ), {'id': '0'}),
+        CanonicalQuery ('player_pickup_device_occurred', tethers_collection (univ), {'device_id': '0'}),
+        CanonicalQuery ('player_pickup_device_occurred', f'u{univ}_deployed_utx_sets', {'label': {'$in': ['0']}}),
+        CanonicalQuery ('player_pickup_device_occurred', tethers_collection (univ), {'label': {'$in': ['0']}}),
+        CanonicalQuery ('player_pickup_utx_occurred', f'u{univ}_deployed_utx_sets', {'label': '0'}),
+        CanonicalQuery ('resource_update_at_harvester_occurred', f'u{univ}_harvesters', {'id': '0'}),
+        CanonicalQuery ('resource_update_at_transformer_occurred', f'u{univ}_transformers', {'id': '0'}),
+        CanonicalQuery ('resource_update_at_upsf_occurred', f'u{univ}_upsfs', {'id': '0'}),
+        CanonicalQuery ('energy_update_at_device_occurred', f'u{univ}_pgs', {'id': '0'}),
+        CanonicalQuery ('energy_update_at_device_occurred', f'u{univ}_ndpes', {'id': '0'}),
+        CanonicalQuery ('impulse_applied_occurred', f'u{univ}_macro_states', {}, sort = [('block_number', DESCENDING)], limit = 1),
+        CanonicalQuery ('player_transfer_undeployed_nonfungible_device_occurred', f'u{univ}_player_nonfungible_devices', {'id': '0', 'owner': '0'}),
+    ]
+
+
+LOBBY_QUERIES = [
+    CanonicalQuery ('universe_activation_occurred', 'lobby_queue', {'account': '0', 'expired': 0}),
+]
+
+
+def _plan_stages (plan: Document) -> Iterable[str]:
+    yield plan.get ('stage', '')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages (plan [key])
+    for child in plan.get ('inputStages', []):
+        yield from _plan_stages (child)
+
+
+def explain_stages (db: Database, query: CanonicalQuery, resolve: Optional[Callable[[str], str]] = None) -> List[str]:
+    """Stages of the winning plan of `query`, as the chain-aware storage would issue it."""
+    filter = dict (query.filter)
+    if query.chain_aware:
+        filter ['_chain.valid_to'] = None
+    collection = resolve (query.collection) if resolve is not None else query.collection
+    cursor = db [collection].find (filter, sort = query.sort, limit = query.limit)
+    planner = cursor.explain ().get ('queryPlanner', {})
+    return list (_plan_stages (planner.get ('winningPlan', {})))
+
+
+def check_query_plans (
+    db: Database,
+    universes: Iterable[int],
+    deployed: DeployedDevices,
+    resolve: Optional[Callable[[str], str]] = None,
+) -> List[CanonicalQuery]:
+    """Canonical handler queries whose winning plan scans the whole collection."""
+    queries = list (LOBBY_QUERIES)
+    for univ in universes:
+        queries += canonical_queries (univ, deployed)
+    return [q for q in queries if 'COLLSCAN' in explain_stages (db, q, resolve)]
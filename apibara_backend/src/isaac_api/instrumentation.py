@@ -0,0 +1,235 @@
+"""Metrics and event logging of the indexers
+
+Shared by the isaac, s2m2 and stardisc indexers. The s2m2 and stardisc
+packages are built on their own, so they hold a copy of this module, written
+by `poetry run isaac vendor` (`isaac_api.codegen.VENDORED`); edit this one.
+
+Metrics are kept in-process and served in the Prometheus text format on
+`http://{host}:{port}/metrics` by `serve`. Updates happen on the event loop;
+the HTTP server runs in a daemon thread and each metric guards its values
+with a lock.
+
+Per-event logging goes to the indexer's logger at DEBUG level, for a sampled
+fraction of the events: `EventLog.begin` decides once per event whether the
+lines it logs are emitted, and the arguments are only formatted for sampled
+events. `CountingStorage` counts the storage operations of a block.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import logging
+import random
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# seconds; isaac handlers take tens of microseconds to tens of milliseconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _labels (names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip (names, values)]
+    if extra:
+        pairs.append (extra)
+    return '{' + ','.join (pairs) + '}' if pairs else ''
+
+
+def _number (value: float) -> str:
+    if value == float ('inf'):
+        return '+Inf'
+    return repr (float (value)) if isinstance (value, float) else str (value)
+
+
+class _Metric:
+    type = ''
+
+    def __init__ (self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple (labels)
+        self._lock = threading.Lock ()
+
+    def _key (self, labels: Dict[str, object]) -> LabelValues:
+        return tuple (str (labels [n]) for n in self.label_names)
+
+    def render (self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            lines += self._samples ()
+        return lines
+
+    def _samples (self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter (_Metric):
+    type = 'counter'
+
+    def __init__ (self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super ().__init__ (name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc (self, amount: float = 1, **labels):
+        key = self._key (labels)
+        with self._lock:
+            self._values [key] = self._values.get (key, 0) + amount
+
+    def value (self, **labels) -> float:
+        return self._values.get (self._key (labels), 0)
+
+    def _samples (self) -> List[str]:
+        return [f'{self.name}{_labels (self.label_names, k)} {_number (v)}' for k, v in self._values.items()]
+
+
+class Gauge (Counter):
+    type = 'gauge'
+
+    def set (self, value: float, **labels):
+        key = self._key (labels)
+        with self._lock:
+            self._values [key] = value
+
+
+class Histogram (_Metric):
+    type = 'histogram'
+
+    def __init__ (self, name: str, help: str, labels: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        super ().__init__ (name, help, labels)
+        self.buckets = tuple (sorted (buckets))
+        self._values: Dict[LabelValues, list] = {}   # labels => [bucket counts..., +Inf count, sum]
+
+    def observe (self, value: float, **labels):
+        key = self._key (labels)
+        i = bisect.bisect_left (self.buckets, value)
+        with self._lock:
+            counts = self._values.get (key)
+            if counts is None:
+                counts = self._values [key] = [0] * (len (self.buckets) + 2)
+            counts [i] += 1
+            counts [-1] += value
+
+    def count (self, **labels) -> int:
+        counts = self._values.get (self._key (labels))
+        return sum (counts [:-1]) if counts else 0
+
+    def quantile (self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the `q` quantile."""
+        counts = self._values.get (self._key (labels))
+        if not counts:
+            return None
+        rank = q * sum (counts [:-1])
+        seen = 0
+        for bound, n in zip (self.buckets + (float ('inf'),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float ('inf')
+
+    def _samples (self) -> List[str]:
+        lines = []
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, n in zip (self.buckets + (float ('inf'),), counts):
+                cumulative += n
+                le = 'le="%s"' % _number (bound)
+                lines.append (f'{self.name}_bucket{_labels (self.label_names, key, le)} {cumulative}')
+            lines.append (f'{self.name}_sum{_labels (self.label_names, key)} {_number (counts [-1])}')
+            lines.append (f'{self.name}_count{_labels (self.label_names, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__ (self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register (self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError (f'Duplicate metric {metric.name}')
+        self._metrics [metric.name] = metric
+        return metric
+
+    def counter (self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register (Counter (name, help, labels))
+
+    def gauge (self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register (Gauge (name, help, labels))
+
+    def histogram (self, name: str, help: str, labels: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register (Histogram (name, help, labels, buckets))
+
+    def metrics (self) -> List[_Metric]:
+        return list (self._metrics.values ())
+
+    def render (self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render ()
+        return '\n'.join (lines) + '\n'
+
+
+REGISTRY = Registry ()
+
+
+def serve (port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve `registry` on `/metrics` from a daemon thread."""
+
+    class Handler (BaseHTTPRequestHandler):
+        def do_GET (self):
+            if self.path.split ('?') [0] != '/metrics':
+                self.send_error (404)
+                return
+            body = registry.render ().encode ()
+            self.send_response (200)
+            self.send_header ('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header ('Content-Length', str (len (body)))
+            self.end_headers ()
+            self.wfile.write (body)
+
+        def log_message (self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer ((host, port), Handler)
+    threading.Thread (target = server.serve_forever, name = 'metrics', daemon = True).start ()
+    return server
+
+
+class EventLog:
+    """DEBUG lines of a sampled fraction of the events."""
+
+    def __init__ (self, logger: logging.Logger, sample: float = 1.0) -> None:
+        self.logger = logger
+        self.sample = sample
+        self._sampled = contextvars.ContextVar (f'{logger.name}.sampled', default = False)
+
+    def begin (self) -> bool:
+        """Decide whether the lines of the event handled from now on, in this task, are logged."""
+        sampled = self.logger.isEnabledFor (logging.DEBUG) and (self.sample >= 1 or random.random () < self.sample)
+        self._sampled.set (sampled)
+        return sampled
+
+    def __call__ (self, msg: str, *args):
+        if self._sampled.get ():
+            self.logger.debug (msg, *args)
+
+
+class CountingStorage:
+    """Apibara storage counting the operations issued through it, by method."""
+
+    def __init__ (self, storage) -> None:
+        self._storage = storage
+        self.ops = defaultdict (int)
+
+    def __getattr__ (self, name):
+        attr = getattr (self._storage, name)
+        if not asyncio.iscoroutinefunction (attr):
+            return attr
+
+        async def counted (*args, **kwargs):
+            self.ops [name] += 1
+            return await attr (*args, **kwargs)
+        return counted
@@ -0,0 +1,214 @@
+"""Per-player inventory aggregate
+
+`u{univ}_player_inventories` holds one document per account, denormalized from
+`u{univ}_player_fungible_balances`, `u{univ}_player_nonfungible_devices`, the
+deployed devices collection and the per-type device collections (`pgs`,
+`harvesters`, `transformers`, `upsfs`, `ndpes`), so the inventory panel is a
+single indexed read on `account`:
+
+    {
+        account, player_index, block_number,
+        balances: {'0': n, ..., '15': n},       undeployed fungible devices by type
+        devices: {device_id: {type, is_deployed, base_grid, energy, resource, ...}},
+        utx_sets: {label: {type, cells}}        deployed utx sets
+    }
+
+The handlers apply deltas to it (`$inc` of a balance, `$set` / `$unset` of a
+device or utx set entry) next to their writes to the source collections, so
+an event costs one update of the inventory, with no join. Resource and energy
+updates are coalesced like the per-type collections'. The documents are
+chain-versioned like their sources, so crash recovery, universe epochs and the
+read API handle them as any other collection.
+
+`backfill_inventories` builds the documents of accounts indexed before the
+aggregate existed from the source collections.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from pymongo.database import Database
+
+from isaac_api.footprint import DeployedDevices
+from isaac_api.unit_of_work import apply_update
+
+Document = Dict[str, Any]
+
+# per-type collections holding the resource and energy of each device, by `id`
+DEVICE_STATE_NAMES = ['pgs', 'harvesters', 'transformers', 'upsfs', 'ndpes']
+
+DEFAULT_DEVICE_TYPE_COUNT = 16
+
+_NOT_STATE = ('_id', '_chain', 'id', 'type')
+
+
+def inventories_collection (univ: int) -> str:
+    return f'u{univ}_player_inventories'
+
+
+def empty_inventory (account: str, device_type_count: int) -> Document:
+    return {
+        'account'  : account,
+        'balances' : {str(i): 0 for i in range (device_type_count)},
+        'devices'  : {},
+        'utx_sets' : {},
+    }
+
+
+def device_state (doc: Document) -> Document:
+    """Resource and energy fields of a per-type device document."""
+    return {k: v for k, v in doc.items() if k not in _NOT_STATE}
+
+
+class PlayerInventories:
+    """Delta updates of the inventory documents, issued through the handlers' storage."""
+
+    def __init__ (self, device_type_count: int = DEFAULT_DEVICE_TYPE_COUNT) -> None:
+        self.device_type_count = device_type_count
+
+    async def update (self, storage, univ: int, account: str, update: Document):
+        """Apply `update` to the inventory of `account`, created empty if it has none yet."""
+        collection = inventories_collection (univ)
+        update = {**update, '$set': {**update.get ('$set', {}), 'block_number': storage.block_number}}
+        if await storage.find_one_and_update (collection, {'account': account}, update) is not None:
+            return
+        doc = empty_inventory (account, self.device_type_count)
+        apply_update (doc, update)
+        await storage.insert_one (collection, doc)
+
+    async def add_balance (self, storage, univ: int, account: str, device_type: int, amount: int):
+        await self.update (storage, univ, account, {'$inc': {f'balances.{device_type}': amount}})
+
+    async def set_player_index (self, storage, univ: int, account: str, player_index: int):
+        await self.update (storage, univ, account, {'$set': {'player_index': player_index}})
+
+    async def add_device (self, storage, univ: int, account: str, device_id: str, device_type: int, state: Document):
+        await self.update (storage, univ, account, {'$set': {f'devices.{device_id}': {
+            'type'        : device_type,
+            'is_deployed' : False,
+            'base_grid'   : None,
+            **state,
+        }}})
+
+    async def move_device (self, storage, univ: int, src: str, dst: str, device_id: str):
+        """Move the entry of a device from the inventory of `src` to that of `dst`."""
+        before = await storage.find_one_and_update (inventories_collection (univ), {'account': src}, {
+            '$unset': {f'devices.{device_id}': ''},
+            '$set': {'block_number': storage.block_number},
+        })
+        entry = (before or {}).get ('devices', {}).get (device_id)
+        if entry is not None:
+            await self.update (storage, univ, dst, {'$set': {f'devices.{device_id}': entry}})
+
+    async def deploy_device (self, storage, univ: int, account: str, device_id: str, base_grid: Optional[Document]):
+        """Mark a device deployed at `base_grid`, or picked up when it is None."""
+        await self.update (storage, univ, account, {'$set': {
+            f'devices.{device_id}.is_deployed' : base_grid is not None,
+            f'devices.{device_id}.base_grid'   : base_grid,
+        }})
+
+    async def update_device_state (self, storage, univ: int, account: str, device_id: str, fields: Document):
+        """Set resource or energy fields of a device, written once per block with its other updates."""
+        await storage.coalesce_update (
+            inventories_collection (univ),
+            {'account': account},
+            {'$set': {
+                **{f'devices.{device_id}.{k}': v for k, v in fields.items()},
+                'block_number': storage.block_number,
+            }}
+        )
+
+    async def add_utx_set (self, storage, univ: int, account: str, label: str, utx_type: str, cells: list):
+        """A utx set deployed from the balance of `account`."""
+        await self.update (storage, univ, account, {
+            '$inc': {f'balances.{utx_type}': -len (cells)},
+            '$set': {f'utx_sets.{label}': {'type': utx_type, 'cells': list (cells)}},
+        })
+
+    async def remove_utx_set (self, storage, univ: int, account: str, label: str, utx_type: str, count: int):
+        """A utx set picked up, its `count` cells back in the balance of `account`."""
+        await self.update (storage, univ, account, {
+            '$inc': {f'balances.{utx_type}': count},
+            '$unset': {f'utx_sets.{label}': ''},
+        })
+
+
+def build_inventories (
+    db: Database,
+    univ: int,
+    deployed: DeployedDevices,
+    device_type_count: int,
+    resolve: Optional[Callable[[str], str]] = None,
+) -> Dict[str, Document]:
+    """Inventory documents of `univ` joined from the current source documents, by account."""
+    current = {'_chain.valid_to': None}
+
+    def find (collection: str) -> Iterable[Document]:
+        return db [resolve (collection) if resolve is not None else collection].find (current)
+
+    inventories: Dict[str, Document] = {}
+
+    def inventory (account: str, doc: Document) -> Document:
+        inv = inventories.get (account)
+        if inv is None:
+            inv = inventories [account] = empty_inventory (account, device_type_count)
+            inv ['block_number'] = 0
+        inv ['block_number'] = max (inv ['block_number'], doc ['_chain']['valid_from'])
+        return inv
+
+    for doc in find (f'u{univ}_player_fungible_balances'):
+        inv = inventory (doc ['account'], doc)
+        inv ['balances'].update ({k: v for k, v in doc.items() if k.isdigit ()})
+        if 'player_index' in doc:
+            inv ['player_index'] = doc ['player_index']
+
+    states = {}
+    for name in DEVICE_STATE_NAMES:
+        for doc in find (f'u{univ}_{name}'):
+            states [doc ['id']] = device_state (doc)
+
+    owners = {}
+    for doc in find (f'u{univ}_player_nonfungible_devices'):
+        owners [doc ['id']] = doc ['owner']
+        inventory (doc ['owner'], doc) ['devices'][doc ['id']] = {
+            'type'        : doc ['type'],
+            'is_deployed' : doc ['is_deployed'],
+            'base_grid'   : None,
+            **states.get (doc ['id'], {}),
+        }
+
+    # deployed documents of nonfungible devices give their base grid, the others are utx sets
+    utx_cells: Dict[str, list] = {}
+    for doc in find (deployed.collection (univ)):
+        if doc ['id'] in owners:
+            inventory (owners [doc ['id']], doc) ['devices'][doc ['id']]['base_grid'] = doc.get ('base_grid')
+            continue
+        inv = inventory (doc ['owner'], doc)
+        inv ['utx_sets'].setdefault (doc ['id'], {'type': doc ['type'], 'cells': []})
+        utx_cells.setdefault (doc ['id'], []).extend (DeployedDevices.cells_of ([doc]))
+    for inv in inventories.values():
+        for label, utx_set in inv ['utx_sets'].items():
+            utx_set ['cells'] = utx_cells [label]
+    return inventories
+
+
+def backfill_inventories (
+    db: Database,
+    univ: int,
+    deployed: DeployedDevices,
+    device_type_count: int,
+    resolve: Optional[Callable[[str], str]] = None,
+) -> int:
+    """Write the inventory documents of accounts indexed before the aggregate existed.
+
+    Returns the number of inventory documents written.
+    """
+    collection = db [resolve (inventories_collection (univ)) if resolve is not None else inventories_collection (univ)]
+    known = {doc ['account'] for doc in collection.find ({'_chain.valid_to': None}, {'account': 1})}
+    docs = [
+        dict (inv, _chain = {'valid_from': inv ['block_number'], 'valid_to': None})
+        for account, inv in build_inventories (db, univ, deployed, device_type_count, resolve).items()
+        if account not in known
+    ]
+    if docs:
+        collection.insert_many (docs)
+    return len (docs)
@@ -0,0 +1,167 @@
+"""Non-blocking access to Mongo for the indexer, the read API and the replay tools
+
+pymongo blocks the calling thread for every round-trip. `AsyncMongo` owns one
+`MongoClient`, with a tuned connection pool, and runs its driver calls on a
+thread pool of the same size, so that coroutines awaiting Mongo leave the event
+loop free and up to `max_pool_size` requests are in flight at once:
+
+    mongo = AsyncMongo.connect (url)
+    db = mongo.database ('isaac')
+    doc = await db ['lobby_queue'].find_one ({'account': '0'})
+    await db ['lobby_queue'].bulk_write (ops, write_concern = mongo.write_concern (CATCH_UP))
+
+`db.db` is the blocking `Database` itself, for setup code that runs before the
+event loop has anything else to do.
+
+Writes take the write concern of the indexer's mode: while catching up with the
+chain head, blocks are acknowledged by the primary alone and not waited on the
+journal (`w=1, j=false`), since a lost block is indexed again; once live, they
+wait for a majority and the journal (`w=majority, j=true`).
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.write_concern import WriteConcern
+
+Document = Dict[str, Any]
+
+CATCH_UP = 'catch-up'
+LIVE = 'live'
+
+DEFAULT_MAX_POOL_SIZE = 32
+DEFAULT_MIN_POOL_SIZE = 4
+DEFAULT_MAX_IDLE_TIME_MS = 60000
+DEFAULT_CATCH_UP_WRITE_CONCERN = '1'
+DEFAULT_LIVE_WRITE_CONCERN = 'majority'
+
+
+def parse_write_concern (w: str, journal: bool) -> WriteConcern:
+    """`WriteConcern` from a `w` setting: a number of members or a tag such as `majority`."""
+    return WriteConcern (w = int (w) if w.isdigit () else w, j = journal)
+
+
+def client_options (
+    max_pool_size: int = DEFAULT_MAX_POOL_SIZE,
+    min_pool_size: int = DEFAULT_MIN_POOL_SIZE,
+    max_idle_time_ms: int = DEFAULT_MAX_IDLE_TIME_MS,
+) -> Dict[str, Any]:
+    """`MongoClient` keyword arguments for a pool of `min_pool_size` to `max_pool_size` connections."""
+    return {
+        'maxPoolSize': max_pool_size,
+        'minPoolSize': min (min_pool_size, max_pool_size),
+        'maxIdleTimeMS': max_idle_time_ms,
+        'retryWrites': True,
+    }
+
+
+class AsyncMongo:
+    """A client whose driver calls run on a thread pool sized like its connection pool."""
+
+    def __init__ (
+        self,
+        client: MongoClient,
+        max_workers: int = DEFAULT_MAX_POOL_SIZE,
+        write_concerns: Optional[Dict[str, WriteConcern]] = None,
+    ) -> None:
+        self.client = client
+        self._executor = ThreadPoolExecutor (max_workers = max_workers, thread_name_prefix = 'isaac-mongo')
+        self._write_concerns = write_concerns or {
+            CATCH_UP: parse_write_concern (DEFAULT_CATCH_UP_WRITE_CONCERN, journal = False),
+            LIVE: parse_write_concern (DEFAULT_LIVE_WRITE_CONCERN, journal = True),
+        }
+
+    @classmethod
+    def connect (
+        cls,
+        url: str,
+        max_pool_size: int = DEFAULT_MAX_POOL_SIZE,
+        min_pool_size: int = DEFAULT_MIN_POOL_SIZE,
+        catch_up_w: str = DEFAULT_CATCH_UP_WRITE_CONCERN,
+        live_w: str = DEFAULT_LIVE_WRITE_CONCERN,
+    ) -> 'AsyncMongo':
+        return cls (
+            MongoClient (url, **client_options (max_pool_size, min_pool_size)),
+            max_workers = max_pool_size,
+            write_concerns = {
+                CATCH_UP: parse_write_concern (catch_up_w, journal = False),
+                LIVE: parse_write_concern (live_w, journal = True),
+            },
+        )
+
+    def database (self, name: str) -> 'AsyncDatabase':
+        return AsyncDatabase (self, self.client [name])
+
+    def write_concern (self, mode: str) -> WriteConcern:
+        return self._write_concerns [mode]
+
+    async def run (self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call the blocking `fn` on the pool."""
+        return await asyncio.get_running_loop ().run_in_executor (self._executor, partial (fn, *args, **kwargs))
+
+    async def gather (self, calls: Iterable[Callable[[], Any]]) -> List[Any]:
+        """Run blocking calls concurrently, each on its own connection."""
+        return await asyncio.gather (*[self.run (call) for call in calls])
+
+    def close (self):
+        self._executor.shutdown (wait = True)
+        self.client.close ()
+
+
+class AsyncDatabase:
+    def __init__ (self, mongo: AsyncMongo, db: Database) -> None:
+        self.mongo = mongo
+        self.db = db
+
+    @property
+    def name (self) -> str:
+        return self.db.name
+
+    def __getitem__ (self, name: str) -> 'AsyncCollection':
+        return AsyncCollection (self.mongo, self.db [name])
+
+    async def command (self, command: str, **kwargs) -> Document:
+        return await self.mongo.run (self.db.command, command, **kwargs)
+
+    async def list_collection_names (self) -> List[str]:
+        return await self.mongo.run (self.db.list_collection_names)
+
+
+class AsyncCollection:
+    def __init__ (self, mongo: AsyncMongo, collection: Collection) -> None:
+        self.mongo = mongo
+        self.collection = collection
+
+    async def find (self, filter: Optional[Document] = None, **kwargs) -> List[Document]:
+        return await self.mongo.run (lambda: list (self.collection.find (filter, **kwargs)))
+
+    async def find_one (self, filter: Optional[Document] = None, **kwargs) -> Optional[Document]:
+        return await self.mongo.run (self.collection.find_one, filter, **kwargs)
+
+    async def count_documents (self, filter: Document) -> int:
+        return await self.mongo.run (self.collection.count_documents, filter)
+
+    async def insert_one (self, doc: Document, write_concern: Optional[WriteConcern] = None):
+        return await self.mongo.run (self._with (write_concern).insert_one, doc)
+
+    async def update_one (self, filter: Document, update: Document, upsert: bool = False, write_concern: Optional[WriteConcern] = None):
+        return await self.mongo.run (self._with (write_concern).update_one, filter, update, upsert = upsert)
+
+    async def replace_one (self, filter: Document, replacement: Document, upsert: bool = False, write_concern: Optional[WriteConcern] = None):
+        return await self.mongo.run (self._with (write_concern).replace_one, filter, replacement, upsert = upsert)
+
+    async def delete_many (self, filter: Document, write_concern: Optional[WriteConcern] = None):
+        return await self.mongo.run (self._with (write_concern).delete_many, filter)
+
+    async def bulk_write (self, requests: list, ordered: bool = True, write_concern: Optional[WriteConcern] = None):
+        return await self.mongo.run (self._with (write_concern).bulk_write, requests, ordered = ordered)
+
+    def _with (self, write_concern: Optional[WriteConcern]) -> Collection:
+        if write_concern is None:
+            return self.collection
+        return self.collection.with_options (write_concern = write_concern)
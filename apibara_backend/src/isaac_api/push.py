@@ -0,0 +1,146 @@
+"""Fan-out of the per-universe view changes to WebSocket subscribers
+
+Each committed block produces at most one message per universe:
+
+    {"type": "changes", "univ": u, "since": n, "block": m, "views": {name: [change, ...]}}
+
+with the `put` / `remove` changes of `isaac_api.views`, covering the blocks
+after `since` up to `block`. A universe reset produces
+
+    {"type": "resync", "univ": u, "block": m}
+
+after which the client fetches snapshots again.
+
+Publishing never waits on a client. Every subscriber has its own queue of at
+most `max_pending` messages, drained by its own sender task at the pace the
+socket accepts. When a slow client's queue is full, its pending messages are
+coalesced into one: a document put and removed again while queued cancels
+out. If the coalesced message still holds more than `max_changes` changes,
+the client gets a `resync` instead.
+"""
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from isaac_api.views import BlockChanges, Document, dumps
+
+DEFAULT_MAX_PENDING = 32
+DEFAULT_MAX_CHANGES = 5000
+
+
+class Message:
+    """One message for the subscribers of a universe, encoded once per view selection."""
+
+    def __init__ (self, univ: int, block: int, since: Optional[int] = None, views: Optional[Dict[str, List[Document]]] = None) -> None:
+        self.univ = univ
+        self.block = block
+        self.since = since
+        self.views = views   # None for a resync
+        self._encoded: Dict[Optional[FrozenSet[str]], bytes] = {}
+
+    @property
+    def resync (self) -> bool:
+        return self.views is None
+
+    def size (self) -> int:
+        return sum (len (changes) for changes in self.views.values()) if self.views else 0
+
+    def encode (self, selection: Optional[FrozenSet[str]] = None) -> Optional[bytes]:
+        """JSON text of the message restricted to the views in `selection`; None if that leaves nothing."""
+        if selection not in self._encoded:
+            if self.resync:
+                body = {'type': 'resync', 'univ': self.univ, 'block': self.block}
+            else:
+                views = self.views if selection is None else {k: v for k, v in self.views.items() if k in selection}
+                if not views:
+                    return None
+                body = {'type': 'changes', 'univ': self.univ, 'since': self.since, 'block': self.block, 'views': views}
+            self._encoded [selection] = dumps (body)
+        return self._encoded [selection]
+
+
+def coalesce (messages: List[Message], max_changes: int) -> Message:
+    """One message equivalent to `messages`, all of the same universe, in order."""
+    first, last = messages [0], messages [-1]
+    if any (m.resync for m in messages):
+        return Message (first.univ, last.block)
+
+    views: Dict[str, Dict[Tuple[str, str], Document]] = {}   # name => (op, _id) => change, in order
+    for message in messages:
+        for name, changes in message.views.items():
+            merged = views.setdefault (name, {})
+            for change in changes:
+                if change ['op'] == 'remove' and ('put', change ['id']) in merged:
+                    del merged [('put', change ['id'])]
+                elif change ['op'] == 'remove':
+                    merged [('remove', change ['id'])] = change
+                else:
+                    merged [('put', change ['doc']['_id'])] = change
+    coalesced = Message (first.univ, last.block, first.since, {k: list (v.values()) for k, v in views.items() if v})
+    if coalesced.size () > max_changes:
+        return Message (first.univ, last.block)
+    return coalesced
+
+
+class Subscriber:
+    """Queue of the messages of one client, and the task sending them."""
+
+    def __init__ (self, univ: int, send, selection: Optional[FrozenSet[str]], max_pending: int, max_changes: int) -> None:
+        self.univ = univ
+        self.selection = selection
+        self.coalesced = 0
+        self._send = send   # coroutine function taking the encoded message
+        self._max_pending = max_pending
+        self._max_changes = max_changes
+        self._pending: Deque[Message] = deque ()
+        self._ready = asyncio.Event ()
+
+    def offer (self, message: Message):
+        self._pending.append (message)
+        if len (self._pending) > self._max_pending:
+            self._pending = deque ([coalesce (list (self._pending), self._max_changes)])
+            self.coalesced += 1
+        self._ready.set ()
+
+    async def run (self):
+        while True:
+            await self._ready.wait ()
+            self._ready.clear ()
+            while self._pending:
+                encoded = self._pending.popleft ().encode (self.selection)
+                if encoded is not None:
+                    await self._send (encoded)
+
+
+class PushHub:
+    """Subscribers by universe; `publish` is a `MaterializedViews` listener."""
+
+    def __init__ (self, max_pending: int = DEFAULT_MAX_PENDING, max_changes: int = DEFAULT_MAX_CHANGES) -> None:
+        self.max_pending = max_pending
+        self.max_changes = max_changes
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+
+    def subscribe (self, univ: int, send, selection: Optional[FrozenSet[str]] = None) -> Subscriber:
+        subscriber = Subscriber (univ, send, selection, self.max_pending, self.max_changes)
+        self._subscribers.setdefault (univ, set ()).add (subscriber)
+        return subscriber
+
+    def unsubscribe (self, subscriber: Subscriber):
+        self._subscribers.get (subscriber.univ, set ()).discard (subscriber)
+
+    def subscriber_count (self) -> int:
+        return sum (len (s) for s in self._subscribers.values())
+
+    def publish (self, changes: BlockChanges):
+        for univ, subscribers in self._subscribers.items():
+            if not subscribers:
+                continue
+            if univ in changes.reset:
+                message = Message (univ, changes.block)
+            elif univ in changes.universes:
+                message = Message (univ, changes.block, changes.since, changes.universes [univ])
+            else:
+                continue
+            for subscriber in subscribers:
+                subscriber.offer (message)
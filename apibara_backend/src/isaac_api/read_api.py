@@ -0,0 +1,111 @@
+"""HTTP read API over the materialized views of the isaac indexer
+
+Runs in the indexer's event loop, so the views it serves are those of the last
+committed block:
+
+    GET /universes/{univ}/{view}
+        {"block": n, "docs": [...]}, with an ETag; `If-None-Match` gives a 304
+        while the view has not changed
+    GET /universes/{univ}/{view}/changes?since=n
+        {"block": m, "changes": [...]}, the changes of the blocks after n up to
+        m; 410 when they are no longer held, and the client fetches a snapshot
+
+Any other query parameter filters the documents on the string form of a
+top-level field, e.g. `?account=<decimal account address>`.
+
+    GET /universes/{univ}/ws?views=macro_states,pgs
+        WebSocket pushing the changes of each block as they are committed, for
+        all views or the comma-separated `views` (see `isaac_api.push`)
+"""
+
+import asyncio
+from typing import Optional
+
+from aiohttp import WSMsgType, web
+
+from isaac_api.push import PushHub
+from isaac_api.views import MaterializedViews, dumps
+
+_VIEWS_KEY = web.AppKey ('views', MaterializedViews)
+_HUB_KEY = web.AppKey ('hub', PushHub)
+
+
+def _json_response (body: bytes, status: int = 200, **headers) -> web.Response:
+    return web.Response (body = body, status = status, content_type = 'application/json', headers = headers)
+
+
+def _lookup (request: web.Request):
+    views = request.app [_VIEWS_KEY]
+    try:
+        univ = int (request.match_info ['univ'])
+    except ValueError:
+        raise web.HTTPNotFound ()
+    name = request.match_info ['view']
+    view = views.view (univ, name)
+    if view is None:
+        raise web.HTTPNotFound (text = f'No view {name} for universe {univ}; views: {", ".join (views.names ())}')
+    query = {k: v for k, v in request.query.items() if k != 'since'}
+    return views, univ, name, view, query
+
+
+async def get_snapshot (request: web.Request) -> web.Response:
+    views, univ, name, view, query = _lookup (request)
+    etag = views.etag (univ, name, view)
+    if etag in request.headers.get ('If-None-Match', ''):
+        return web.Response (status = 304, headers = {'ETag': etag})
+    body = b'{"block":%d,"docs":%s}' % (views.block, view.snapshot (query))
+    return _json_response (body, ETag = etag)
+
+
+async def get_changes (request: web.Request) -> web.Response:
+    views, univ, name, view, query = _lookup (request)
+    try:
+        since = int (request.query ['since'])
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest (text = 'Expected an integer `since` block')
+    changes = view.changes_since (since, query)
+    if changes is None:
+        return _json_response (dumps ({'error': f'changes since block {since} are no longer held', 'block': views.block}), status = 410)
+    return _json_response (dumps ({'block': views.block, 'changes': changes}))
+
+
+async def push_changes (request: web.Request) -> web.WebSocketResponse:
+    hub = request.app [_HUB_KEY]
+    try:
+        univ = int (request.match_info ['univ'])
+    except ValueError:
+        raise web.HTTPNotFound ()
+    selection = frozenset (request.query ['views'].split (',')) if request.query.get ('views') else None
+
+    ws = web.WebSocketResponse (heartbeat = 30)
+    await ws.prepare (request)
+    subscriber = hub.subscribe (univ, lambda encoded: ws.send_str (encoded.decode ()), selection)
+    sender = asyncio.ensure_future (subscriber.run ())
+    try:
+        # clients only listen; reading notices when they go away
+        async for msg in ws:
+            if msg.type == WSMsgType.ERROR:
+                break
+    finally:
+        hub.unsubscribe (subscriber)
+        sender.cancel ()
+    return ws
+
+
+def create_app (views: MaterializedViews, hub: Optional[PushHub] = None) -> web.Application:
+    app = web.Application ()
+    app [_VIEWS_KEY] = views
+    app [_HUB_KEY] = hub = hub or PushHub ()
+    views.listeners.append (hub.publish)
+    app.router.add_get ('/universes/{univ}/ws', push_changes)
+    app.router.add_get ('/universes/{univ}/{view}', get_snapshot)
+    app.router.add_get ('/universes/{univ}/{view}/changes', get_changes)
+    return app
+
+
+async def start (views: MaterializedViews, port: int, host: str = '127.0.0.1', hub: Optional[PushHub] = None) -> web.AppRunner:
+    """Serve the read API from the running event loop."""
+    runner = web.AppRunner (create_app (views, hub), access_log = None)
+    await runner.setup ()
+    await web.TCPSite (runner, host, port).start ()
+    return runner
@@ -0,0 +1,263 @@
+"""Recording of the blocks handled by the isaac indexer
+
+With `ISAAC_RECORD_PATH` set, the indexer appends every `NewEvents` batch it
+handles to a recording directory. `isaac replay` feeds a recording back into
+the handlers without an Apibara server.
+
+A recording is a sequence of segments, each named after its first block:
+
+    {first_block:012d}.seg    header, then one record per block
+    {first_block:012d}.idx    one (block_number, offset, length) entry per block
+
+A segment is rolled over once it reaches `segment_bytes`. Block records are
+
+    BLOCK  number, timestamp (us, -1 if unknown), event count, flags, hash, parent hash
+    EVENT  address, log_index, felt count, name length; then the name and the felts
+
+all little-endian, with hashes, addresses and felts as 32 big-endian bytes.
+The index entries have a fixed size, so the block a read starts from is found
+with a binary search and a single seek. Segments are read through `mmap`,
+block by block; an event's data is a `memoryview` of the mapped segment,
+handed to the decoders without a copy. A segment stays mapped while events
+read from it are alive.
+"""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from apibara.model import BlockHeader, NewEvents, StarkNetEvent
+
+MAGIC = b'ISAACREC'
+VERSION = 1
+HEADER = struct.Struct ('<8sH')
+BLOCK = struct.Struct ('<QqIB32s32s')
+EVENT = struct.Struct ('<32sIIB')
+INDEX_ENTRY = struct.Struct ('<QQI')
+
+FELT_SIZE = 32
+HAS_PARENT = 0x01
+HAS_TIMESTAMP = 0x02
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+
+def _word (value: Optional[bytes]) -> bytes:
+    return (value or b'').rjust (32, b'\x00')
+
+
+def _data (data) -> bytes:
+    if isinstance (data, (bytes, bytearray, memoryview)):
+        return bytes (data)
+    return b''.join (data)
+
+
+def encode_block (block_events: NewEvents) -> bytes:
+    block = block_events.block
+    flags = (HAS_PARENT if block.parent_hash is not None else 0) | (HAS_TIMESTAMP if block.timestamp else 0)
+    timestamp = int (block.timestamp.timestamp () * 1_000_000) if block.timestamp else -1
+    parts = [BLOCK.pack (block.number, timestamp, len (block_events.events), flags, _word (block.hash), _word (block.parent_hash))]
+    for event in block_events.events:
+        name = event.name.encode ()
+        data = _data (event.data)
+        parts.append (EVENT.pack (_word (event.address), event.log_index, len (data) // FELT_SIZE, len (name)))
+        parts.append (name)
+        parts.append (data)
+    return b''.join (parts)
+
+
+class RecordedEvent (NamedTuple):
+    block_number: int
+    event: StarkNetEvent
+
+
+def _decode_header (buf, offset: int) -> Tuple[BlockHeader, int, int]:
+    number, timestamp, count, flags, hash, parent_hash = BLOCK.unpack_from (buf, offset)
+    header = BlockHeader (
+        hash        = hash,
+        parent_hash = parent_hash if flags & HAS_PARENT else None,
+        number      = number,
+        timestamp   = datetime.fromtimestamp (timestamp / 1_000_000, timezone.utc) if flags & HAS_TIMESTAMP else None,
+    )
+    return header, count, offset + BLOCK.size
+
+
+def _iter_events (buf, offset: int, count: int) -> Iterator[StarkNetEvent]:
+    for _ in range (count):
+        address, log_index, felt_count, name_len = EVENT.unpack_from (buf, offset)
+        offset += EVENT.size
+        name = bytes (buf [offset:offset + name_len]).decode ()
+        offset += name_len
+        end = offset + felt_count * FELT_SIZE
+        yield StarkNetEvent (name = name, address = address, log_index = log_index, topics = [], data = buf [offset:end])
+        offset = end
+
+
+def decode_block (buf, offset: int = 0) -> NewEvents:
+    header, count, offset = _decode_header (buf, offset)
+    return NewEvents (block = header, events = list (_iter_events (buf, offset, count)))
+
+
+#
+# Segments
+#
+def _segments (directory: str) -> List[Tuple[int, str]]:
+    """(first block, path without suffix) of every segment, in block order."""
+    if not os.path.isdir (directory):
+        return []
+    segments = []
+    for name in os.listdir (directory):
+        if name.endswith (SEGMENT_SUFFIX):
+            stem = name [:-len (SEGMENT_SUFFIX)]
+            segments.append ((int (stem), os.path.join (directory, stem)))
+    return sorted (segments)
+
+
+def _index_entries (path: str) -> int:
+    size = os.path.getsize (path + INDEX_SUFFIX) if os.path.exists (path + INDEX_SUFFIX) else 0
+    return size // INDEX_ENTRY.size
+
+
+def _map (path: str) -> mmap.mmap:
+    with open (path, 'rb') as f:
+        return mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+
+
+def _first_entry_after (index: mmap.mmap, count: int, after: int) -> int:
+    """Position of the first index entry with a block number above `after`."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if INDEX_ENTRY.unpack_from (index, mid * INDEX_ENTRY.size) [0] <= after:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class RecordingWriter:
+    """Appends handled blocks to a recording directory.
+
+    Blocks at or below the last one recorded are skipped, so a block retried
+    after a failed handler is recorded once. A record is written to its
+    segment before its index entry; on open, bytes past the last indexed
+    record (an interrupted write) are truncated.
+    """
+
+    def __init__ (self, directory: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.last_block: Optional[int] = None
+        self._segment = None
+        self._index = None
+        os.makedirs (directory, exist_ok = True)
+
+        for _, path in reversed (_segments (directory)):
+            if _index_entries (path):
+                self._recover (path)
+                break
+            # rolled over but nothing recorded yet
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                if os.path.exists (path + suffix):
+                    os.remove (path + suffix)
+
+    def _recover (self, path: str):
+        count = _index_entries (path)
+        with open (path + INDEX_SUFFIX, 'ab') as index:
+            index.truncate (count * INDEX_ENTRY.size)
+        with open (path + INDEX_SUFFIX, 'rb') as index:
+            index.seek ((count - 1) * INDEX_ENTRY.size)
+            number, offset, length = INDEX_ENTRY.unpack (index.read (INDEX_ENTRY.size))
+        self.last_block = number
+        with open (path + SEGMENT_SUFFIX, 'r+b') as segment:
+            segment.truncate (offset + length)
+        self._open (path)
+
+    def _open (self, path: str):
+        self.close ()
+        self._segment = open (path + SEGMENT_SUFFIX, 'ab')
+        self._index = open (path + INDEX_SUFFIX, 'ab')
+        if self._segment.tell () == 0:
+            self._segment.write (HEADER.pack (MAGIC, VERSION))
+
+    def append (self, block_events: NewEvents):
+        number = block_events.block.number
+        if self.last_block is not None and number <= self.last_block:
+            return
+        if self._segment is None or self._segment.tell () >= self.segment_bytes:
+            self._open (os.path.join (self.directory, f'{number:012d}'))
+
+        record = encode_block (block_events)
+        offset = self._segment.tell ()
+        self._segment.write (record)
+        self._segment.flush ()
+        self._index.write (INDEX_ENTRY.pack (number, offset, len (record)))
+        self._index.flush ()
+        self.last_block = number
+
+    def close (self):
+        for f in (self._segment, self._index):
+            if f is not None:
+                f.close ()
+        self._segment = self._index = None
+
+
+class RecordingReader:
+    """Lazy reader of a recording directory."""
+
+    def __init__ (self, directory: str) -> None:
+        self.directory = directory
+
+    def blocks (self, after: Optional[int] = None, until: Optional[int] = None) -> Iterator[NewEvents]:
+        """Blocks above `after` and up to `until`, in order."""
+        for segment, offset in self._records (after, until):
+            yield decode_block (segment, offset)
+
+    def events (self, after: Optional[int] = None, until: Optional[int] = None) -> Iterator[RecordedEvent]:
+        """Events of the blocks above `after` and up to `until`, decoded one at a time."""
+        for segment, offset in self._records (after, until):
+            header, count, offset = _decode_header (segment, offset)
+            for event in _iter_events (segment, offset, count):
+                yield RecordedEvent (header.number, event)
+
+    def _records (self, after: Optional[int], until: Optional[int]) -> Iterator[Tuple[memoryview, int]]:
+        segments = _segments (self.directory)
+        for i, (first, path) in enumerate (segments):
+            if until is not None and first > until:
+                return
+            if after is not None and i + 1 < len (segments) and segments [i + 1][0] <= after + 1:
+                continue
+            count = _index_entries (path)
+            if not count:
+                continue
+            index = _map (path + INDEX_SUFFIX)
+            segment = _map (path + SEGMENT_SUFFIX)
+            view = memoryview (segment)
+            try:
+                magic, version = HEADER.unpack_from (segment, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError (f'{path}{SEGMENT_SUFFIX} is not a version {VERSION} recording segment')
+                start = _first_entry_after (index, count, after) if after is not None else 0
+                for position in range (start, count):
+                    number, offset, _ = INDEX_ENTRY.unpack_from (index, position * INDEX_ENTRY.size)
+                    if until is not None and number > until:
+                        return
+                    yield view, offset
+            finally:
+                view.release ()
+                index.close ()
+                try:
+                    segment.close ()
+                except BufferError:
+                    # events still hold views of the segment, it is unmapped once they are dropped
+                    pass
+
+
+def read_blocks (directory: str, after: Optional[int] = None) -> Iterator[NewEvents]:
+    """Blocks of the recording in `directory` in order, skipping those up to `after`."""
+    return RecordingReader (directory).blocks (after = after)
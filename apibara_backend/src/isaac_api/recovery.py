@@ -0,0 +1,117 @@
+"""Crash recovery of the isaac indexer to its last committed block
+
+A block is committed once its progress is in `shard_progress` (see
+`isaac_api.shards`): the unit of work writes it after every other request of
+the block. A crash before that leaves some of the block's writes in Mongo and
+no progress for it. The writes identify their block:
+
+- chain-aware documents carry it in `_chain.valid_from` / `_chain.valid_to`,
+- `universe_epochs` carries the block that advanced the epoch,
+- macro trajectory buckets hold the block numbers appended to them, and
+  `MacroTrajectory.append` skips a block already appended,
+
+so on startup `recover` rolls the collections of each progress key back to
+the block recorded for it. An epoch advanced by an uncommitted block is
+reverted and its collections, written by that block only, are dropped. The
+trajectory, written outside chain versioning, is truncated to the block and
+completed from the macro states, which undoes a reset of the block. The block is then delivered again by Apibara,
+which only acknowledges a block once the handler returned, and handled from
+the state it was first handled against. Blocks up to the recorded one are
+skipped (`ShardState.owns`), so handling a block twice writes it once.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.database import Database
+
+from isaac_api.epochs import EPOCHS_COLLECTION
+from isaac_api.shards import LOBBY_KEY, PROGRESS_COLLECTION, universe_key
+from isaac_api.trajectory import MacroTrajectory
+
+log = logging.getLogger ('isaac_api.recovery')
+
+# collections of the lobby key; the others belong to the universe in their `u{univ}_` prefix
+LOBBY_COLLECTIONS = ['lobby_queue']
+
+
+@dataclass
+class RecoveryStats:
+    documents: int = 0
+    epochs: Dict[int, int] = field (default_factory = dict)   # univ => epoch reverted to
+    trajectory_blocks: int = 0
+
+
+def rollback (db: Database, block_number: int, skip: Iterable[str] = (), collections: Optional[Iterable[str]] = None) -> int:
+    """Undo the chain-aware writes of the blocks after `block_number`.
+
+    Documents created after it are deleted and documents clamped after it are
+    current again. Only `collections` are rolled back, every collection by
+    default; collections in `skip` (views) are left alone. Returns the number
+    of documents touched.
+    """
+    skip = set (skip)
+    touched = 0
+    for name in db.list_collection_names () if collections is None else collections:
+        if name in skip or name.startswith ('system.'):
+            continue
+        collection = db [name]
+        touched += collection.delete_many ({'_chain.valid_from': {'$gt': block_number}}).deleted_count
+        touched += collection.update_many (
+            {'_chain.valid_to': {'$gt': block_number}},
+            {'$set': {'_chain.valid_to': None}}
+        ).modified_count
+    return touched
+
+
+def views (universes: Iterable[int], epochs) -> set:
+    """Names of the epoch views of `universes`, which cannot be written."""
+    if not epochs.enabled:
+        return set ()
+    return {f'u{univ}_{name}' for univ in universes for name in epochs.names ()}
+
+
+def recover (db: Database, shard, epochs, trajectory: Optional[MacroTrajectory] = None) -> RecoveryStats:
+    """Roll the collections of each key of `shard` back to the last block committed for it."""
+    trajectory = trajectory or MacroTrajectory ()
+    stats = RecoveryStats ()
+    skip = views (shard.owned (), epochs)
+    for univ in shard.owned ():
+        block_number = shard.progress.get (universe_key (univ))
+        if block_number is None:
+            continue
+        # an epoch advanced by an uncommitted block goes back to the previous one, whose
+        # collections are only dropped once the block is committed; the collections of
+        # the reverted epoch hold writes of that block only
+        doc = db [EPOCHS_COLLECTION].find_one_and_update (
+            {'univ': univ, 'block_number': {'$gt': block_number}},
+            {'$inc': {'epoch': -1}, '$unset': {'block_number': ''}},
+            return_document = ReturnDocument.AFTER
+        )
+        if doc is not None:
+            stats.epochs [univ] = doc ['epoch']
+            epochs.drop_epoch (db, univ, doc ['epoch'] + 1)
+        prefix = f'{universe_key (univ)}_'
+        names = [name for name in db.list_collection_names () if name.startswith (prefix)]
+        stats.documents += rollback (db, block_number, skip, names)
+        epochs.load (db, [univ])
+        stats.trajectory_blocks += trajectory.repair (db, univ, block_number, resolve = epochs.collection)
+    if LOBBY_KEY in shard.progress and LOBBY_KEY in shard.keys ():
+        names = db.list_collection_names ()
+        stats.documents += rollback (db, shard.progress [LOBBY_KEY], skip, [name for name in LOBBY_COLLECTIONS if name in names])
+    if stats.documents or stats.epochs or stats.trajectory_blocks:
+        log.warning (
+            'rolled back %s documents, %s trajectory blocks and the epochs of %s written by uncommitted blocks',
+            stats.documents, stats.trajectory_blocks, sorted (stats.epochs)
+        )
+    return stats
+
+
+def clamp_progress (db: Database, block_number: int) -> int:
+    """Move the progress recorded after `block_number` back to it."""
+    return db [PROGRESS_COLLECTION].update_many (
+        {'block_number': {'$gt': block_number}},
+        {'$set': {'block_number': block_number}}
+    ).modified_count
@@ -0,0 +1,130 @@
+"""Offline replay of a recording into the Mongo read model
+
+`replay_recording` feeds the blocks of a recording (see `isaac_api.recording`)
+straight into `handle_events`, without an Apibara server. Nothing is
+acknowledged to a server while replaying, so the blocks are always committed
+in groups (see `isaac_api.group_commit`) of up to `checkpoint_blocks` blocks,
+one `bulk_write` per collection; the indexer logs only warnings while replaying.
+
+Progress is checkpointed in `replay_checkpoints`:
+
+    {_id: 'replay', recording, block_number, epochs}
+
+after every group commit: every `checkpoint_blocks` blocks, after any block
+that starts a universe epoch, and at the end of the recording. An
+interrupted replay resumes after the checkpoint: the chain-aware
+documents written by the blocks after it are rolled back first, so those
+blocks are replayed onto the state they were recorded against.
+
+With `context.mongo` set, blocks and checkpoints go through its pool, with the
+catch-up write concern since no chain head is known while replaying.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from apibara.indexer.runner import Info
+from apibara.indexer.storage import Storage
+from pymongo.database import Database
+
+from isaac_api.epochs import EPOCHS_COLLECTION
+from isaac_api.group_commit import GROUP_MODE, GroupCommit
+from isaac_api.indexer import commit_group, handle_events, log
+from isaac_api.recording import read_blocks
+from isaac_api.recovery import clamp_progress, rollback, views
+
+CHECKPOINTS_COLLECTION = 'replay_checkpoints'
+CHECKPOINT_ID = 'replay'
+DEFAULT_CHECKPOINT_BLOCKS = 1000
+
+
+@dataclass
+class ReplayStats:
+    blocks: int = 0
+    events: int = 0
+    seconds: float = 0.0
+    resumed_after: Optional[int] = None
+
+    @property
+    def events_per_second (self) -> float:
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+def _epochs (db: Database) -> Dict[str, int]:
+    return {str (doc ['univ']): doc ['epoch'] for doc in db [EPOCHS_COLLECTION].find ()}
+
+
+def resume_point (db: Database, universes: Iterable[int], epochs) -> Optional[int]:
+    """Block of the last checkpoint, after rolling the read model back to it."""
+    checkpoint = db [CHECKPOINTS_COLLECTION].find_one ({'_id': CHECKPOINT_ID})
+    if checkpoint is None:
+        return None
+    if _epochs (db) != checkpoint ['epochs']:
+        # the collections of the checkpoint's epoch may already be dropped
+        raise RuntimeError (
+            f"a universe epoch started after the checkpoint at block {checkpoint ['block_number']}; "
+            f"replay again with --restart"
+        )
+    rollback (db, checkpoint ['block_number'], skip = views (universes, epochs) | {CHECKPOINTS_COLLECTION})
+    clamp_progress (db, checkpoint ['block_number'])
+    return checkpoint ['block_number']
+
+
+def save_checkpoint (db: Database, recording: str, block_number: int):
+    db [CHECKPOINTS_COLLECTION].replace_one (
+        {'_id': CHECKPOINT_ID},
+        {'recording': os.path.abspath (recording), 'block_number': block_number, 'epochs': _epochs (db)},
+        upsert = True
+    )
+
+
+async def _save_checkpoint (context, db: Database, recording: str, block_number: int):
+    if context.mongo is None:
+        save_checkpoint (db, recording, block_number)
+    else:
+        await context.mongo.run (save_checkpoint, db, recording, block_number)
+
+
+async def replay_recording (
+    db: Database,
+    recording: str,
+    context,
+    resumed_after: Optional[int] = None,
+    checkpoint_blocks: int = DEFAULT_CHECKPOINT_BLOCKS,
+    quiet: bool = True,
+) -> ReplayStats:
+    """Feed the blocks of `recording` after `resumed_after` to `handle_events`."""
+    stats = ReplayStats (resumed_after = resumed_after)
+    started = time.perf_counter ()
+    last_block = None
+    # no chain head is known while replaying: the group mode is set rather than entered
+    group = context.group = GroupCommit (max_blocks = checkpoint_blocks, enter_lag = 0, mode = GROUP_MODE)
+
+    level = log.level
+    if quiet:
+        log.setLevel (logging.WARNING)
+    try:
+        for block_events in read_blocks (recording, after = resumed_after):
+            block_number = block_events.block.number
+            epochs_before = context.epochs.current ()
+            info = Info (context = context, rpc_client = None, storage = Storage (db, block_number))
+            await handle_events (info, block_events)
+
+            stats.blocks += 1
+            stats.events += len (block_events.events)
+            last_block = block_number
+            if group.uow is not None and context.epochs.current () != epochs_before:
+                await commit_group (context)
+            if group.uow is None:
+                await _save_checkpoint (context, db, recording, block_number)
+        if group.uow is not None:
+            await commit_group (context)
+            await _save_checkpoint (context, db, recording, last_block)
+    finally:
+        log.setLevel (level)
+
+    stats.seconds = time.perf_counter () - started
+    return stats
@@ -0,0 +1,138 @@
+"""Sharding of the isaac indexer across processes, by universe
+
+`ISAAC_SHARDS` lists the universes of each shard, shards separated by `;`:
+
+    ISAAC_SHARDS="0,1;2,3"
+
+Each shard worker runs its own Apibara indexer, with its own cursor and the
+events of its universes only, plus the lobby's universe (de)activation events
+for the universe collections they touch. A single lobby coordinator handles
+the lobby events for `lobby_queue`. All processes write to the same database.
+
+`shard_progress` records the last block committed for each universe and for
+the lobby, one document per key (`u{univ}` or `lobby`):
+
+    {_id, block_number, head_block, indexer_id}
+
+A worker skips the events of a universe up to its recorded block. The indexer
+id of a worker is derived from its universes, so rebalancing is a matter of
+stopping the workers, changing `ISAAC_SHARDS` and starting them again: a
+worker whose universes changed gets a new indexer, which starts from the
+earliest block recorded for its universes.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+PROGRESS_COLLECTION = 'shard_progress'
+LOBBY_KEY = 'lobby'
+
+
+def universe_key (univ: int) -> str:
+    return f'u{univ}'
+
+
+def parse_shards (spec: str) -> List[List[int]]:
+    """Universes of each shard from an `ISAAC_SHARDS` value."""
+    shards = [[int (u) for u in part.split (',') if u.strip ()] for part in spec.split (';') if part.strip ()]
+    seen = [u for shard in shards for u in shard]
+    if len (seen) != len (set (seen)):
+        raise ValueError (f'Invalid shards {spec!r}: a universe is assigned to several shards')
+    if any (not shard for shard in shards):
+        raise ValueError (f'Invalid shards {spec!r}: empty shard')
+    return shards
+
+
+@dataclass (frozen = True)
+class ShardRole:
+    """What one indexer process handles; `universes` None means every universe."""
+    indexer_id: str = ''
+    universes: Optional[FrozenSet[int]] = None
+    lobby: bool = True
+
+    @classmethod
+    def worker (cls, base_id: str, universes: Iterable[int]) -> 'ShardRole':
+        universes = frozenset (universes)
+        return cls (f'{base_id}-' + '-'.join (universe_key (u) for u in sorted (universes)), universes, lobby = False)
+
+    @classmethod
+    def coordinator (cls, base_id: str) -> 'ShardRole':
+        return cls (f'{base_id}-{LOBBY_KEY}', frozenset (), lobby = True)
+
+
+@dataclass
+class ShardState:
+    """The role of this process and the progress of its universes."""
+    role: ShardRole = field (default_factory = ShardRole)
+    universes: List[int] = field (default_factory = list)   # universes configured
+    progress: Dict[str, int] = field (default_factory = dict)
+
+    def owned (self) -> List[int]:
+        if self.role.universes is None:
+            return list (self.universes)
+        return sorted (self.role.universes)
+
+    def keys (self) -> List[str]:
+        return [universe_key (u) for u in self.owned ()] + ([LOBBY_KEY] if self.role.lobby else [])
+
+    def owns (self, univ: int, block_number: int) -> bool:
+        """Whether this process handles the events of `univ` in this block."""
+        if self.role.universes is not None and univ not in self.role.universes:
+            return False
+        return self.progress.get (universe_key (univ), -1) < block_number
+
+    def owns_lobby (self, block_number: int) -> bool:
+        return self.role.lobby and self.progress.get (LOBBY_KEY, -1) < block_number
+
+    def load (self, db: Database):
+        self.progress = {
+            doc ['_id']: doc ['block_number']
+            for doc in db [PROGRESS_COLLECTION].find ({'_id': {'$in': self.keys ()}})
+        }
+
+    def start_block (self, default: int) -> int:
+        """Block to start a new indexer from: the earliest block recorded for the keys of this process."""
+        return min ([self.progress.get (key, default) for key in self.keys ()], default = default)
+
+    def record (self, storage, block_number: int, head_block: int = 0):
+        """Queue the progress of this block on the unit of work `storage`, written after its documents."""
+        for key in self.keys ():
+            if self.progress.get (key, -1) >= block_number:
+                continue
+            storage.queue_write (PROGRESS_COLLECTION, UpdateOne (
+                {'_id': key},
+                {'$set': {'block_number': block_number, 'head_block': head_block, 'indexer_id': self.role.indexer_id}},
+                upsert = True
+            ), last = True)
+        storage.on_commit (lambda: self.progress.update ({
+            key: block_number for key in self.keys () if self.progress.get (key, -1) < block_number
+        }))
+
+    def forget (self, db: Database):
+        """Drop the recorded progress of this process, to index again from the start."""
+        db [PROGRESS_COLLECTION].delete_many ({'_id': {'$in': self.keys ()}})
+        self.progress = {}
+
+
+def shard_status (db: Database, shards: List[List[int]]) -> List[dict]:
+    """Last block, head and lag of each shard and of the lobby coordinator."""
+    progress = {doc ['_id']: doc for doc in db [PROGRESS_COLLECTION].find ()}
+    rows = []
+    for name, keys in [(str (i), [universe_key (u) for u in shard]) for i, shard in enumerate (shards)] + [(LOBBY_KEY, [LOBBY_KEY])]:
+        docs = [progress.get (key) for key in keys]
+        if any (doc is None for doc in docs):
+            rows.append ({'shard': name, 'keys': keys, 'block_number': None, 'head_block': None, 'lag': None})
+            continue
+        block_number = min (doc ['block_number'] for doc in docs)
+        head_block = max (doc.get ('head_block') or 0 for doc in progress.values())
+        rows.append ({
+            'shard': name,
+            'keys': keys,
+            'block_number': block_number,
+            'head_block': head_block or None,
+            'lag': max (0, head_block - block_number) if head_block else None,
+        })
+    return rows
@@ -0,0 +1,58 @@
+"""Index of the utx sets tethered to each deployed device
+
+Every deployed utx set is tethered to the device at its `src_grid` and the one
+at its `dst_grid`. `u{univ}_utx_tethers` records one document per end:
+
+    {device_id, label, end}
+
+so picking up a device finds its tethered utx sets with a single indexed
+lookup on `device_id` instead of scanning utx sets cell by cell.
+"""
+
+from typing import Any, Callable, Dict, Optional
+
+from pymongo.database import Database
+
+from isaac_api.footprint import DeployedDevices
+
+Document = Dict[str, Any]
+
+SRC_END = 'src'
+DST_END = 'dst'
+
+
+def tethers_collection (univ: int) -> str:
+    return f'u{univ}_utx_tethers'
+
+
+def backfill_tethers (db: Database, univ: int, deployed: DeployedDevices, resolve: Optional[Callable[[str], str]] = None) -> int:
+    """Write the tether documents of current utx sets indexed before the tether index existed.
+
+    Returns the number of tether documents written.
+    """
+    current = {'_chain.valid_to': None}
+    tethers = db [resolve (tethers_collection (univ)) if resolve is not None else tethers_collection (univ)]
+    known = {doc ['label'] for doc in tethers.find (current, {'label': 1})}
+
+    device_at: Dict[str, str] = {}
+    for doc in db [deployed.collection (univ)].find (current):
+        for cell in DeployedDevices.cells_of ([doc]):
+            device_at [f"{cell['x']}:{cell['y']}"] = doc ['id']
+
+    docs = []
+    for utx_set in db [f'u{univ}_deployed_utx_sets'].find (current):
+        if utx_set ['label'] in known or not utx_set.get ('tethered'):
+            continue
+        for end, grid in ((SRC_END, utx_set ['src_grid']), (DST_END, utx_set ['dst_grid'])):
+            device_id = device_at.get (f"{grid['x']}:{grid['y']}")
+            if device_id is None:
+                continue
+            docs.append ({
+                'device_id' : device_id,
+                'label'     : utx_set ['label'],
+                'end'       : end,
+                '_chain'    : {'valid_from': utx_set ['_chain']['valid_from'], 'valid_to': None},
+            })
+    if docs:
+        tethers.insert_many (docs)
+    return len (docs)
@@ -0,0 +1,240 @@
+"""Bucketed, columnar storage of macro trajectories
+
+`u{univ}_macro_trajectory` holds one document per `bucket_blocks` blocks:
+
+    {bucket, start_block, end_block, count, sealed, block_numbers, columns: {sun0_q_x, ..., phi}}
+
+The open bucket is appended to in place with `$push`, one value per column per
+forwarded block. Once the trajectory moves past it the bucket is sealed: its
+columns are rewritten once as packed little-endian float64 (block numbers as
+int64) binaries. Readers accept both forms.
+
+The trajectory is derived from `forward_world_macro_occurred` and is written
+outside apibara's chain versioning; crash recovery brings it back in line with
+the chain-aware `u{univ}_macro_states` with `MacroTrajectory.repair`.
+"""
+
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from bson import Binary
+from pymongo import DeleteMany, UpdateOne
+from pymongo.database import Database
+
+from isaac_api.felts import DYNAMICS_FIELDS
+
+COLUMNS = [f'{body}_{vec}_{axis}' for body, vec, axis in DYNAMICS_FIELDS] + ['phi']
+
+PHI_SCALE = 10**20
+DEFAULT_BUCKET_BLOCKS = 256
+
+
+def trajectory_collection (univ: int) -> str:
+    return f'u{univ}_macro_trajectory'
+
+
+def row_from_dynamics (dynamics: Sequence[float], phi: int) -> List[float]:
+    """Trajectory row of the 16 flat dynamics values (`isaac_api.felts.DYNAMICS_FIELDS` order) and phi."""
+    return list (dynamics) + [phi / PHI_SCALE]
+
+
+def row_from_macro_state (doc: Dict[str, Any]) -> List[float]:
+    """Trajectory row of a `u{univ}_macro_states` document."""
+    dynamics = [doc ['dynamics'][body][vec][axis] for body, vec, axis in DYNAMICS_FIELDS]
+    return row_from_dynamics (dynamics, int.from_bytes (doc ['phi'], 'big'))
+
+
+#
+# Packing
+#
+def _pack (values: array) -> Binary:
+    if sys.byteorder != 'little':
+        values = array (values.typecode, values)
+        values.byteswap ()
+    return Binary (values.tobytes ())
+
+
+def _unpack (typecode: str, packed) -> array:
+    if isinstance (packed, list):
+        return array (typecode, packed)
+    values = array (typecode)
+    values.frombytes (bytes (packed))
+    if sys.byteorder != 'little':
+        values.byteswap ()
+    return values
+
+
+@dataclass
+class TrajectorySlice:
+    """Macro states of a block interval, column-major: `values[c*n:(c+1)*n]` is column `columns[c]`.
+
+    Both arrays support the buffer protocol, e.g.
+    `numpy.frombuffer (s.values, dtype='float64').reshape (len (s.columns), len (s))`.
+    """
+    block_numbers: array
+    values: array
+    columns: List[str]
+
+    def __len__ (self) -> int:
+        return len (self.block_numbers)
+
+    def column (self, name: str) -> array:
+        n = len (self)
+        c = self.columns.index (name)
+        return self.values [c*n:(c+1)*n]
+
+
+class _OpenBucket:
+    def __init__ (self, bucket: int) -> None:
+        self.bucket = bucket
+        self.block_numbers = array ('q')
+        self.columns = {name: array ('d') for name in COLUMNS}
+
+
+class MacroTrajectory:
+    """Appends each universe's macro states to its open trajectory bucket."""
+
+    def __init__ (self, bucket_blocks: int = DEFAULT_BUCKET_BLOCKS) -> None:
+        self.bucket_blocks = bucket_blocks
+        self._open: Dict[int, Optional[_OpenBucket]] = {}
+
+    def warm (self, db: Database, universes: Iterable[int], resolve: Optional[Callable[[str], str]] = None):
+        """Reload the open bucket of each universe so appends continue where they left off."""
+        resolve = resolve or (lambda collection: collection)
+        for univ in universes:
+            self._open [univ] = None
+            for doc in db [resolve (trajectory_collection (univ))].find ({'sealed': False}, sort = [('bucket', -1)], limit = 1):
+                open_bucket = _OpenBucket (doc ['bucket'])
+                open_bucket.block_numbers = _unpack ('q', doc ['block_numbers'])
+                for name in COLUMNS:
+                    open_bucket.columns [name] = _unpack ('d', doc ['columns'][name])
+                self._open [univ] = open_bucket
+
+    async def append (self, storage, univ: int, block_number: int, row: List[float]):
+        for request in self._appends (univ, block_number, row):
+            storage.queue_write (trajectory_collection (univ), request)
+
+    def _appends (self, univ: int, block_number: int, row: List[float]) -> List[UpdateOne]:
+        """Requests appending `row` to the trajectory of `univ`, sealing the open bucket first if needed."""
+        requests = []
+        open_bucket = self._open.get (univ)
+
+        # a block replayed after a restart was already appended
+        if open_bucket is not None and len (open_bucket.block_numbers) and block_number <= open_bucket.block_numbers [-1]:
+            return requests
+
+        bucket = block_number // self.bucket_blocks
+        if open_bucket is not None and open_bucket.bucket != bucket:
+            requests.append (UpdateOne (
+                {'bucket': open_bucket.bucket},
+                {'$set': {
+                    'sealed': True,
+                    'block_numbers': _pack (open_bucket.block_numbers),
+                    **{f'columns.{name}': _pack (values) for name, values in open_bucket.columns.items()},
+                }}
+            ))
+            open_bucket = None
+
+        if open_bucket is None:
+            open_bucket = _OpenBucket (bucket)
+            self._open [univ] = open_bucket
+
+        open_bucket.block_numbers.append (block_number)
+        for name, value in zip (COLUMNS, row):
+            open_bucket.columns [name].append (value)
+
+        requests.append (UpdateOne (
+            {'bucket': bucket},
+            {
+                '$setOnInsert': {'start_block': bucket * self.bucket_blocks, 'sealed': False},
+                '$set': {'end_block': block_number},
+                '$inc': {'count': 1},
+                '$push': {
+                    'block_numbers': block_number,
+                    **{f'columns.{name}': value for name, value in zip (COLUMNS, row)},
+                },
+            },
+            upsert = True
+        ))
+        return requests
+
+    def forget (self, univ: int):
+        """Drop the open bucket of `univ` from memory, leaving storage as is."""
+        self._open [univ] = None
+
+    def reset (self, storage, univ: int):
+        """Drop the trajectory of `univ`, e.g. when the lobby deactivates it.
+
+        The macro states are cleared in the same block, so `repair` rebuilds the
+        trajectory when the block is not committed.
+        """
+        self.forget (univ)
+        storage.queue_write (trajectory_collection (univ), DeleteMany ({}))
+
+    def repair (self, db: Database, univ: int, block_number: int, resolve: Optional[Callable[[str], str]] = None) -> int:
+        """Make the trajectory of `univ` hold the current macro states up to `block_number` again.
+
+        Values appended by the blocks after `block_number` are truncated, then the
+        current `u{univ}_macro_states` missing from the trajectory, e.g. dropped by
+        a reset of a block that was not committed, are appended back. Returns the
+        number of blocks removed and appended.
+        """
+        resolve = resolve or (lambda collection: collection)
+        collection = db [resolve (trajectory_collection (univ))]
+        repaired = 0
+
+        for doc in collection.find ({'end_block': {'$gt': block_number}}):
+            blocks = _unpack ('q', doc ['block_numbers'])
+            keep = sum (1 for b in blocks if b <= block_number)
+            repaired += len (blocks) - keep
+            if keep == 0:
+                collection.delete_one ({'_id': doc ['_id']})
+                continue
+            # the bucket is the last one again, appended to in place
+            collection.update_one ({'_id': doc ['_id']}, {'$set': {
+                'sealed': False,
+                'end_block': blocks [keep - 1],
+                'count': keep,
+                'block_numbers': blocks [:keep].tolist (),
+                **{f'columns.{name}': _unpack ('d', doc ['columns'][name]) [:keep].tolist () for name in COLUMNS},
+            }})
+
+        last = collection.find_one ({}, sort = [('end_block', -1)])
+        self.warm (db, [univ], resolve)
+        requests = []
+        for state in db [resolve (f'u{univ}_macro_states')].find (
+            {'_chain.valid_to': None, 'block_number': {'$gt': last ['end_block'] if last else -1, '$lte': block_number}},
+            sort = [('block_number', 1)]
+        ):
+            requests += self._appends (univ, state ['block_number'], row_from_macro_state (state))
+            repaired += 1
+        if requests:
+            collection.bulk_write (requests, ordered = True)
+        return repaired
+
+
+def read_trajectory (db: Database, univ: int, start_block: int, end_block: int) -> TrajectorySlice:
+    """Macro states with `start_block <= block_number <= end_block`, as one contiguous buffer."""
+    block_numbers = array ('q')
+    per_column = {name: array ('d') for name in COLUMNS}
+
+    docs = db [trajectory_collection (univ)].find (
+        {'start_block': {'$lte': end_block}, 'end_block': {'$gte': start_block}},
+        sort = [('start_block', 1)]
+    )
+    for doc in docs:
+        blocks = _unpack ('q', doc ['block_numbers'])
+        lo = next ((i for i, b in enumerate (blocks) if b >= start_block), len (blocks))
+        hi = next ((i for i in range (len (blocks) - 1, -1, -1) if blocks [i] <= end_block), -1) + 1
+        if lo >= hi:
+            continue
+        block_numbers.extend (blocks [lo:hi])
+        for name in COLUMNS:
+            per_column [name].extend (_unpack ('d', doc ['columns'][name]) [lo:hi])
+
+    values = array ('d')
+    for name in COLUMNS:
+        values.extend (per_column [name])
+    return TrajectorySlice (block_numbers, values, list (COLUMNS))
@@ -0,0 +1,470 @@
+"""Per-block unit of work for the isaac indexer"""
+
+import asyncio
+import copy
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateMany, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.write_concern import WriteConcern
+
+from isaac_api.mongo import AsyncMongo
+
+Document = Dict[str, Any]
+Filter = Dict[str, Any]
+Update = Dict[str, Any]
+Projection = Dict[str, Any]
+
+
+#
+# Minimal in-process evaluation of the filters and update operators used by the handlers,
+# applied to the documents created in the current block
+#
+def _get_path (doc: Document, path: str) -> Tuple[bool, Any]:
+    value = doc
+    for key in path.split ('.'):
+        if not isinstance (value, dict) or key not in value:
+            return False, None
+        value = value [key]
+    return True, value
+
+
+def _value_matches (value: Any, condition: Any) -> bool:
+    if isinstance (condition, dict) and condition and all (k.startswith ('$') for k in condition):
+        for op, operand in condition.items():
+            if op == '$in':
+                if not any (_value_matches (value, o) for o in operand):
+                    return False
+            elif op == '$nin':
+                if any (_value_matches (value, o) for o in operand):
+                    return False
+            elif op == '$ne':
+                if _value_matches (value, operand):
+                    return False
+            elif op == '$lt':
+                if value is None or not value < operand:
+                    return False
+            else:
+                raise ValueError (f'Unsupported filter operator {op}')
+        return True
+
+    # arrays match a scalar condition if any element equals it (multikey semantics)
+    if isinstance (value, list) and not isinstance (condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches (doc: Document, filter: Filter) -> bool:
+    for key, condition in filter.items():
+        if key == '$or':
+            if not any (matches (doc, f) for f in condition):
+                return False
+        elif key == '$and':
+            if not all (matches (doc, f) for f in condition):
+                return False
+        elif key == '$nor':
+            if any (matches (doc, f) for f in condition):
+                return False
+        else:
+            found, value = _get_path (doc, key)
+            if not _value_matches (value if found else None, condition):
+                return False
+    return True
+
+
+def _set_path (doc: Document, path: str, value: Any):
+    keys = path.split ('.')
+    for key in keys[:-1]:
+        doc = doc.setdefault (key, {})
+    doc [keys[-1]] = value
+
+
+def apply_update (doc: Document, update: Update):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == '$set':
+                _set_path (doc, path, value)
+            elif op == '$inc':
+                _, current = _get_path (doc, path)
+                _set_path (doc, path, (current or 0) + value)
+            elif op == '$unset':
+                keys = path.split ('.')
+                found, parent = _get_path (doc, '.'.join (keys[:-1])) if len (keys) > 1 else (True, doc)
+                if found and isinstance (parent, dict):
+                    parent.pop (keys[-1], None)
+            else:
+                raise ValueError (f'Unsupported update operator {op}')
+
+
+def _project (doc: Document, projection: Optional[Projection]) -> Document:
+    if not projection:
+        return copy.deepcopy (doc)
+    included = [k for k, v in projection.items() if v]
+    if included:
+        projected = {k: copy.deepcopy (doc [k]) for k in included if k in doc}
+        if projection.get ('_id', 1) and '_id' in doc:
+            projected ['_id'] = doc ['_id']
+        return projected
+    return {k: copy.deepcopy (v) for k, v in doc.items() if projection.get (k, 1)}
+
+
+class CollectionChanges (NamedTuple):
+    """What a block did to the current documents of one collection."""
+    closed_ids: Set[ObjectId]     # pre-block documents clamped one by one
+    closed_filters: List[Filter]  # delete_many filters applied to the pre-block documents
+    created: List[Document]       # documents created in the block and still current
+
+
+#
+# Unit of work
+#
+class BlockUnitOfWork:
+    """Chain-aware storage that queues the writes of one block and flushes them
+    as ordered ``bulk_write`` batches, one per collection.
+
+    It exposes the same coroutines as apibara's ``Storage`` so handlers use it
+    through ``info.storage`` unchanged. Documents versioned during the block are
+    kept in memory until ``commit``; reads see them, and do not see the
+    pre-block documents that the block has already clamped or deleted.
+
+    `resolve` maps the collection names used by the handlers to the collections
+    actually read and written; it is applied when a request is issued. With
+    `concurrent_reads`, reads leave the event loop free for handlers working on
+    other collections. With `mongo` (an `isaac_api.mongo.AsyncMongo`), every
+    read runs on its pool, and `commit` writes the batches of all collections
+    concurrently, with `write_concern`. Requests queued with
+    `queue_write (..., last = True)` are written once all the others are.
+
+    `coalesce_update` defers a `$set` on one document and merges it with the
+    deferred `$set`s of the same document, the last write of a field winning.
+    The merged update is applied as one `find_one_and_update` before any other
+    request on the collection, or by `flush`, so the result is the same as
+    updating in order.
+
+    `advance` carries the unit of work on to a later block, to commit the
+    writes of several blocks together: each document keeps the block that
+    created it and the block that clamped it, and a document created by an
+    earlier block is versioned rather than updated in place, as if every block
+    had been committed on its own.
+    """
+
+    def __init__ (
+        self,
+        db: Database,
+        block_number: int,
+        resolve: Optional[Callable[[str], str]] = None,
+        concurrent_reads: bool = False,
+        mongo: Optional[AsyncMongo] = None,
+        write_concern: Optional[WriteConcern] = None,
+    ) -> None:
+        self._db = db
+        self._block_number = block_number
+        self._resolve = resolve or (lambda collection: collection)
+        self._concurrent_reads = concurrent_reads
+        self._mongo = mongo
+        self._write_concern = write_concern
+        self._after_commit: List[Tuple[Callable[[], None], bool]] = []
+
+        self._ops: Dict[str, list] = {}              # collection => queued pymongo requests, in issue order
+        self._last: Set[str] = set ()                     # collections written after all the others
+        self._pending: Dict[str, Dict[ObjectId, Document]] = {}   # collection => documents inserted in this block
+        self._clamped: Dict[str, set] = {}           # collection => pre-block _ids clamped in this block
+        self._deleted: Dict[str, List[Filter]] = {}  # collection => delete_many filters applied to pre-block documents
+        self._deferred: Dict[str, Dict[tuple, Tuple[Filter, Dict[str, Any]]]] = {}  # collection => filter key => (filter, fields to $set)
+
+        self.reads = 0
+        self.writes = 0
+
+    @property
+    def block_number (self) -> int:
+        return self._block_number
+
+    @property
+    def db (self) -> Database:
+        return self._db
+
+    async def advance (self, block_number: int):
+        """Queue the writes from now on for `block_number`, a block after the current one."""
+        if block_number <= self._block_number:
+            raise ValueError (f'Cannot advance from block {self._block_number} to block {block_number}')
+        # the deferred updates belong to the current block
+        await self.flush ()
+        self._block_number = block_number
+
+    #
+    # Writes
+    #
+    async def insert_one (self, collection: str, doc: Document):
+        collection = await self._use (collection)
+        self._insert (collection, doc)
+
+    async def insert_many (self, collection: str, docs: List[Document]):
+        collection = await self._use (collection)
+        for doc in docs:
+            self._insert (collection, doc)
+
+    async def delete_one (self, collection: str, filter: Filter):
+        collection = await self._use (collection)
+        existing, is_pending = await self._find_one_current (collection, filter)
+        if existing is not None:
+            self._clamp (collection, existing, is_pending)
+
+    async def delete_many (self, collection: str, filter: Filter):
+        collection = await self._use (collection)
+        for doc in self._pending_matches (collection, filter):
+            doc ['_chain']['valid_to'] = self._block_number
+
+        server_filter = dict (filter)
+        server_filter ['_chain.valid_to'] = None
+        server_filter ['_chain.valid_from'] = {'$lt': self._block_number}
+        self._queue (collection, UpdateMany (server_filter, {'$set': {'_chain.valid_to': self._block_number}}))
+        self._deleted.setdefault (collection, []).append (dict (filter))
+
+    async def find_one_and_replace (self, collection: str, filter: Filter, replacement: Document, upsert: bool = False):
+        collection = await self._use (collection)
+        existing, is_pending = await self._find_one_current (collection, filter)
+        if existing is not None:
+            self._clamp (collection, existing, is_pending)
+        if existing is not None or upsert:
+            self._insert (collection, replacement)
+        return _strip (existing)
+
+    async def find_one_and_update (self, collection: str, filter: Filter, update: Update):
+        collection = await self._use (collection)
+        return await self._find_one_and_update (collection, filter, update)
+
+    async def coalesce_update (self, collection: str, filter: Filter, update: Update):
+        """Deferred `find_one_and_update` with a `$set`-only update; see the class docstring."""
+        if set (update) != {'$set'}:
+            raise ValueError (f'Only $set updates can be coalesced, got {sorted (update)}')
+        collection = self._resolve (collection)
+        key = tuple (sorted (filter.items()))
+        _, fields = self._deferred.setdefault (collection, {}).setdefault (key, (dict (filter), {}))
+        fields.update (update ['$set'])
+
+    async def flush (self):
+        """Apply every deferred update."""
+        for collection in list (self._deferred):
+            await self._flush_deferred (collection)
+
+    async def _find_one_and_update (self, collection: str, filter: Filter, update: Update):
+        existing, is_pending = await self._find_one_current (collection, filter)
+        if existing is None:
+            return None
+
+        before = _strip (existing)
+        if is_pending and existing ['_chain']['valid_from'] == self._block_number:
+            # the current version was created in this block: update it in place
+            apply_update (existing, update)
+        else:
+            self._clamp (collection, existing, is_pending)
+            new_version = copy.deepcopy (before)
+            apply_update (new_version, update)
+            self._insert (collection, new_version)
+        return before
+
+    async def update_many (self, collection: str, filter: Filter, update: Update) -> int:
+        """Chain-aware update of every current document matching `filter`, with a single read."""
+        collection = await self._use (collection)
+        updated = 0
+        for doc in self._pending_matches (collection, filter):
+            if doc ['_chain']['valid_from'] == self._block_number:
+                apply_update (doc, update)
+            else:
+                self._clamp (collection, doc, True)
+                new_version = _strip (doc)
+                apply_update (new_version, update)
+                self._insert (collection, new_version)
+            updated += 1
+        for doc in await self._server_find (collection, filter):
+            self._clamp (collection, doc, False)
+            new_version = _strip (doc)
+            apply_update (new_version, update)
+            self._insert (collection, new_version)
+            updated += 1
+        return updated
+
+    #
+    # Reads
+    #
+    async def find_one (self, collection: str, filter: Filter) -> Optional[Document]:
+        collection = await self._use (collection)
+        existing, _ = await self._find_one_current (collection, filter)
+        return copy.deepcopy (existing)
+
+    async def find (
+        self,
+        collection: str,
+        filter: Filter,
+        projection: Optional[Projection] = None,
+        skip: Optional[int] = None,
+        limit: Optional[int] = None,
+        sort: Optional[List[Tuple[str, int]]] = None,
+    ) -> List[Document]:
+        collection = await self._use (collection)
+        # the server cannot skip over documents it does not know about yet: skip after merging
+        server_limit = (skip or 0) + limit if limit else 0
+        docs = (await self._server_find (collection, filter, sort, server_limit)) + self._pending_matches (collection, filter)
+        if sort:
+            for key, direction in reversed (sort):
+                docs.sort (key = lambda doc: _get_path (doc, key)[1], reverse = direction < 0)
+        docs = docs [skip or 0:]
+        if limit:
+            docs = docs [:limit]
+        return [_project (doc, projection) for doc in docs]
+
+    #
+    # Commit
+    #
+    async def commit (self) -> int:
+        """Flush all queued requests; returns the number of requests written."""
+        await self.flush ()
+        written = 0
+        for last in (False, True):
+            batches = [(c, ops) for c, ops in self._ops.items() if ops and (c in self._last) == last]
+            await self._write (batches)
+            self.writes += len (batches)
+            written += sum (len (ops) for _, ops in batches)
+        self._ops.clear ()
+        self._last.clear ()
+        self._pending.clear ()
+        self._clamped.clear ()
+        self._deleted.clear ()
+
+        callbacks, self._after_commit = self._after_commit, []
+        for callback, blocking in callbacks:
+            if blocking:
+                await self._read (callback)
+            else:
+                callback ()
+        return written
+
+    def changes (self) -> Dict[str, CollectionChanges]:
+        """Changes to the current documents made so far, by collection; call after `flush` and before `commit`."""
+        return {
+            collection: CollectionChanges (
+                closed_ids = set (self._clamped.get (collection, ())),
+                closed_filters = list (self._deleted.get (collection, ())),
+                created = [
+                    copy.deepcopy (doc) for doc in self._pending.get (collection, {}).values()
+                    if doc ['_chain']['valid_to'] is None
+                ],
+            )
+            for collection in set (self._pending) | set (self._clamped) | set (self._deleted)
+        }
+
+    def queue_write (self, collection: str, request, last: bool = False):
+        """Queue a raw pymongo request for a collection kept outside chain versioning."""
+        collection = self._resolve (collection)
+        self._queue (collection, request)
+        if last:
+            self._last.add (collection)
+
+    def on_commit (self, callback: Callable[[], None], blocking: bool = False):
+        """Run `callback` once the queued requests are written.
+
+        A `blocking` callback makes driver calls: it runs off the event loop like
+        the reads, and `commit` returns once it is done.
+        """
+        self._after_commit.append ((callback, blocking))
+
+    def pending_request_count (self) -> int:
+        return sum (len (ops) for ops in self._ops.values())
+
+    #
+    # Internals
+    #
+    async def _use (self, collection: str) -> str:
+        """Resolve `collection` and apply its deferred updates, ahead of a request on it."""
+        collection = self._resolve (collection)
+        if collection in self._deferred:
+            await self._flush_deferred (collection)
+        return collection
+
+    async def _flush_deferred (self, collection: str):
+        for filter, fields in self._deferred.pop (collection).values():
+            await self._find_one_and_update (collection, filter, {'$set': fields})
+
+    async def _write (self, batches: List[Tuple[str, list]]):
+        if self._mongo is None:
+            for collection, ops in batches:
+                self._collection (collection).bulk_write (ops, ordered=True)
+            return
+        # one connection per collection: the batches are independent
+        await self._mongo.gather ([
+            partial (self._collection (collection).bulk_write, ops, ordered=True) for collection, ops in batches
+        ])
+
+    def _collection (self, collection: str) -> Collection:
+        if self._write_concern is None:
+            return self._db [collection]
+        return self._db [collection].with_options (write_concern = self._write_concern)
+
+    def _queue (self, collection: str, request):
+        self._ops.setdefault (collection, []).append (request)
+
+    def _insert (self, collection: str, doc: Document):
+        doc ['_id'] = ObjectId ()
+        doc ['_chain'] = {'valid_from': self._block_number, 'valid_to': None}
+        self._pending.setdefault (collection, {}) [doc ['_id']] = doc
+        self._queue (collection, InsertOne (doc))
+
+    def _clamp (self, collection: str, doc: Document, is_pending: bool):
+        if is_pending:
+            doc ['_chain']['valid_to'] = self._block_number
+            return
+        self._clamped.setdefault (collection, set()).add (doc ['_id'])
+        self._queue (collection, UpdateOne (
+            {'_id': doc ['_id']},
+            {'$set': {'_chain.valid_to': self._block_number}}
+        ))
+
+    def _pending_matches (self, collection: str, filter: Filter) -> List[Document]:
+        return [
+            doc for doc in self._pending.get (collection, {}).values()
+            if doc ['_chain']['valid_to'] is None and matches (doc, filter)
+        ]
+
+    def _server_query (self, collection: str, filter: Filter) -> Filter:
+        query = dict (filter)
+        query ['_chain.valid_to'] = None
+        clamped = self._clamped.get (collection)
+        if clamped:
+            query ['_id'] = {'$nin': list (clamped)}
+        deleted = self._deleted.get (collection)
+        if deleted:
+            query ['$nor'] = list (deleted)
+        return query
+
+    async def _server_find (self, collection: str, filter: Filter, sort = None, limit: int = 0) -> List[Document]:
+        self.reads += 1
+        query = self._server_query (collection, filter)
+        return await self._read (lambda: list (self._db [collection].find (query, sort = sort, limit = limit)))
+
+    async def _find_one_current (self, collection: str, filter: Filter) -> Tuple[Optional[Document], bool]:
+        for doc in self._pending_matches (collection, filter):
+            return doc, True
+        self.reads += 1
+        query = self._server_query (collection, filter)
+        return await self._read (lambda: self._db [collection].find_one (query)), False
+
+    async def _read (self, fn: Callable[[], Any]) -> Any:
+        # with concurrent reads the blocking driver call runs on the default executor,
+        # so handlers of other universes progress while this one waits on Mongo
+        if self._mongo is not None:
+            return await self._mongo.run (fn)
+        if not self._concurrent_reads:
+            return fn ()
+        return await asyncio.get_running_loop ().run_in_executor (None, fn)
+
+
+def _strip (doc: Optional[Document]) -> Optional[Document]:
+    if doc is None:
+        return None
+    doc = copy.deepcopy (doc)
+    doc.pop ('_id', None)
+    doc.pop ('_chain', None)
+    return doc
@@ -0,0 +1,224 @@
+"""In-memory materialized views of the current documents, fed by the isaac indexer
+
+`MaterializedViews` holds, for each universe, the current documents of the
+collections the frontends poll (`VIEW_NAMES`, plus the deployed devices
+collection of the storage mode), keyed by `_id`. It is loaded from Mongo once,
+then kept up to date from the changes of each committed block
+(`BlockUnitOfWork.changes`), so serving a view never reads Mongo.
+
+Every view also keeps the changes of the last `retention_blocks` blocks, as
+
+    {block, op: 'put', doc}     a document became current
+    {block, op: 'remove', id}   the document with this _id stopped being current
+
+A chain-aware update is a `remove` of the old version followed by a `put` of
+the new one. `changes_since (n)` returns None when the changes after block `n`
+are no longer all held (older than the retention, or before an epoch reset):
+the client fetches a snapshot again.
+
+Callables added to `MaterializedViews.listeners` receive the `BlockChanges` of
+each block applied, to push them to clients.
+"""
+
+import json
+import secrets
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo.database import Database
+
+from isaac_api.epochs import UniverseEpochs
+from isaac_api.footprint import DeployedDevices
+from isaac_api.unit_of_work import CollectionChanges, matches
+
+Document = Dict[str, Any]
+
+DEFAULT_RETENTION_BLOCKS = 1000
+
+# u{univ}_* collections served, besides the deployed devices collection of the storage mode
+VIEW_NAMES = [
+    'civ_state',
+    'player_fungible_balances',
+    'player_nonfungible_devices',
+    'player_inventories',
+    'deployed_utx_sets',
+    'macro_states',
+    'impulses',
+    'pgs',
+    'harvesters',
+    'transformers',
+    'upsfs',
+    'ndpes',
+]
+
+
+def _json_default (value: Any) -> Any:
+    if isinstance (value, ObjectId):
+        return str (value)
+    if isinstance (value, bytes):
+        return '0x' + value.hex ()
+    raise TypeError (f'Cannot serialize {type (value).__name__}')
+
+
+def dumps (value: Any) -> bytes:
+    return json.dumps (value, default = _json_default, separators = (',', ':')).encode ()
+
+
+def _public (doc: Document) -> Document:
+    """The document as served: `_chain` dropped, `_id` as a string."""
+    public = {k: v for k, v in doc.items() if k != '_chain'}
+    public ['_id'] = str (doc ['_id'])
+    return public
+
+
+def _matches_query (doc: Document, query: Dict[str, str]) -> bool:
+    # query strings carry text: compare on the string form of the field
+    return all (k in doc and str (doc [k]) == v for k, v in query.items())
+
+
+class BlockChanges (NamedTuple):
+    """Changes of the views of one block, by universe and view name."""
+    block: int
+    since: int                                  # previous block applied
+    universes: Dict[int, Dict[str, List[Document]]]
+    reset: Set[int]                             # universes whose views were cleared by a new epoch
+
+
+class View:
+    """Current documents of one collection of one universe, and their recent changes."""
+
+    def __init__ (self, block: int) -> None:
+        self.docs: Dict[ObjectId, Document] = {}
+        self.version = block   # last block that changed the view
+        self.floor = block     # changes after this block are all held
+        self._log: Deque[Tuple[int, List[Document]]] = deque ()   # (block, changes), oldest first
+        self._body: Optional[bytes] = None   # unfiltered snapshot documents at `version`
+
+    def apply (self, block: int, changes: CollectionChanges) -> List[Document]:
+        entries = []
+        closed = [doc_id for doc_id in changes.closed_ids if doc_id in self.docs]
+        for filter in changes.closed_filters:
+            closed += [doc_id for doc_id, doc in self.docs.items() if matches (doc, filter)]
+        for doc_id in closed:
+            if self.docs.pop (doc_id, None) is not None:
+                entries.append ({'block': block, 'op': 'remove', 'id': str (doc_id)})
+        for doc in changes.created:
+            self.docs [doc ['_id']] = doc
+            entries.append ({'block': block, 'op': 'put', 'doc': _public (doc)})
+        if entries:
+            self._log.append ((block, entries))
+            self.version = block
+            self._body = None
+        return entries
+
+    def reset (self, block: int):
+        self.docs.clear ()
+        self._log.clear ()
+        self.version = self.floor = block
+        self._body = None
+
+    def trim (self, oldest: int):
+        """Forget the changes of the blocks up to `oldest`."""
+        while self._log and self._log [0][0] <= oldest:
+            self._log.popleft ()
+        self.floor = max (self.floor, oldest)
+
+    def snapshot (self, query: Optional[Dict[str, str]] = None) -> bytes:
+        """JSON array of the current documents, in the order they became current."""
+        if query:
+            return dumps ([_public (doc) for doc in self.docs.values() if _matches_query (doc, query)])
+        if self._body is None:
+            self._body = dumps ([_public (doc) for doc in self.docs.values()])
+        return self._body
+
+    def changes_since (self, block: int, query: Optional[Dict[str, str]] = None) -> Optional[List[Document]]:
+        if block < self.floor:
+            return None
+        changes = []
+        for logged, entries in reversed (self._log):
+            if logged <= block:
+                break
+            changes [:0] = entries
+        if query:
+            # a filtered client ignores removals of documents it never saw
+            changes = [c for c in changes if c ['op'] == 'remove' or _matches_query (c ['doc'], query)]
+        return changes
+
+
+class MaterializedViews:
+    """Views of every universe, keyed by (univ, name)."""
+
+    def __init__ (self, retention_blocks: int = DEFAULT_RETENTION_BLOCKS) -> None:
+        self.retention_blocks = retention_blocks
+        self.block = 0   # last block applied
+        # ETags change when the process restarts, since the views are reloaded
+        self.generation = secrets.token_hex (4)
+        self._views: Dict[Tuple[int, str], View] = {}
+        self._sources: Dict[str, Tuple[int, str]] = {}   # physical collection => (univ, name)
+        self._epochs: Dict[int, int] = {}
+        self.listeners: List[Callable[[BlockChanges], None]] = []
+
+    def names (self) -> List[str]:
+        return sorted ({name for _, name in self._views})
+
+    def view (self, univ: int, name: str) -> Optional[View]:
+        return self._views.get ((univ, name))
+
+    def etag (self, univ: int, name: str, view: View) -> str:
+        return f'"{self.generation}-{univ}-{name}-{view.version}"'
+
+    def load (self, db: Database, universes: Iterable[int], epochs: UniverseEpochs, deployed: DeployedDevices):
+        """Read the current documents of every view."""
+        universes = list (universes)
+        names = VIEW_NAMES + [deployed.collection (0).split ('_', 1) [1]]
+        self._epochs = epochs.current ()
+        loaded = {}
+        for univ in universes:
+            for name in names:
+                collection = epochs.collection (f'u{univ}_{name}')
+                self._sources [collection] = (univ, name)
+                loaded [(univ, name)] = list (db [collection].find ({'_chain.valid_to': None}))
+        self.block = max (
+            [doc ['_chain']['valid_from'] for docs in loaded.values() for doc in docs], default = 0
+        )
+        for key, docs in loaded.items():
+            view = self._views [key] = View (self.block)
+            view.docs = {doc ['_id']: doc for doc in docs}
+
+    def apply (self, block_number: int, changes: Dict[str, CollectionChanges], epochs: UniverseEpochs):
+        """Apply the changes of a committed block."""
+        current = epochs.current ()
+        reset = {univ for univ, epoch in current.items() if self._epochs.get (univ, epoch) != epoch}
+        for univ in reset:
+            self._reset_universe (univ, block_number, epochs)
+        self._epochs = current
+
+        universes: Dict[int, Dict[str, List[Document]]] = {}
+        for collection, collection_changes in changes.items():
+            key = self._sources.get (collection)
+            if key is None:
+                continue
+            entries = self._views [key].apply (block_number, collection_changes)
+            if entries:
+                univ, name = key
+                universes.setdefault (univ, {}) [name] = entries
+
+        since, self.block = self.block, block_number
+        for listener in self.listeners:
+            listener (BlockChanges (block_number, since, universes, reset))
+        oldest = block_number - self.retention_blocks
+        if oldest > 0:
+            for view in self._views.values():
+                view.trim (oldest)
+
+    def _reset_universe (self, univ: int, block_number: int, epochs: UniverseEpochs):
+        # the universe moved to the empty collections of a new epoch
+        sources = {key: c for c, key in self._sources.items()}
+        for (view_univ, name), view in self._views.items():
+            collection = epochs.collection (f'u{univ}_{name}')
+            if view_univ != univ or sources [(univ, name)] == collection:
+                continue
+            view.reset (block_number)
+            del self._sources [sources [(univ, name)]]
+            self._sources [collection] = (univ, name)
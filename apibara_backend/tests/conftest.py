@@ -0,0 +1,38 @@
+"""Helpers shared by the tests that drive the isaac handlers: contract addresses,
+events, block headers, and a context to handle blocks with."""
+
+import asyncio
+
+from apibara.indexer.runner import Info
+from apibara.indexer.storage import Storage
+from apibara.model import BlockHeader, NewEvents, StarkNetEvent
+
+from isaac_api import indexer
+
+UNIVERSE = bytes.fromhex(indexer.ISAAC_UNIVERSE_ADDRESSES[0][2:])
+LOBBY = bytes.fromhex(indexer.ISAAC_LOBBY_ADDRESS[2:])
+
+
+def event(name, address, *values):
+    return StarkNetEvent(name=name, address=address, log_index=0, topics=[], data=[v.to_bytes(32, 'big') for v in values])
+
+
+def give(counter, account, device_type, amount):
+    return event('give_undeployed_fungible_device_occurred', UNIVERSE, counter, account, device_type, amount)
+
+
+def block_header(number, hash=None):
+    return BlockHeader(hash=bytes([number % 256]) if hash is None else hash, parent_hash=None, number=number, timestamp=None)
+
+
+def prepare_context(db, **kwargs):
+    # mongomock cannot explain queries
+    return indexer.prepare_context(db, check_plans=False, **kwargs)
+
+
+async def handle_block(db, context, number, events):
+    await indexer.handle_events(Info(context, None, Storage(db, number)), NewEvents(block=block_header(number), events=events))
+
+
+def handle(db, context, number, events):
+    asyncio.run(handle_block(db, context, number, events))
@@ -0,0 +1,26 @@
+from isaac_api.cache import BoundedLRU, UniverseStateCache
+
+
+def test_bounded_lru_evicts_least_recently_used():
+    lru = BoundedLRU(2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    assert lru.get('b') is None
+    assert (lru.hits, lru.misses, lru.evictions, len(lru)) == (1, 1, 1, 2)
+
+
+def test_deployed_cells_and_reset():
+    cache = UniverseStateCache(max_entries=10)
+    state = cache.universe(0)
+    state.put_deployed('7', '1', '14', {'x': 0, 'y': 0}, [{'x': 0, 'y': 0}, {'x': 0, 'y': 1}])
+    assert state.deployed_at({'x': 0, 'y': 1})[0] == '7'
+
+    state.remove_deployed('7')
+    assert state.deployed_at({'x': 0, 'y': 0}) is None
+
+    state.put_balance('1', {'account': '1', '12': 3, '_id': 'x'})
+    cache.reset_universe(0)
+    assert cache.universe(0).balances.get('1') is None
+    assert cache.stats()['balances']['misses'] == 1
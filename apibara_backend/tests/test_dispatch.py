@@ -0,0 +1,43 @@
+import pytest
+from apibara.model import StarkNetEvent
+
+from isaac_api import indexer
+from isaac_api.dispatch import LOBBY_PRIORITY, UNIVERSE_PRIORITY, EventRegistry, address_bytes
+
+
+def _event(name, address):
+    return StarkNetEvent(name=name, address=address, log_index=0, topics=[], data=[])
+
+
+def test_every_indexed_event_has_a_handler():
+    assert sorted(indexer.EVENTS.universe_handlers) == sorted(indexer.UNIVERSE_EVENT_LIST)
+    assert sorted(indexer.EVENTS.lobby_handlers) == sorted(indexer.LOBBY_EVENT_LIST)
+
+
+def test_routes_by_address_and_name():
+    dispatch = indexer.EVENTS.build(indexer.ISAAC_UNIVERSE_ADDRESSES, indexer.ISAAC_LOBBY_ADDRESS)
+    universe = address_bytes(indexer.ISAAC_UNIVERSE_ADDRESSES[0])
+    lobby = address_bytes(indexer.ISAAC_LOBBY_ADDRESS)
+
+    route = dispatch.route(_event('player_deploy_device_occurred', universe))
+    assert (route.univ, route.priority, route.handler) == (0, UNIVERSE_PRIORITY, indexer.handle_player_deploy_device_occurred)
+    route = dispatch.route(_event('ask_to_queue_occurred', lobby))
+    assert (route.univ, route.priority) == (None, LOBBY_PRIORITY)
+
+    # an address without its leading zero bytes routes the same
+    assert dispatch.route(_event('player_deploy_device_occurred', universe.lstrip(b'\0'))).univ == 0
+    assert dispatch.route(_event('ask_to_queue_occurred', universe)) is None
+    assert dispatch.route(_event('ask_to_queue_occurred', b'\1' * 32)) is None
+
+
+def test_register_checks_the_event():
+    events = EventRegistry()
+
+    @events.lobby('give_invitation_occurred')
+    async def handle(info, event, block_number):
+        pass
+
+    with pytest.raises(ValueError):
+        events.lobby('give_invitation_occurred')(handle)
+    with pytest.raises(ValueError):
+        events.universe('no_such_event')
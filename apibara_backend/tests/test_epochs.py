@@ -0,0 +1,44 @@
+import asyncio
+
+import mongomock
+
+from isaac_api.epochs import EPOCH_MODE, UniverseEpochs
+from isaac_api.footprint import DeployedDevices
+from isaac_api.unit_of_work import BlockUnitOfWork
+
+
+def test_collection_names_resolve_to_current_epoch():
+    assert UniverseEpochs().collection('u0_pgs') == 'u0_pgs'
+
+    epochs = UniverseEpochs(EPOCH_MODE, DeployedDevices('footprint'))
+    assert epochs.collection('u0_pgs') == 'u0_e0_pgs'
+    assert epochs.collection('u3_deployed_device_footprints') == 'u3_e0_deployed_device_footprints'
+    assert epochs.collection('u0_civ_state') == 'u0_civ_state'
+    assert epochs.collection('lobby_queue') == 'lobby_queue'
+
+
+def test_advance_moves_writes_and_drops_previous_epoch(monkeypatch):
+    # mongomock has no views
+    monkeypatch.setattr(UniverseEpochs, '_switch_views', lambda self, db, univ: None)
+    db = mongomock.MongoClient().db
+    epochs = UniverseEpochs(EPOCH_MODE)
+    epochs.load(db, [0])
+
+    async def block(block_number, advance):
+        uow = BlockUnitOfWork(db, block_number, resolve=epochs.collection)
+        await uow.insert_one('u0_pgs', {'id': str(block_number)})
+        if advance:
+            epochs.advance(uow, 0)
+        await uow.insert_one('u0_pgs', {'id': f'{block_number}+'})
+        await uow.commit()
+
+    asyncio.run(block(1, advance=False))
+    asyncio.run(block(2, advance=True))
+
+    assert 'u0_e0_pgs' not in db.list_collection_names()
+    assert [d['id'] for d in db.u0_e1_pgs.find()] == ['2+']
+    assert db.universe_epochs.find_one({'univ': 0})['epoch'] == 1
+
+    restarted = UniverseEpochs(EPOCH_MODE)
+    restarted.load(db, [0])
+    assert restarted.collection('u0_pgs') == 'u0_e1_pgs'
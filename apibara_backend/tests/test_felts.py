@@ -0,0 +1,57 @@
+import os
+import random
+from types import SimpleNamespace
+
+from apibara.starknet import get_selector_from_name
+
+from isaac_api import codegen, contract, decoders
+from isaac_api.felts import dynamics_to_json, extract_counter
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+P = contract.STARK_PRIME
+
+
+def _felt(value):
+    return (value % P).to_bytes(32, 'big')
+
+
+def _random_felt(rng):
+    return rng.choice([rng.randrange(0, 50), -rng.randrange(1, 50), rng.randrange(-10**22, 10**22), rng.randrange(0, P)])
+
+
+def _json(value):
+    if isinstance(value, (contract.Vec2, contract.Dynamics)):
+        return value.to_json()
+    if isinstance(value, tuple):
+        return tuple(_json(v) for v in value)
+    return value
+
+
+def test_decoders_match_contract_decoders():
+    rng = random.Random(7)
+    for _ in range(200):
+        values = [_random_felt(rng) for _ in range(20)]
+        values[3] = values[8] = rng.randrange(0, 5)      # array lengths of the lobby and utx events
+        data = [_felt(v) for v in values]
+        event = SimpleNamespace(data=data)
+
+        for name in decoders.DECODERS:
+            if name == 'forward_world_macro_occurred':
+                continue
+            expected = _json(getattr(contract, f'decode_{name}_event')(event))
+            assert decoders.DECODERS[name](data) == expected, name
+            assert decoders.DECODERS[name](b''.join(data)) == expected, name
+
+        dynamics, phi = contract.decode_forward_world_event(event)
+        flat, flat_phi = decoders.decode_forward_world_macro_occurred(data)
+        assert dynamics_to_json(flat) == dynamics.to_json() and flat_phi == phi
+        assert extract_counter(data) == extract_counter(b''.join(data)) == contract.extract_counter_from_event(event)
+
+
+def test_generated_decoders_are_up_to_date():
+    for name, preset in codegen.PRESETS.items():
+        with open(os.path.join(ROOT, preset.out)) as f:
+            assert f.read() == codegen.generate(preset.abis, preset.conventions, preset=name, root=ROOT), name
+    assert 'debug_emit_felt' not in decoders.DECODERS
+    assert decoders.DECODERS_BY_KEY[get_selector_from_name('ask_to_queue_occurred')] is decoders.decode_ask_to_queue_occurred
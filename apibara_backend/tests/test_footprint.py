@@ -0,0 +1,49 @@
+import asyncio
+
+import mongomock
+from apibara.indexer.storage import Storage
+
+from isaac_api.footprint import DeployedDevices, _cells_view_pipeline, cells_collection, footprints_collection
+
+DEVICES = [
+    ('0xaaa', '100', '3', [{'x': 5, 'y': 5}, {'x': 6, 'y': 5}], {'x': 5, 'y': 5}),
+    ('0xbbb', 'utx-1', '12', [{'x': 1, 'y': 2}, {'x': 2, 'y': 2}, {'x': 3, 'y': 2}], None),
+]
+
+
+def _deploy(db, deployed):
+    async def run():
+        for owner, device_id, device_type, cells, base_grid in DEVICES:
+            await deployed.insert(Storage(db, 100), 0, owner, device_id, device_type, cells, base_grid)
+
+    asyncio.run(run())
+
+
+def _view(db, filter):
+    # mongomock has no views: run the view's pipeline as the server does for a find on it
+    return list(db[footprints_collection(0)].aggregate(_cells_view_pipeline() + [{'$match': filter}]))
+
+
+def test_view_reads_like_the_cells_collection():
+    cells_db, footprint_db = mongomock.MongoClient().db, mongomock.MongoClient().db
+    _deploy(cells_db, DeployedDevices('cells'))
+    _deploy(footprint_db, DeployedDevices('footprint'))
+
+    def without_id(docs):
+        return sorted(({k: v for k, v in doc.items() if k != '_id'} for doc in docs), key=repr)
+
+    for filter in (
+        {'grid': {'x': 6, 'y': 5}, '_chain.valid_to': None},
+        {'id': 'utx-1', '_chain.valid_to': None},
+        {'owner': '0xaaa', '_chain.valid_to': None},
+    ):
+        expected = list(cells_db[cells_collection(0)].find(filter))
+        assert without_id(_view(footprint_db, filter)) == without_id(expected)
+
+    # every cell keeps an `_id` of its own, the same on every read
+    docs = _view(footprint_db, {'_chain.valid_to': None})
+    ids = [doc['_id'] for doc in docs]
+    assert len(docs) == 5 and len(set(ids)) == 5
+    assert ids == [doc['_id'] for doc in _view(footprint_db, {'_chain.valid_to': None})]
+    footprint = footprint_db[footprints_collection(0)].find_one({'id': 'utx-1'})
+    assert [doc['_id'] for doc in _view(footprint_db, {'id': 'utx-1'})] == [f"{footprint['_id']}:{n}" for n in range(3)]
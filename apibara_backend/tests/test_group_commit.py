@@ -0,0 +1,73 @@
+import asyncio
+
+import mongomock
+
+from isaac_api import indexer
+from isaac_api.group_commit import BLOCK_MODE, GROUP_MODE, GroupCommit
+from isaac_api.shards import PROGRESS_COLLECTION
+from tests.conftest import give, handle_block, prepare_context
+
+BLOCKS = [(100 + i, [give(2 * i, 0xaaa, 12, i + 1), give(2 * i + 1, 0xbbb, 13, 1)]) for i in range(7)]
+
+
+def _run(db, group, head_block):
+    context = prepare_context(db)
+    context.group = group
+    indexer.HEAD_BLOCK.set(head_block)
+
+    async def run():
+        for number, events in BLOCKS:
+            await handle_block(db, context, number, events)
+        return context
+
+    try:
+        return asyncio.run(run())
+    finally:
+        indexer.HEAD_BLOCK.set(0)
+
+
+def _history(db):
+    return sorted(
+        (doc['account'], doc['_chain']['valid_from'], doc['_chain']['valid_to'], doc.get('12'), doc.get('13'))
+        for doc in db.u0_player_fungible_balances.find()
+    )
+
+
+def test_update_mode():
+    group = GroupCommit(max_blocks=10, enter_lag=100, exit_lag=10)
+    assert not group.update_mode(None) and group.mode == BLOCK_MODE
+    assert not group.update_mode(50)
+    assert group.update_mode(101) and group.mode == GROUP_MODE
+    assert not group.update_mode(50)
+    assert group.update_mode(10) and group.mode == BLOCK_MODE
+    assert not GroupCommit(max_blocks=1).update_mode(1000)
+
+
+def test_group_commits_write_what_block_commits_write():
+    single = mongomock.MongoClient().db
+    _run(single, GroupCommit(), head_block=1000)
+
+    grouped = mongomock.MongoClient().db
+    commits = indexer.COMMIT_BLOCKS.count()
+    context = _run(grouped, GroupCommit(max_blocks=3, enter_lag=100), head_block=1000)
+    # blocks 100-102 and 103-105 are committed, 106 waits for its group
+    assert indexer.COMMIT_BLOCKS.count() == commits + 2
+    assert grouped[PROGRESS_COLLECTION].find_one({'_id': 'u0'})['block_number'] == 105
+    assert context.group.blocks == 1
+
+    asyncio.run(indexer.commit_group(context))
+    assert _history(grouped) == _history(single)
+    assert grouped[PROGRESS_COLLECTION].find_one({'_id': 'u0'})['block_number'] == 106
+
+
+def test_back_to_block_commits_near_the_head():
+    db = mongomock.MongoClient().db
+    # blocks 100-104 are more than 10 blocks behind the head, 105 and 106 within 10 blocks of it
+    switches = indexer.MODE_SWITCHES.value(mode=BLOCK_MODE)
+    commits = indexer.COMMIT_BLOCKS.count()
+    context = _run(db, GroupCommit(max_blocks=100, enter_lag=12, exit_lag=10), head_block=115)
+    assert context.group.mode == BLOCK_MODE and context.group.uow is None
+    assert indexer.MODE_SWITCHES.value(mode=BLOCK_MODE) == switches + 1
+    # 100-105 together, then 106
+    assert indexer.COMMIT_BLOCKS.count() == commits + 2
+    assert db[PROGRESS_COLLECTION].find_one({'_id': 'u0'})['block_number'] == 106
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import mongomock
+import pytest
+from apibara.indexer.runner import Info
+from apibara.model import EventFilter, NewEvents
+
+from isaac_api import indexer
+from isaac_api.host import HOST_PROGRESS_COLLECTION, IndexerHost, Plugin, PooledStorage
+from isaac_api.mongo import AsyncMongo
+from tests.conftest import UNIVERSE, block_header, event, prepare_context
+
+OTHER = bytes.fromhex('039d38747fb62279cb5266261b01dce9bf369b53fe422e89fcb8153891e301f9')
+
+
+def _handle(host, number, events):
+    asyncio.run(host.handle_events(Info(None, None, None), NewEvents(block=block_header(number), events=events)))
+
+
+def _host(client):
+    db = client.isaac
+    context = prepare_context(db)
+    isaac = Plugin('isaac', 'isaac', indexer.event_filters(), 100, indexer.handle_events, context=context)
+
+    handled = []
+
+    async def handle_other(info, block_events):
+        handled.append((block_events.block.number, [e.name for e in block_events.events]))
+        await info.storage.insert_one('puzzles', {'puzzle_id': block_events.block.number})
+
+    other = Plugin('other', 'other', [EventFilter.from_event_name('new_puzzle_occurred', OTHER)], 50, handle_other)
+    host = IndexerHost([isaac, other], AsyncMongo(client, max_workers=2).database('isaac'))
+    asyncio.run(host.load())
+    return host, handled
+
+
+def test_routes_each_event_to_its_plugin():
+    client = mongomock.MongoClient()
+    host, handled = _host(client)
+    assert len(host.filters()) == len(indexer.event_filters()) + 1
+    assert host.index_from_block() == 50
+
+    events = [
+        event('give_undeployed_fungible_device_occurred', UNIVERSE, 0, 0xaaa, 12, 10),
+        event('new_puzzle_occurred', OTHER.lstrip(b'\0'), 1, 0),
+    ]
+    _handle(host, 101, events)
+    assert handled == [(101, ['new_puzzle_occurred'])]
+    assert client.isaac.u0_player_fungible_balances.count_documents({}) == 1
+    assert client.other.puzzles.count_documents({}) == 1
+    assert {doc['_id']: doc['block_number'] for doc in client.isaac[HOST_PROGRESS_COLLECTION].find()} == {'isaac': 101, 'other': 101}
+
+    # a restarted host skips the blocks each plugin handled
+    host, handled = _host(client)
+    assert host.index_from_block() == 101
+    _handle(host, 101, events)
+    _handle(host, 102, events[1:])
+    assert handled == [(102, ['new_puzzle_occurred'])]
+    assert client.isaac.u0_player_fungible_balances.count_documents({}) == 1
+
+
+def test_a_contract_belongs_to_one_plugin():
+    filters = [EventFilter.from_event_name('new_puzzle_occurred', OTHER)]
+    plugins = [Plugin('a', 'a', filters, 0, None), Plugin('b', 'b', filters, 0, None)]
+    with pytest.raises(ValueError):
+        IndexerHost(plugins, AsyncMongo(mongomock.MongoClient(), max_workers=1).database('db'))
+
+
+def test_plugin_storage_runs_on_the_pool(monkeypatch):
+    db = AsyncMongo(mongomock.MongoClient(), max_workers=1).database('other')
+    storage = PooledStorage(db, 101)
+    threads = []
+    find_one_and_update = mongomock.collection.Collection.find_one_and_update
+
+    def recorded(self, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return find_one_and_update(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'find_one_and_update', recorded)
+
+    async def run():
+        await storage.insert_one('puzzles', {'puzzle_id': 1, 'solved': False})
+        return await storage.find_one_and_update('puzzles', {'puzzle_id': 1}, {'$set': {'solved': True}})
+
+    assert asyncio.run(run())['solved'] is False
+    assert threads and all(name.startswith('isaac-mongo') for name in threads)
+    # chain-aware as apibara's Storage: the old version ends where the new one starts
+    docs = sorted(db.db.puzzles.find({}, {'_id': 0}), key=lambda doc: doc['_chain']['valid_to'] is None)
+    assert [(doc['solved'], doc['_chain']) for doc in docs] == [
+        (False, {'valid_from': 101, 'valid_to': 101}),
+        (True, {'valid_from': 101, 'valid_to': None}),
+    ]
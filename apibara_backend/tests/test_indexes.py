@@ -0,0 +1,27 @@
+import mongomock
+
+from isaac_api.footprint import DeployedDevices
+from isaac_api.indexes import _plan_stages, canonical_queries, ensure_indexes, universe_indexes
+
+
+def test_ensure_indexes_creates_only_missing():
+    db = mongomock.MongoClient().db
+    deployed = DeployedDevices()
+    created = ensure_indexes(db, [0], deployed)
+    assert 'u0_player_fungible_balances.account_1__chain.valid_to_1' in created
+    assert 'lobby_queue.account_1_expired_1__chain.valid_to_1' in created
+    assert ensure_indexes(db, [0], deployed) == []
+
+
+def test_canonical_queries_lead_with_an_index_prefix():
+    for deployed in (DeployedDevices('cells'), DeployedDevices('footprint')):
+        indexes = universe_indexes(0, deployed)
+        for query in canonical_queries(0, deployed):
+            leading = [[k for k, _ in m.document['key'].items()][0] for m in indexes[query.collection]]
+            assert any(f in leading for f in list(query.filter) + ['_chain.valid_to']), query
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {'stage': 'LIMIT', 'inputStage': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}
+    assert list(_plan_stages(plan)) == ['LIMIT', 'FETCH', 'IXSCAN']
+    assert 'COLLSCAN' in _plan_stages({'stage': 'SUBPLAN', 'inputStages': [{'stage': 'COLLSCAN'}]})
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import urllib.request
+
+from isaac_api import codegen
+from isaac_api.instrumentation import COUNT_BUCKETS, CountingStorage, EventLog, Registry, serve
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+def test_histogram_buckets_and_render():
+    registry = Registry()
+    latency = registry.histogram('handler_seconds', 'Handler latency.', ['event'], buckets=(0.001, 0.01))
+    requests = registry.histogram('block_requests', 'Requests per block.', buckets=COUNT_BUCKETS)
+    lag = registry.gauge('lag_blocks', 'Blocks behind the head.')
+    for value in (0.0005, 0.0005, 0.005, 0.5):
+        latency.observe(value, event='transfer')
+    requests.observe(0)
+    lag.set(3)
+
+    assert latency.count(event='transfer') == 4
+    assert latency.quantile(0.5, event='transfer') == 0.001
+    assert latency.quantile(0.99, event='transfer') == float('inf')
+    assert requests.quantile(0.5) == 0
+
+    text = registry.render()
+    assert 'handler_seconds_bucket{event="transfer",le="0.001"} 2' in text
+    assert 'handler_seconds_bucket{event="transfer",le="+Inf"} 4' in text
+    assert 'handler_seconds_count{event="transfer"} 4' in text
+    assert 'block_requests_bucket{le="0"} 1' in text
+    assert 'lag_blocks 3' in text
+
+    server = serve(0, registry=registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode() == registry.render()
+    finally:
+        server.shutdown()
+
+
+def test_event_log_sampling(caplog):
+    logger = logging.getLogger('isaac_api.test_instrumentation')
+    trace = EventLog(logger, sample=0)
+    with caplog.at_level(logging.DEBUG, logger=logger.name):
+        assert not trace.begin()
+        trace('skipped %s', 1)
+        trace.sample = 1
+        assert trace.begin()
+        trace('kept %s', 2)
+    assert [r.getMessage() for r in caplog.records] == ['kept 2']
+
+    # below DEBUG nothing is sampled
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        assert not trace.begin()
+
+
+def test_counting_storage_counts_coroutine_calls():
+    class Storage:
+        block_number = 7
+
+        async def insert_one(self, collection, doc):
+            return doc
+
+    storage = CountingStorage(Storage())
+    asyncio.run(storage.insert_one('c', {}))
+    asyncio.run(storage.insert_one('c', {}))
+    assert storage.block_number == 7
+    assert dict(storage.ops) == {'insert_one': 2}
+
+
+def test_vendored_copies_are_up_to_date():
+    for source, copies in codegen.VENDORED.items():
+        for copy in copies:
+            with open(os.path.join(ROOT, copy)) as f:
+                assert f.read() == codegen.vendored_source(source, ROOT), copy
@@ -0,0 +1,117 @@
+import mongomock
+
+from isaac_api import indexer
+from isaac_api.inventory import build_inventories, inventories_collection
+from tests.conftest import LOBBY, UNIVERSE, event, handle, prepare_context
+
+A, B = 0xAAA, 0xBBB
+
+
+class _Events:
+    def __init__(self):
+        self.counter = 0
+
+    def __call__(self, name, *values, address=UNIVERSE):
+        self.counter += 1
+        return event(name, address, self.counter, *values)
+
+
+def _blocks():
+    e = _Events()
+    return [
+        [
+            e('give_undeployed_fungible_device_occurred', A, 12, 10),
+            e('give_undeployed_fungible_device_occurred', B, 12, 5),
+            e('create_new_nonfungible_device_occurred', A, 3, 100),
+            e('create_new_nonfungible_device_occurred', A, 8, 101),
+            e('universe_activation_occurred', 777, 1, 2, A, B, address=LOBBY),
+        ],
+        [
+            e('player_deploy_device_occurred', A, 100, 5, 5),
+            e('player_deploy_device_occurred', A, 101, 10, 10),
+            e('player_deploy_utx_occurred', A, 500, 12, 5, 5, 10, 10, 3, 6, 5, 7, 5, 8, 5),
+            e('resource_update_at_harvester_occurred', 100, 4),
+            e('resource_update_at_harvester_occurred', 100, 6),
+            e('resource_update_at_transformer_occurred', 101, 1, 2),
+            e('energy_update_at_device_occurred', 100, 7),
+        ],
+        [
+            e('player_pickup_utx_occurred', A, 6, 5),
+            e('player_pickup_device_occurred', A, 101, 10, 10),
+            e('player_transfer_undeployed_fungible_device_occurred', A, B, 12, 2),
+            e('player_transfer_undeployed_nonfungible_device_occurred', A, B, 101),
+            e('player_upsf_build_fungible_device_occurred', B, 0, 0, 13, 4),
+        ],
+    ]
+
+
+def _run(db, blocks, start=100):
+    context = prepare_context(db)
+    for number, events in enumerate(blocks, start):
+        handle(db, context, number, events)
+    return context
+
+
+def _inventories(db):
+    return {
+        doc['account']: {k: v for k, v in doc.items() if k not in ('_id', '_chain', 'block_number')}
+        for doc in db[inventories_collection(0)].find({'_chain.valid_to': None})
+    }
+
+
+def test_inventory_follows_the_handlers():
+    db = mongomock.MongoClient().db
+    blocks = _blocks()
+
+    context = _run(db, blocks[:2])
+    a = _inventories(db)[str(A)]
+    assert a['player_index'] == 0
+    assert a['balances']['12'] == 7
+    assert a['devices']['100'] == {
+        'type': 3, 'is_deployed': True, 'base_grid': {'x': 5, 'y': 5}, 'resource': 6, 'energy': 7,
+    }
+    assert a['devices']['101']['resource_pre'] == 1 and a['devices']['101']['resource_post'] == 2
+    assert a['utx_sets'] == {'500': {'type': '12', 'cells': [{'x': 6, 'y': 5}, {'x': 7, 'y': 5}, {'x': 8, 'y': 5}]}}
+    # one version per account and block
+    assert db[inventories_collection(0)].count_documents({'account': str(A)}) == 2
+
+    _run(db, blocks[2:], start=102)
+    inventories = _inventories(db)
+    a, b = inventories[str(A)], inventories[str(B)]
+    assert a['balances']['12'] == 8 and a['utx_sets'] == {}
+    assert set(a['devices']) == {'100'}
+    assert b['balances']['12'] == 7 and b['balances']['13'] == 4
+    assert b['devices']['101'] == {
+        'type': 8, 'is_deployed': False, 'base_grid': None, 'resource_pre': 1, 'resource_post': 2, 'energy': 0,
+    }
+
+    # the aggregate is the join of the source collections
+    built = build_inventories(db, 0, context.deployed, indexer.DEVICE_TYPE_COUNT)
+    assert inventories == {
+        account: {k: v for k, v in doc.items() if k != 'block_number'} for account, doc in built.items()
+    }
+
+
+def test_backfill_writes_the_missing_inventories():
+    db = mongomock.MongoClient().db
+    _run(db, _blocks())
+    indexed = _inventories(db)
+    db[inventories_collection(0)].delete_many({'account': str(B)})
+
+    prepare_context(db)
+    assert _inventories(db) == indexed
+    assert db[inventories_collection(0)].count_documents({'account': str(A)}) == 3
+
+
+def test_pickup_of_nothing_is_ignored():
+    db = mongomock.MongoClient().db
+    blocks = _blocks()
+    _run(db, blocks[:2])
+    before = _inventories(db)
+
+    e = _Events()
+    e.counter = 100
+    # B has nothing at (5, 5) and nothing is deployed at (0, 0)
+    _run(db, [[e('player_pickup_device_occurred', B, 100, 5, 5), e('player_pickup_device_occurred', A, 100, 0, 0)]], start=102)
+    assert _inventories(db) == before
+    assert db['u0_player_nonfungible_devices'].find_one({'id': '100', '_chain.valid_to': None})['is_deployed']
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from isaac_api.push import Message, PushHub, coalesce
+from isaac_api.views import BlockChanges
+
+
+def _put(block, doc_id, value):
+    return {'block': block, 'op': 'put', 'doc': {'_id': doc_id, 'energy': value}}
+
+
+def _remove(block, doc_id):
+    return {'block': block, 'op': 'remove', 'id': doc_id}
+
+
+def test_coalesce_cancels_transient_documents():
+    messages = [
+        Message(0, 11, 10, {'pgs': [_remove(11, 'a'), _put(11, 'b', 1)]}),
+        Message(0, 12, 11, {'pgs': [_remove(12, 'b'), _put(12, 'c', 2)], 'macro_states': [_put(12, 'm', 0)]}),
+    ]
+    coalesced = coalesce(messages, max_changes=10)
+    assert (coalesced.since, coalesced.block) == (10, 12)
+    assert coalesced.views == {'pgs': [_remove(11, 'a'), _put(12, 'c', 2)], 'macro_states': [_put(12, 'm', 0)]}
+    assert json.loads(coalesced.encode(frozenset(['macro_states'])))['views'] == {'macro_states': [_put(12, 'm', 0)]}
+
+    assert coalesce(messages, max_changes=2).resync
+    assert coalesce(messages + [Message(0, 13)], max_changes=10).resync
+
+
+def test_slow_subscriber_is_coalesced():
+    hub = PushHub(max_pending=2)
+    received = []
+    release = asyncio.Event()
+
+    async def slow_send(encoded):
+        await release.wait()
+        received.append(json.loads(encoded))
+
+    fast_received = []
+
+    async def scenario():
+        subscriber = hub.subscribe(0, slow_send)
+        fast = hub.subscribe(0, _collect(fast_received))
+        tasks = [asyncio.ensure_future(s.run()) for s in (subscriber, fast)]
+        for block in range(1, 6):
+            hub.publish(BlockChanges(block, block - 1, {0: {'pgs': [_put(block, str(block), block)]}}, set()))
+            await asyncio.sleep(0)
+        release.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        return subscriber
+
+    subscriber = asyncio.run(scenario())
+    assert [m['block'] for m in fast_received] == [1, 2, 3, 4, 5]
+    # the first message was being sent; the four queued behind it were merged
+    assert subscriber.coalesced >= 1
+    assert received[0]['block'] == 1
+    assert received[-1]['block'] == 5
+    assert [c['doc']['_id'] for m in received for c in m['views']['pgs']] == ['1', '2', '3', '4', '5']
+
+
+def _collect(received):
+    async def send(encoded):
+        received.append(json.loads(encoded))
+    return send
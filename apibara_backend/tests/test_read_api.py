@@ -0,0 +1,80 @@
+import asyncio
+
+import mongomock
+from aiohttp.test_utils import TestClient, TestServer
+
+from isaac_api import read_api
+from isaac_api.views import MaterializedViews
+from tests.conftest import give, handle_block, prepare_context
+
+
+def test_snapshots_and_changes():
+    db = mongomock.MongoClient().db
+    views = MaterializedViews(retention_blocks=2)
+    context = prepare_context(db, views=views)
+
+    async def scenario():
+        client = TestClient(TestServer(read_api.create_app(views)))
+        await client.start_server()
+        try:
+            await handle_block(db, context, 100, [give(0, 0xaaa, 12, 1), give(1, 0xbbb, 12, 5)])
+            response = await client.get('/universes/0/player_fungible_balances')
+            snapshot = await response.json()
+            etag = response.headers['ETag']
+            assert snapshot['block'] == 100
+            assert sorted(doc['12'] for doc in snapshot['docs']) == [1, 5]
+
+            response = await client.get('/universes/0/player_fungible_balances', headers={'If-None-Match': etag})
+            assert response.status == 304
+
+            response = await client.get('/universes/0/player_fungible_balances', params={'account': str(0xbbb)})
+            assert [doc['12'] for doc in (await response.json())['docs']] == [5]
+
+            await handle_block(db, context, 101, [give(2, 0xaaa, 12, 2)])
+            response = await client.get('/universes/0/player_fungible_balances', headers={'If-None-Match': etag})
+            assert response.status == 200
+
+            changes = (await (await client.get('/universes/0/player_fungible_balances/changes', params={'since': 100})).json())
+            assert changes['block'] == 101
+            assert [c['op'] for c in changes['changes']] == ['remove', 'put']
+            assert changes['changes'][1]['doc']['12'] == 3
+            current = {doc['_id'] for doc in snapshot['docs']} - {changes['changes'][0]['id']} | {changes['changes'][1]['doc']['_id']}
+            response = await client.get('/universes/0/player_fungible_balances')
+            assert current == {doc['_id'] for doc in (await response.json())['docs']}
+
+            # only the changes of the last two blocks are held
+            await handle_block(db, context, 102, [])
+            await handle_block(db, context, 103, [])
+            response = await client.get('/universes/0/player_fungible_balances/changes', params={'since': 100})
+            assert response.status == 410
+            response = await client.get('/universes/0/player_fungible_balances/changes', params={'since': 101})
+            assert (await response.json())['changes'] == []
+
+            assert (await client.get('/universes/0/no_such_view')).status == 404
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_websocket_push():
+    db = mongomock.MongoClient().db
+    views = MaterializedViews()
+    context = prepare_context(db, views=views)
+
+    async def scenario():
+        client = TestClient(TestServer(read_api.create_app(views)))
+        await client.start_server()
+        try:
+            ws = await client.ws_connect('/universes/0/ws', params={'views': 'player_fungible_balances'})
+            await handle_block(db, context, 100, [give(0, 0xaaa, 12, 1)])
+            message = await ws.receive_json(timeout=5)
+            await ws.close()
+        finally:
+            await client.close()
+        return message
+
+    message = asyncio.run(scenario())
+    assert (message['type'], message['univ'], message['block']) == ('changes', 0, 100)
+    assert [c['op'] for c in message['views']['player_fungible_balances']] == ['put']
+
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime, timezone
+
+from apibara.model import BlockHeader, NewEvents, StarkNetEvent
+
+from isaac_api.decoders import decode_give_undeployed_fungible_device_occurred
+from isaac_api.recording import RecordingReader, RecordingWriter
+
+ADDRESS = bytes.fromhex('0666e03798f67a4579e6a211a9eb1b11d58e159fd11adbe275d600a08506c1b8')
+
+
+def _block(number, events=2):
+    header = BlockHeader(
+        hash=number.to_bytes(32, 'big'),
+        parent_hash=(number - 1).to_bytes(32, 'big'),
+        number=number,
+        timestamp=datetime(2022, 11, 1, tzinfo=timezone.utc),
+    )
+    return NewEvents(block=header, events=[
+        StarkNetEvent(
+            name='give_undeployed_fungible_device_occurred',
+            address=ADDRESS,
+            log_index=i,
+            topics=[],
+            data=[v.to_bytes(32, 'big') for v in (i, 0xaaa, 12, number)],
+        )
+        for i in range(events)
+    ])
+
+
+def test_segments_ranges_and_recovery(tmp_path):
+    directory = str(tmp_path)
+    writer = RecordingWriter(directory, segment_bytes=600)
+    for number in range(10, 20):
+        writer.append(_block(number))
+    writer.close()
+    assert len([name for name in os.listdir(directory) if name.endswith('.seg')]) > 1
+
+    reader = RecordingReader(directory)
+    blocks = list(reader.blocks())
+    assert [b.block.number for b in blocks] == list(range(10, 20))
+    assert blocks[0].block == _block(10).block
+    assert [b.block.number for b in reader.blocks(after=13, until=16)] == [14, 15, 16]
+
+    events = list(reader.events(after=17))
+    assert [(e.block_number, e.event.log_index) for e in events] == [(18, 0), (18, 1), (19, 0), (19, 1)]
+    assert decode_give_undeployed_fungible_device_occurred(events[-1].event.data) == (1, 0xaaa, 12, 19)
+    # the data is read in place from the mapped segment
+    assert isinstance(events[-1].event.data, memoryview) and events[-1].event.data.nbytes == 4 * 32
+
+    # a record written without its index entry is dropped on reopen
+    last = sorted(name for name in os.listdir(directory) if name.endswith('.seg'))[-1]
+    with open(os.path.join(directory, last), 'ab') as segment:
+        segment.write(b'partial record')
+    writer = RecordingWriter(directory, segment_bytes=600)
+    assert writer.last_block == 19
+    writer.append(_block(20))
+    writer.close()
+    assert [b.block.number for b in RecordingReader(directory).blocks(after=18)] == [19, 20]
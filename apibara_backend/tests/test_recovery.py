@@ -0,0 +1,136 @@
+import asyncio
+
+import mongomock
+import pytest
+from pymongo import UpdateOne
+
+from isaac_api.epochs import EPOCH_MODE, UniverseEpochs
+from isaac_api.felts import dynamics_to_json
+from isaac_api.recovery import recover
+from isaac_api.shards import PROGRESS_COLLECTION, ShardState
+from isaac_api.trajectory import MacroTrajectory, read_trajectory, row_from_dynamics
+from isaac_api.unit_of_work import BlockUnitOfWork
+from tests.conftest import give, handle, prepare_context
+
+BLOCKS = [
+    (100, [give(0, 0xaaa, 12, 10)]),
+    (101, [give(1, 0xaaa, 12, 5), give(2, 0xbbb, 13, 1)]),
+]
+
+
+def _balances(db):
+    return sorted(
+        (doc['account'], doc['_chain']['valid_from'], doc['_chain']['valid_to'], doc.get('12'), doc.get('13'))
+        for doc in db.u0_player_fungible_balances.find()
+    )
+
+
+def test_restart_after_a_crash_mid_commit_resumes_from_the_last_committed_block(monkeypatch):
+    clean = mongomock.MongoClient().db
+    context = prepare_context(clean)
+    for number, events in BLOCKS:
+        handle(clean, context, number, events)
+
+    db = mongomock.MongoClient().db
+    context = prepare_context(db)
+    handle(db, context, *BLOCKS[0])
+
+    # the documents of block 101 are written, then the process dies before its progress is
+    write = BlockUnitOfWork._write
+
+    async def crash(self, batches):
+        if any(collection == PROGRESS_COLLECTION for collection, _ in batches):
+            raise RuntimeError('killed')
+        await write(self, batches)
+
+    monkeypatch.setattr(BlockUnitOfWork, '_write', crash)
+    with pytest.raises(RuntimeError):
+        handle(db, context, *BLOCKS[1])
+    monkeypatch.setattr(BlockUnitOfWork, '_write', write)
+    assert db[PROGRESS_COLLECTION].find_one({'_id': 'u0'})['block_number'] == 100
+
+    # Apibara delivers block 101 again to the restarted process
+    context = prepare_context(db)
+    assert context.shard.start_block(0) == 100
+    handle(db, context, *BLOCKS[1])
+    assert _balances(db) == _balances(clean)
+
+    # and a block delivered twice is written once
+    handle(db, context, *BLOCKS[1])
+    assert _balances(db) == _balances(clean)
+
+
+def test_recover_reverts_an_epoch_advanced_by_an_uncommitted_block():
+    db = mongomock.MongoClient().db
+    db[PROGRESS_COLLECTION].insert_many([{'_id': 'u0', 'block_number': 100}, {'_id': 'lobby', 'block_number': 100}])
+    db.universe_epochs.insert_one({'univ': 0, 'epoch': 1, 'block_number': 101})
+    db.u0_e0_pgs.insert_one({'id': '1', '_chain': {'valid_from': 90, 'valid_to': 101}})
+    db.u0_e1_pgs.insert_one({'id': '2', '_chain': {'valid_from': 101, 'valid_to': None}})
+    db.u0_e1_macro_trajectory.insert_one({'bucket': 0, 'block_numbers': [101]})
+    db.lobby_queue.insert_one({'account': '1', '_chain': {'valid_from': 101, 'valid_to': None}})
+
+    shard = ShardState(universes=[0])
+    shard.load(db)
+    stats = recover(db, shard, UniverseEpochs(EPOCH_MODE))
+
+    assert stats.epochs == {0: 0}
+    assert db.universe_epochs.find_one({'univ': 0})['epoch'] == 0
+    assert db.u0_e0_pgs.find_one()['_chain']['valid_to'] is None
+    # the reverted epoch's collections are dropped, including those outside chain versioning
+    assert not [name for name in db.list_collection_names() if name.startswith('u0_e1_')]
+    assert db.lobby_queue.count_documents({}) == 0
+
+
+def _forward(db, trajectory, block_number, reset=False, progress=True):
+    async def block():
+        uow = BlockUnitOfWork(db, block_number)
+        if reset:
+            await uow.delete_many('u0_macro_states', {})
+            trajectory.reset(uow, 0)
+        else:
+            dynamics = [float(block_number)] * 16
+            state = {'phi': (2 * 10**20).to_bytes(32, 'big'), 'dynamics': dynamics_to_json(dynamics), 'block_number': block_number}
+            await uow.insert_one('u0_macro_states', state)
+            await trajectory.append(uow, 0, block_number, row_from_dynamics(dynamics, 2 * 10**20))
+        if progress:
+            uow.queue_write(PROGRESS_COLLECTION, UpdateOne(
+                {'_id': 'u0'}, {'$set': {'block_number': block_number}}, upsert=True
+            ), last=True)
+        await uow.commit()
+
+    asyncio.run(block())
+
+
+def _recover(db):
+    shard = ShardState(universes=[0])
+    shard.load(db)
+    trajectory = MacroTrajectory(bucket_blocks=4)
+    stats = recover(db, shard, UniverseEpochs(), trajectory)
+    return stats, trajectory
+
+
+def test_recover_truncates_and_rebuilds_the_trajectory():
+    db = mongomock.MongoClient().db
+    trajectory = MacroTrajectory(bucket_blocks=4)
+    for number in range(1, 7):
+        _forward(db, trajectory, number)
+    committed = read_trajectory(db, 0, 0, 100)
+
+    # blocks appended by an uncommitted block are truncated, and appends continue the open bucket
+    _forward(db, trajectory, 7, progress=False)
+    _forward(db, trajectory, 8, progress=False)
+    stats, trajectory = _recover(db)
+    assert stats.trajectory_blocks == 2
+    assert read_trajectory(db, 0, 0, 100) == committed
+    _forward(db, trajectory, 7)
+    assert list(read_trajectory(db, 0, 0, 100).block_numbers) == [1, 2, 3, 4, 5, 6, 7]
+
+    # a reset of an uncommitted block is undone from the macro states
+    _forward(db, trajectory, 8, reset=True, progress=False)
+    assert db.u0_macro_trajectory.count_documents({}) == 0
+    stats, trajectory = _recover(db)
+    assert stats.trajectory_blocks == 7
+    rebuilt = read_trajectory(db, 0, 0, 100)
+    assert list(rebuilt.block_numbers) == [1, 2, 3, 4, 5, 6, 7]
+    assert list(rebuilt.column('planet_q_x')) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+    assert list(rebuilt.column('phi')) == [2.0] * 7
@@ -0,0 +1,75 @@
+import asyncio
+
+import mongomock
+from apibara.model import NewEvents
+
+from isaac_api import replay
+from isaac_api.epochs import UniverseEpochs
+from isaac_api.recording import RecordingWriter, read_blocks
+from isaac_api.replay import replay_recording, resume_point
+from isaac_api.unit_of_work import BlockUnitOfWork
+from tests.conftest import block_header, give, prepare_context
+
+
+def _record(path):
+    writer = RecordingWriter(str(path), segment_bytes=200)
+    for i in range(4):
+        writer.append(NewEvents(block=block_header(100 + i), events=[give(i, 0xaaa, 12, 1)]))
+    # a retried block is recorded once
+    writer.append(NewEvents(block=block_header(101, hash=b''), events=[]))
+
+
+def _replay(db, path):
+    epochs = UniverseEpochs()
+    epochs.load(db, [0])
+    resumed_after = resume_point(db, [0], epochs)
+    return asyncio.run(replay_recording(db, str(path), prepare_context(db), resumed_after, checkpoint_blocks=2))
+
+
+def test_replay_resumes_from_checkpoint(tmp_path):
+    path = tmp_path / 'recording'
+    _record(path)
+    assert [b.block.number for b in read_blocks(str(path))] == [100, 101, 102, 103]
+    assert RecordingWriter(str(path)).last_block == 103
+
+    db = mongomock.MongoClient().db
+    stats = _replay(db, path)
+    assert (stats.blocks, stats.events) == (4, 4)
+    balance = db.u0_player_fungible_balances.find_one({'_chain.valid_to': None})
+    assert balance['12'] == 4
+
+    # blocks 102 and 103 were written but the last checkpoint is at 101
+    db.replay_checkpoints.update_one({}, {'$set': {'block_number': 101}})
+    stats = _replay(db, path)
+    assert (stats.resumed_after, stats.blocks) == (101, 2)
+    current = list(db.u0_player_fungible_balances.find({'_chain.valid_to': None}))
+    assert [doc['12'] for doc in current] == [4]
+    assert db.u0_player_fungible_balances.count_documents({}) == 4
+
+
+def test_replay_commits_in_groups_of_checkpoint_blocks(tmp_path, monkeypatch):
+    path = tmp_path / 'recording'
+    _record(path)
+    db = mongomock.MongoClient().db
+
+    committed, checkpoints = [], []
+    commit = BlockUnitOfWork.commit
+
+    async def counted_commit(self):
+        committed.append(self.block_number)
+        return await commit(self)
+
+    save = replay.save_checkpoint
+
+    def recorded_save(db, recording, block_number):
+        checkpoints.append(block_number)
+        save(db, recording, block_number)
+
+    monkeypatch.setattr(BlockUnitOfWork, 'commit', counted_commit)
+    monkeypatch.setattr(replay, 'save_checkpoint', recorded_save)
+    _replay(db, path)
+
+    # each checkpoint follows the commit of its group
+    assert committed == checkpoints == [101, 103]
+    assert db.u0_player_fungible_balances.find_one({'_chain.valid_to': None})['12'] == 4
+    assert db.u0_player_fungible_balances.count_documents({}) == 4
@@ -0,0 +1,83 @@
+import mongomock
+import pytest
+
+from isaac_api import indexer
+from isaac_api.shards import PROGRESS_COLLECTION, ShardRole, ShardState, parse_shards, shard_status
+from tests.conftest import LOBBY, UNIVERSE, event, handle, prepare_context
+
+
+def _blocks():
+    return [
+        (100, [event('ask_to_queue_occurred', LOBBY, 0, 0xaaa, 0), event('ask_to_queue_occurred', LOBBY, 1, 0xbbb, 1)]),
+        (101, [
+            event('give_undeployed_fungible_device_occurred', UNIVERSE, 0, 0xaaa, 12, 10),
+            event('give_undeployed_fungible_device_occurred', UNIVERSE, 1, 0xbbb, 12, 10),
+            event('universe_activation_occurred', LOBBY, 2, 777, 1, 2, 0xaaa, 0xbbb),
+        ]),
+    ]
+
+
+def _current(db, collection):
+    return sorted(
+        ({k: v for k, v in doc.items() if k not in ('_id', '_chain')} for doc in db[collection].find({'_chain.valid_to': None})),
+        key=repr,
+    )
+
+
+def _context(db, role):
+    return prepare_context(db, shard=ShardState(role, [0]))
+
+
+def test_parse_shards():
+    assert parse_shards('0,1; 2,3;') == [[0, 1], [2, 3]]
+    with pytest.raises(ValueError):
+        parse_shards('0,1;1')
+    with pytest.raises(ValueError):
+        parse_shards('0;,')
+
+
+def test_event_filters():
+    worker = ShardRole.worker('isaac', [0])
+    coordinator = ShardRole.coordinator('isaac')
+    assert (worker.indexer_id, coordinator.indexer_id) == ('isaac-u0', 'isaac-lobby')
+    assert len(indexer.event_filters(worker)) == len(indexer.UNIVERSE_EVENT_LIST) + 2
+    assert len(indexer.event_filters(coordinator)) == len(indexer.LOBBY_EVENT_LIST)
+    assert len(indexer.event_filters(ShardRole.worker('isaac', [1]))) == 2
+
+
+def test_shards_write_what_a_single_process_writes():
+    single = mongomock.MongoClient().db
+    context = prepare_context(single)
+    for number, events in _blocks():
+        handle(single, context, number, events)
+
+    # each process gets the events of its own filters
+    sharded = mongomock.MongoClient().db
+    worker = _context(sharded, ShardRole.worker('isaac', [0]))
+    coordinator = _context(sharded, ShardRole.coordinator('isaac'))
+    lobby_names = set(indexer.LOBBY_EVENT_LIST)
+    worker_names = set(indexer.UNIVERSE_EVENT_LIST + indexer.UNIVERSE_LOBBY_EVENT_LIST)
+    for number, events in _blocks():
+        handle(sharded, coordinator, number, [e for e in events if e.name in lobby_names])
+        handle(sharded, worker, number, [e for e in events if e.name in worker_names])
+
+    for collection in ('lobby_queue', 'u0_player_fungible_balances'):
+        assert _current(sharded, collection) == _current(single, collection)
+    assert {doc['_id']: doc['block_number'] for doc in sharded[PROGRESS_COLLECTION].find()} == {'u0': 101, 'lobby': 101}
+
+    # a block delivered again after a restart is skipped
+    handle(sharded, worker, 101, _blocks()[1][1])
+    assert _current(sharded, 'u0_player_fungible_balances') == _current(single, 'u0_player_fungible_balances')
+    restarted = _context(sharded, ShardRole.worker('isaac', [0]))
+    assert restarted.shard.start_block(0) == 101
+
+
+def test_shard_status():
+    db = mongomock.MongoClient().db
+    db[PROGRESS_COLLECTION].insert_many([
+        {'_id': 'u0', 'block_number': 90, 'head_block': 100},
+        {'_id': 'u1', 'block_number': 95, 'head_block': 100},
+        {'_id': 'lobby', 'block_number': 99, 'head_block': 100},
+    ])
+    rows = shard_status(db, [[0, 1], [2]])
+    assert [(row['shard'], row['block_number'], row['lag']) for row in rows] == [('0', 90, 10), ('1', None, None), ('lobby', 99, 1)]
@@ -0,0 +1,36 @@
+import asyncio
+
+import mongomock
+
+from isaac_api.trajectory import COLUMNS, MacroTrajectory, read_trajectory, row_from_dynamics
+from isaac_api.unit_of_work import BlockUnitOfWork
+
+
+def _dynamics(t):
+    return [t, -t, 0.5 * t, 1.0] * 4
+
+
+def test_append_seal_and_read_range():
+    db = mongomock.MongoClient().db
+    trajectory = MacroTrajectory(bucket_blocks=4)
+
+    async def forward(trajectory, blocks):
+        for block_number in blocks:
+            uow = BlockUnitOfWork(db, block_number)
+            await trajectory.append(uow, 0, block_number, row_from_dynamics(_dynamics(block_number), 3 * 10**20))
+            await uow.commit()
+
+    asyncio.run(forward(trajectory, [1, 2, 3, 5, 6, 6, 9]))
+    assert [d['sealed'] for d in db.u0_macro_trajectory.find(sort=[('bucket', 1)])] == [True, True, False]
+
+    # a restarted indexer continues the open bucket
+    restarted = MacroTrajectory(bucket_blocks=4)
+    restarted.warm(db, [0])
+    asyncio.run(forward(restarted, [9, 10]))
+
+    s = read_trajectory(db, 0, 2, 9)
+    assert list(s.block_numbers) == [2, 3, 5, 6, 9]
+    assert len(s.values) == len(COLUMNS) * len(s)
+    assert list(s.column('planet_q_x')) == [2.0, 3.0, 5.0, 6.0, 9.0]
+    assert list(s.column('phi')) == [3.0] * 5
+    assert memoryview(s.values).format == 'd'
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+
+import mongomock
+from pymongo import UpdateOne
+
+from isaac_api.mongo import CATCH_UP, LIVE, AsyncMongo
+from isaac_api.unit_of_work import BlockUnitOfWork, apply_update, matches
+
+
+def test_matches_equality_and_subdocument():
+    doc = {'id': '7', 'grid': {'x': 1, 'y': 2}, '_chain': {'valid_to': None}}
+    assert matches(doc, {'id': '7', 'grid': {'x': 1, 'y': 2}})
+    assert matches(doc, {'grid.x': 1, '_chain.valid_to': None})
+    assert not matches(doc, {'grid': {'x': 2, 'y': 2}})
+    assert not matches(doc, {'owner': '1'})
+
+
+def test_matches_operators_and_arrays():
+    doc = {'label': '5', 'cells': ['1:2', '1:3']}
+    assert matches(doc, {'label': {'$in': ['4', '5']}})
+    assert matches(doc, {'cells': '1:3'})
+    assert matches(doc, {'$or': [{'label': '9'}, {'cells': '1:2'}]})
+    assert not matches(doc, {'$nor': [{'label': '5'}]})
+
+
+def test_apply_update():
+    doc = {'account': '1', '12': 3, 'nested': {'a': 1}}
+    apply_update(doc, {'$inc': {'12': -2, '13': 4}, '$set': {'block_number': 9, 'nested.b': 2}})
+    assert doc == {'account': '1', '12': 1, '13': 4, 'block_number': 9, 'nested': {'a': 1, 'b': 2}}
+
+
+def test_concurrent_reads_see_block_writes():
+    db = mongomock.MongoClient().db
+    db.u0_pgs.insert_one({'id': '1', 'energy': 0, '_chain': {'valid_from': 1, 'valid_to': None}})
+    db.u1_pgs.insert_one({'id': '1', 'energy': 0, '_chain': {'valid_from': 1, 'valid_to': None}})
+
+    async def universe(uow, univ, energy):
+        await uow.find_one_and_update(f'u{univ}_pgs', {'id': '1'}, {'$set': {'energy': energy}})
+        return await uow.find_one(f'u{univ}_pgs', {'id': '1'})
+
+    async def block():
+        uow = BlockUnitOfWork(db, 2, concurrent_reads=True)
+        docs = await asyncio.gather(universe(uow, 0, 5), universe(uow, 1, 7))
+        await uow.commit()
+        return docs
+
+    assert [d['energy'] for d in asyncio.run(block())] == [5, 7]
+    assert db.u1_pgs.find_one({'_chain.valid_to': None})['energy'] == 7
+
+
+def test_coalesced_updates_match_sequential_updates():
+    def run(coalesce):
+        db = mongomock.MongoClient().db
+        db.u0_harvesters.insert_one({'id': '1', 'resource': 0, 'energy': 0, '_chain': {'valid_from': 1, 'valid_to': None}})
+
+        async def block():
+            uow = BlockUnitOfWork(db, 2)
+            update = uow.coalesce_update if coalesce else uow.find_one_and_update
+            await update('u0_harvesters', {'id': '1'}, {'$set': {'resource': 3}})
+            await update('u0_harvesters', {'id': '1'}, {'$set': {'energy': 5}})
+            await update('u0_harvesters', {'id': '2'}, {'$set': {'energy': 9}})
+            await update('u0_harvesters', {'id': '1'}, {'$set': {'resource': 4}})
+            # a device created in the block sees the updates issued before, not after
+            await uow.insert_one('u0_harvesters', {'id': '2', 'resource': 0, 'energy': 0})
+            await update('u0_harvesters', {'id': '2'}, {'$set': {'energy': 7}})
+            reads = uow.reads
+            await uow.commit()
+            return reads
+
+        reads = asyncio.run(block())
+        docs = sorted(db.u0_harvesters.find({'_chain.valid_to': None}, {'_id': 0, '_chain': 0}), key=lambda d: d['id'])
+        return docs, reads, db.u0_harvesters.count_documents({})
+
+    coalesced, reads, versions = run(coalesce=True)
+    assert coalesced == run(coalesce=False)[0]
+    assert coalesced == [{'id': '1', 'resource': 4, 'energy': 5}, {'id': '2', 'resource': 0, 'energy': 7}]
+    assert (reads, versions) == (2, 3)
+
+
+def test_pooled_commit_writes_last_requests_after_the_others():
+    client = mongomock.MongoClient()
+    db = client.db
+    db.u0_pgs.insert_one({'id': '1', 'energy': 0, '_chain': {'valid_from': 1, 'valid_to': None}})
+    mongo = AsyncMongo(client, max_workers=4)
+    written = []
+
+    class Recording:
+        # stands in for a collection, to see the order the batches are written in
+        def __init__(self, name):
+            self.name = name
+
+        def bulk_write(self, ops, ordered):
+            written.append(self.name)
+            return db[self.name].bulk_write(ops, ordered=ordered)
+
+    async def block():
+        uow = BlockUnitOfWork(db, 2, mongo=mongo, write_concern=mongo.write_concern(CATCH_UP))
+        uow._collection = Recording
+        uow.queue_write('progress', UpdateOne({'_id': 'u0'}, {'$set': {'block_number': 2}}, upsert=True), last=True)
+        await uow.find_one_and_update('u0_pgs', {'id': '1'}, {'$set': {'energy': 5}})
+        await uow.insert_one('u0_harvesters', {'id': '2'})
+        assert (await uow.find_one('u0_pgs', {'id': '1'}))['energy'] == 5
+        return await uow.commit()
+
+    try:
+        assert asyncio.run(block()) == 4
+    finally:
+        mongo.close()
+    assert written[-1] == 'progress' and sorted(written[:-1]) == ['u0_harvesters', 'u0_pgs']
+    assert db.u0_pgs.find_one({'_chain.valid_to': None})['energy'] == 5
+    assert mongo.write_concern(CATCH_UP).document == {'w': 1, 'j': False}
+    assert mongo.write_concern(LIVE).document == {'w': 'majority', 'j': True}
+
+
+def test_blocking_commit_callbacks_run_on_the_pool():
+    client = mongomock.MongoClient()
+    mongo = AsyncMongo(client, max_workers=2)
+    threads = []
+
+    async def block():
+        uow = BlockUnitOfWork(client.db, 2, mongo=mongo)
+        uow.on_commit(lambda: threads.append(('blocking', threading.current_thread().name)), blocking=True)
+        uow.on_commit(lambda: threads.append(('inline', threading.current_thread().name)))
+        await uow.commit()
+        return threading.current_thread().name
+
+    try:
+        loop_thread = asyncio.run(block())
+    finally:
+        mongo.close()
+    assert threads[0][0] == 'blocking' and threads[0][1].startswith('isaac-mongo')
+    assert threads[1] == ('inline', loop_thread)
+
+
+def test_advance_versions_documents_of_earlier_blocks():
+    db = mongomock.MongoClient().db
+
+    async def run():
+        uow = BlockUnitOfWork(db, 10)
+        await uow.insert_one('pgs', {'id': '1', 'energy': 0})
+        await uow.coalesce_update('pgs', {'id': '1'}, {'$set': {'energy': 1}})
+        await uow.advance(11)
+        await uow.find_one_and_update('pgs', {'id': '1'}, {'$set': {'energy': 2}})
+        await uow.update_many('pgs', {'id': '1'}, {'$set': {'energy': 3}})
+        await uow.advance(12)
+        await uow.update_many('pgs', {'id': '1'}, {'$set': {'energy': 4}})
+        await uow.commit()
+
+    asyncio.run(run())
+    versions = sorted((doc['_chain']['valid_from'], doc['_chain']['valid_to'], doc['energy']) for doc in db.pgs.find())
+    assert versions == [(10, 11, 1), (11, 12, 3), (12, None, 4)]
@@ -0,0 +1,59 @@
+"""Event decoders generated from `s2m2_abi.json` by `isaac_api.codegen`; do not edit
+
+Regenerate with `poetry run isaac gen-decoders --preset s2m2` after changing the contracts.
+"""
+
+from itertools import repeat
+from typing import Callable, Dict, List, Sequence, Union
+
+STARK_PRIME = 3618502788666131213697322783095070105623107215331596699973092056135872020481
+STARK_PRIME_HALF = 1809251394333065606848661391547535052811553607665798349986546028067936010240
+FELT_SIZE = 32
+SCALE_FP = 10**20
+
+Data = Union[Sequence[bytes], bytes, bytearray, memoryview]
+
+
+def _felts (data: Data) -> List[int]:
+    if isinstance (data, (bytes, bytearray, memoryview)):
+        view = memoryview (data)
+        return [int.from_bytes (view [i:i + FELT_SIZE], 'big') for i in range (0, len (view), FELT_SIZE)]
+    return list (map (int.from_bytes, data, repeat ('big')))
+
+
+def _s (v: int) -> int:
+    return v - STARK_PRIME if v > STARK_PRIME_HALF else v
+
+
+def _fp (v: int) -> float:
+    return (v - STARK_PRIME if v > STARK_PRIME_HALF else v) / SCALE_FP
+
+
+def decode_new_puzzle_occurred (data: Data):
+    v = _felts (data)
+    n_arr_circles = _s (v [1])
+    return _s (v [0]), n_arr_circles, [{'cell_index': _s (f0), 'type': _s (f1)} for f0, f1 in zip (v [2:2 + 2*n_arr_circles:2], v [3:3 + 2*n_arr_circles:2])]
+
+
+def decode_success_occurred (data: Data):
+    v = _felts (data)
+    n_arr_cell_indices = _s (v [2])
+    return v [0], _s (v [1]), n_arr_cell_indices, [_s (x) for x in v [3:3 + n_arr_cell_indices]]
+
+
+def decode_s2m_ended_occurred (data: Data):
+    return None
+
+
+DECODERS: Dict[str, Callable] = {
+    'new_puzzle_occurred': decode_new_puzzle_occurred,
+    'success_occurred': decode_success_occurred,
+    's2m_ended_occurred': decode_s2m_ended_occurred,
+}
+
+# event keys: the selector of the event name, as found in the first key of an event
+DECODERS_BY_KEY: Dict[int, Callable] = {
+    0x21f38ab34d2485d66261d84328596f7be10443889a07d6fb7d702b638e53f05: decode_new_puzzle_occurred,
+    0x35fb0d52127ebffe0b859b0b684d383f1d7f231efd94410e83c010252b7b473: decode_success_occurred,
+    0x9f0b762cd3c4acf9cd015f5e99c13d58d51155595ff710c8b4418aae736c78: decode_s2m_ended_occurred,
+}
@@ -3,6 +3,8 @@
 import os
 import sys
 import asyncio
+import logging
+import time
 from argparse import ArgumentParser
 from datetime import datetime
 
@@ -17,6 +19,7 @@ from s2m2_api.contract import (
     decode_new_puzzle_occurred,
     decode_success_occurred
 )
+from s2m2_api.instrumentation import REGISTRY, COUNT_BUCKETS, CountingStorage, EventLog, serve
 
 # load_dotenv()
 
@@ -24,25 +27,60 @@ ORIGIN_BLOCK_TO_INDEX = 279667 - 1
 INDEXER_ID = 's2m2'
 S2M2_ADDRESS = '0x039d38747fb62279cb5266261b01dce9bf369b53fe422e89fcb8153891e301f9'
 
+LOG_LEVEL = os.getenv ('S2M2_LOG_LEVEL', 'INFO').upper ()
+# fraction of the events whose handling is logged at DEBUG
+EVENT_LOG_SAMPLE = float (os.getenv ('S2M2_EVENT_LOG_SAMPLE', '1.0'))
+# serve Prometheus metrics on this port; 0 disables
+METRICS_PORT = int (os.getenv ('S2M2_METRICS_PORT', '0'))
+
+log = logging.getLogger ('s2m2_api.indexer')
+trace = EventLog (log, EVENT_LOG_SAMPLE)
+
+HANDLER_SECONDS = REGISTRY.histogram ('s2m2_handler_seconds', 'Time spent handling one event.', ['event'])
+BLOCK_SECONDS = REGISTRY.histogram ('s2m2_block_seconds', 'Time spent handling one block.')
+BLOCK_MONGO_OPS = REGISTRY.histogram ('s2m2_block_mongo_ops', 'Storage operations issued while handling one block.', buckets = COUNT_BUCKETS)
+MONGO_OPS = REGISTRY.counter ('s2m2_mongo_ops_total', 'Storage operations, by method.', ['op'])
+INDEXED_BLOCK = REGISTRY.gauge ('s2m2_indexed_block', 'Last block handled.')
+HEAD_BLOCK = REGISTRY.gauge ('s2m2_head_block', 'Latest block announced by the Apibara server.')
+BLOCK_LAG = REGISTRY.gauge ('s2m2_block_lag', 'Blocks between the head and the last block handled.')
+
+
 #
 # Handle events
 #
 async def handle_events(info: Info, block_events: NewEvents):
     block_number = block_events.block.number
-    print(f'> Block {block_number}')
+    log.info ('block %s: %s events', block_number, len (block_events.events))
+    start = time.perf_counter ()
 
+    storage = CountingStorage (info.storage)
+    info = Info (context = info.context, rpc_client = info.rpc_client, storage = storage)
     for event in block_events.events:
+        event_start = time.perf_counter ()
+        await handle_event (info, event)
+        HANDLER_SECONDS.observe (time.perf_counter () - event_start, event = event.name)
+
+    BLOCK_SECONDS.observe (time.perf_counter () - start)
+    BLOCK_MONGO_OPS.observe (sum (storage.ops.values ()))
+    for op, n in storage.ops.items ():
+        MONGO_OPS.inc (n, op = op)
+    INDEXED_BLOCK.set (block_number)
+    BLOCK_LAG.set (max (0, HEAD_BLOCK.value () - block_number))
+
+
+async def handle_event(info: Info, event):
+    if trace.begin ():
         from_adr = hex ( int.from_bytes(event.address, "big") )
-        print (f'  - got event: name={event.name}, address={from_adr}')
+        trace ('got event: name=%s, address=%s', event.name, from_adr)
 
-        if event.name == 'new_puzzle_occurred':
-            await handle_new_puzzle_occurred (info, event)
+    if event.name == 'new_puzzle_occurred':
+        await handle_new_puzzle_occurred (info, event)
 
-        elif event.name == 'success_occurred':
-            await handle_success_occurred (info, event)
+    elif event.name == 'success_occurred':
+        await handle_success_occurred (info, event)
 
-        elif event.name == 's2m_ended_occurred':
-            await handle_s2m_ended_occurred (info) # this event has no payload
+    elif event.name == 's2m_ended_occurred':
+        await handle_s2m_ended_occurred (info) # this event has no payload
 
 
 async def handle_new_puzzle_occurred(info, event):
@@ -72,7 +110,7 @@ async def handle_success_occurred(info, event):
     # Decode event
     #
     solver, puzzle_id, arr_cell_indices_len, arr_cell_indices = decode_success_occurred (event)
-    print (f'> success_occurred: solver={solver}, puzzle_id={puzzle_id}, arr_cell_indices_len={arr_cell_indices_len}, arr_cell_indices={arr_cell_indices}')
+    trace ('success_occurred: solver=%s, puzzle_id=%s, arr_cell_indices_len=%s, arr_cell_indices=%s', solver, puzzle_id, arr_cell_indices_len, arr_cell_indices)
 
     #
     # Update collection
@@ -110,17 +148,41 @@ async def handle_s2m_ended_occurred (info):
 # Handle block
 #
 async def handle_block (info: Info, block: NewBlock):
+    HEAD_BLOCK.set (block.new_head.number)
+    BLOCK_LAG.set (max (0, block.new_head.number - INDEXED_BLOCK.value ()))
+
     # Use the provided RPC client to fetch the current block data.
     # The client is already initialized with the correct network based
     # on the indexer's settings.
     block = await info.rpc_client.get_block_by_hash(block.new_head.hash)
     block_time = datetime.fromtimestamp(block['accepted_time'])
-    print(f'> new live block {block["block_number"]} at {block_time}')
+    log.info ('new live block %s at %s', block["block_number"], block_time)
 
 #
 # Main
 #
+def event_filters ():
+    return [
+        EventFilter.from_event_name (
+            name    = 'new_puzzle_occurred',
+            address = S2M2_ADDRESS.replace ('0x', '')
+        ),
+        EventFilter.from_event_name (
+            name    = 'success_occurred',
+            address = S2M2_ADDRESS.replace ('0x', '')
+        ),
+        EventFilter.from_event_name (
+            name    = 's2m_ended_occurred',
+            address = S2M2_ADDRESS.replace ('0x', '')
+        )
+    ]
+
+
 async def run_indexer (server_url=None, mongo_url=None, restart=None):
+    logging.basicConfig (level = LOG_LEVEL, format = '%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if METRICS_PORT:
+        serve (METRICS_PORT)
+        log.info ('serving metrics on port %s', METRICS_PORT)
 
     if restart:
         async with Client.connect(server_url) as client:
@@ -145,20 +207,7 @@ async def run_indexer (server_url=None, mongo_url=None, restart=None):
     # For now, this also helps the SDK map between human-readable
     # event names and StarkNet events.
     runner.create_if_not_exists(
-        filters=[
-            EventFilter.from_event_name (
-                name    = 'new_puzzle_occurred',
-                address = S2M2_ADDRESS.replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 'success_occurred',
-                address = S2M2_ADDRESS.replace ('0x', '')
-            ),
-            EventFilter.from_event_name (
-                name    = 's2m_ended_occurred',
-                address = S2M2_ADDRESS.replace ('0x', '')
-            )
-        ],
+        filters = event_filters (),
         index_from_block = ORIGIN_BLOCK_TO_INDEX
     )
 
@@ -1,5 +1,22 @@
-from s2m2_api import __version__
+import random
+from types import SimpleNamespace
+
+from s2m2_api import __version__, contract, decoders
 
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_generated_decoders_match_contract_decoders():
+    rng = random.Random(3)
+    for _ in range(100):
+        values = [rng.choice([rng.randrange(0, 50), -rng.randrange(1, 50), rng.randrange(0, contract.STARK_PRIME)]) for _ in range(12)]
+        values[1] = values[2] = rng.randrange(0, 5)      # array lengths
+        event = SimpleNamespace(data=[(v % contract.STARK_PRIME).to_bytes(32, 'big') for v in values])
+
+        puzzle_id, n, circles = contract.decode_new_puzzle_occurred(event)
+        assert decoders.decode_new_puzzle_occurred(event.data) == (
+            puzzle_id, n, [{'cell_index': c.cell_idx, 'type': c.typ} for c in circles]
+        )
+        assert decoders.decode_success_occurred(event.data) == contract.decode_success_occurred(event)
@@ -1,5 +1,6 @@
 import logging
 import os
+import time
 
 from apibara.indexer import IndexerRunner, IndexerRunnerConfiguration, Info
 from apibara.indexer.indexer import IndexerConfiguration
@@ -9,12 +10,18 @@ from apibara.starknet.cursor import starknet_cursor
 from apibara.starknet.proto.starknet_pb2 import Block, Event
 
 from indexer.contract import decode_sns_register_occurred
+from indexer.instrumentation import (
+    COUNT_BUCKETS,
+    REGISTRY,
+    CountingStorage,
+    EventLog,
+    serve,
+)
 
-# Print apibara logs
+# Print apibara logs, through the handler `run_indexer` configures
 root_logger = logging.getLogger("apibara")
 # change to `logging.DEBUG` to print more information
 root_logger.setLevel(logging.INFO)
-root_logger.addHandler(logging.StreamHandler())
 
 STARDISC_ADDR = felt.from_hex(
     "0x0367846f4e87762424244c9891a5db6c242b270632ff2d82bfe1ed0907dfddf5"
@@ -24,6 +31,36 @@ REGISTER_KEY = felt.from_hex(
 )
 BIRTH_BLOCK = 307_806  # deploy tx hash: 0x84f9a339eb3f94d30bd5e333e241721f22366ba999687a205ae9dd26a61936
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# fraction of the events whose handling is logged at DEBUG
+EVENT_LOG_SAMPLE = float(os.getenv("EVENT_LOG_SAMPLE", "1.0"))
+# serve Prometheus metrics on this port; 0 disables
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+log = logging.getLogger("indexer.indexer")
+trace = EventLog(log, EVENT_LOG_SAMPLE)
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "stardisc_handler_seconds", "Time spent handling one event.", ["event"]
+)
+BLOCK_SECONDS = REGISTRY.histogram(
+    "stardisc_block_seconds", "Time spent handling one block."
+)
+BLOCK_MONGO_OPS = REGISTRY.histogram(
+    "stardisc_block_mongo_ops",
+    "Storage operations issued while handling one block.",
+    buckets=COUNT_BUCKETS,
+)
+MONGO_OPS = REGISTRY.counter(
+    "stardisc_mongo_ops_total", "Storage operations, by method.", ["op"]
+)
+INDEXED_BLOCK = REGISTRY.gauge("stardisc_indexed_block", "Last block handled.")
+# the stream does not announce the head: how old the last block handled is
+# stands in for the lag
+BLOCK_AGE = REGISTRY.gauge(
+    "stardisc_block_age_seconds", "Age of the last block handled when it was handled."
+)
+
 
 class StardiscIndexer(StarkNetIndexer):
     def __init__(self, id: str):
@@ -45,14 +82,32 @@ class StardiscIndexer(StarkNetIndexer):
 
     async def handle_data(self, info: Info, data: Block):
         # Handle one block of data
+        block_number = data.header.block_number
+        INDEXED_BLOCK.set(block_number)
+        BLOCK_AGE.set(max(0, time.time() - data.header.timestamp.ToSeconds()))
         if not data.events:
             return
 
+        log.info("block %s: %s events", block_number, len(data.events))
+        start = time.perf_counter()
+        storage = CountingStorage(info.storage)
+        info = Info(context=info.context, storage=storage)
         for e in data.events:
+            event_start = time.perf_counter()
             await self.handle_sns_register_occurred(info, e.event)
+            HANDLER_SECONDS.observe(
+                time.perf_counter() - event_start, event="sns_register_occurred"
+            )
+
+        BLOCK_SECONDS.observe(time.perf_counter() - start)
+        BLOCK_MONGO_OPS.observe(sum(storage.ops.values()))
+        for op, n in storage.ops.items():
+            MONGO_OPS.inc(n, op=op)
 
     async def handle_sns_register_occurred(self, info: Info, event: Event):
         addr, name = decode_sns_register_occurred(event)
+        if trace.begin():
+            trace("sns_register_occurred: addr=%s, name=%s", addr, name)
         await info.storage.find_one_and_replace(
             collection="registry",
             filter={"addr": str(addr)},
@@ -65,7 +120,13 @@ class StardiscIndexer(StarkNetIndexer):
 
 
 async def run_indexer(server_url=None, mongo_url=None, restart=None):
-    print("Starting Apibara indexer")
+    logging.basicConfig(
+        level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+        log.info("serving metrics on port %s", METRICS_PORT)
+    log.info("Starting Apibara indexer")
 
     runner = IndexerRunner(
         config=IndexerRunnerConfiguration(